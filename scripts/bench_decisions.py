@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Decisions storage benchmark: JSONL file, binary file (DECISIONS_FORMAT=binary) and SQLite.
+
+Prefills a scratch directory with --n decisions spread over 30 days (fast bulk path, not
+timed), then times what the proxy and the API do against a store of that size: appending
+through decisions.append (until written), tail(50), the dry-run rollup for one day and
+for 30 days, and for SQLite the first and a deep /decisions/query page.
+
+    PYTHONPATH=. python scripts/bench_decisions.py --n 10000000 --backend sqlite
+
+For converting an existing log and its rates, see convert_decisions.py.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+RULES = [f"rule-{i}" for i in range(20)]
+ACTIONS = ("allow", "autocorrect", "block")
+DAY0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _record(i: int, n: int) -> dict:
+    ts = DAY0 + timedelta(seconds=i * (30 * 86400 / max(n, 1)))
+    return {
+        "ts": ts.isoformat(),
+        "spid": 50 + i % 200,
+        "action": ACTIONS[i % 3],
+        "rule_id": RULES[i % len(RULES)],
+        "column": f"dbo.T{i % 10}.C",
+        "reason": "benchmark",
+        "sample": "INSERT INTO dbo.T (C) VALUES ('x')",
+    }
+
+
+def _prefill(backend: str, n: int) -> None:
+    if backend == "sqlite":
+        from src.metrics import sqlite_store
+        conn = sqlite_store._connect(sqlite_store.db_path())
+        kept: dict = {}
+        for start in range(0, n, 20000):
+            sqlite_store._write_batch(conn, [("d", _record(i, n)) for i in range(start, min(n, start + 20000))], kept)
+        conn.close()
+        return
+    os.makedirs("data/metrics", exist_ok=True)
+    if backend == "binary":
+        from src.metrics import binlog
+        d = binlog.dictionary("data/metrics")
+        with open("data/metrics/decisions.bin", "wb") as f:
+            for i in range(n):
+                f.write(binlog.encode(_record(i, n), d))
+        return
+    with open("data/metrics/decisions.jsonl", "w", encoding="utf-8") as f:
+        for i in range(n):
+            f.write(json.dumps(_record(i, n)) + "\n")
+
+
+def _timed(fn, repeat: int = 5) -> float:
+    """Best of `repeat`, in ms."""
+    best = float("inf")
+    for _ in range(repeat):
+        s = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - s)
+    return best * 1000.0
+
+
+def bench(backend: str, n: int, appends: int) -> dict:
+    os.environ["DECISIONS_BACKEND"] = "sqlite" if backend == "sqlite" else "jsonl"
+    os.environ["DECISIONS_FORMAT"] = "binary" if backend == "binary" else "jsonl"
+    from src.metrics import decisions, rollups, sqlite_store
+    sqlite_store.reset()
+    rollups.reset()
+    out = {"backend": backend, "n": n}
+    s = time.perf_counter()
+    _prefill(backend, n)
+    out["prefill_s"] = round(time.perf_counter() - s, 1)
+    s = time.perf_counter()
+    rollups.query("2026-01-01")  # JSONL: first refresh reads the whole file once
+    out["rollup_first_ms"] = round((time.perf_counter() - s) * 1000.0, 1)
+    s = time.perf_counter()
+    for i in range(appends):
+        decisions.append({"spid": 99, "action": "block", "rule_id": "bench", "column": "dbo.X.Y", "sample": "x"})
+    sqlite_store.flush()
+    out["append_per_s"] = round(appends / (time.perf_counter() - s))
+    out["tail50_ms"] = round(_timed(lambda: decisions.tail(50)), 3)
+    out["rollup_day_ms"] = round(_timed(lambda: rollups.query("2026-01-15")), 3)
+    out["rollup_30d_ms"] = round(_timed(lambda: rollups.query("2026-01-01", "2026-01-30")), 3)
+    if backend == "sqlite":
+        out["query_first_page_ms"] = round(_timed(lambda: sqlite_store.query(rule="rule-3", column="dbo.T3.C", limit=100)), 3)
+        cursor = n // 2
+        out["query_deep_page_ms"] = round(_timed(lambda: sqlite_store.query(rule="rule-3", limit=100, cursor=cursor)), 3)
+        out["query_time_range_ms"] = round(_timed(lambda: sqlite_store.query(since="2026-01-10T00", until="2026-01-10T01", limit=100)), 3)
+        out["db_mb"] = round(os.path.getsize(sqlite_store.db_path()) / 1e6)
+        sqlite_store.reset()
+    else:
+        path = "data/metrics/decisions.bin" if backend == "binary" else "data/metrics/decisions.jsonl"
+        out["file_mb"] = round(os.path.getsize(path) / 1e6)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--n", type=int, default=10_000_000, help="decisions to prefill")
+    ap.add_argument("--appends", type=int, default=20000, help="decisions appended through decisions.append")
+    ap.add_argument("--backend", choices=("jsonl", "binary", "sqlite", "all"), default="all")
+    args = ap.parse_args()
+    backends = ("jsonl", "binary", "sqlite") if args.backend == "all" else (args.backend,)
+    cwd = os.getcwd()
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                print(json.dumps(bench(backend, args.n, args.appends)))
+            finally:
+                os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 """Tiny local benchmark for parser/encoder hot paths.
-Measures simple SQL parse and RPC payload build throughput.
+Measures simple SQL parse, RPC payload build, RPC request parse (regex vs token parser),
+bulk load row decoding throughput, the cost of per-stage timing and counter increments
+with the JSON file and shared-memory metrics backends.
 """
+import os
+import struct
+import tempfile
 import time
 from src.tds.sqlparse_simple import extract_values
 from src.tds.rpc_build import build_rpc_payload
+from src.tds.rpc_parse import extract_proc_and_params, parse_rpc_request
+from src.tds.bulk import BulkLoadDecoder
+from src.metrics import stage_timing
 
 
 def bench_parse(n=10000):
@@ -23,10 +31,129 @@ def bench_rpc(n=5000):
     return time.time() - s
 
 
+def _sample_rpc_request() -> bytes:
+    # sp_executesql (by ProcID) with a statement, declarations and two typed parameters
+    def nvarchar(name: str, value: str) -> bytes:
+        data = value.encode("utf-16le")
+        return bytes([len(name)]) + name.encode("utf-16le") + b"\x00\xe7\x40\x1f\x09\x04\xd0\x00\x34" + struct.pack("<H", len(data)) + data
+    out = b"\xff\xff\x0a\x00\x00\x00"
+    out += nvarchar("", "INSERT INTO dbo.Users (Email, Phone, Age) VALUES (@p0, @p1, @p2)")
+    out += nvarchar("", "@p0 nvarchar(4000),@p1 nvarchar(4000),@p2 int")
+    out += nvarchar("@p0", "'someone@example.com'")
+    out += nvarchar("@p1", "070-123 45 67")
+    out += b"\x03@\x00p\x002\x00\x00\x26\x04\x04" + struct.pack("<i", 42)
+    return out
+
+
+def bench_rpc_parse(n=20000):
+    payload = _sample_rpc_request()
+    s = time.time()
+    for _ in range(n):
+        extract_proc_and_params(payload)
+    t_regex = time.time() - s
+    s = time.time()
+    for _ in range(n):
+        parse_rpc_request(payload)
+    return t_regex, time.time() - s
+
+
+def _sample_bulk_load(rows: int) -> bytes:
+    # COLMETADATA (Id int, Email nvarchar(100), Name nvarchar(50), Amount money), ROWs, DONE
+    def col(name: str, type_info: bytes) -> bytes:
+        return b"\x00" * 6 + type_info + bytes([len(name)]) + name.encode("utf-16le")
+    coll = b"\x09\x04\xd0\x00\x34"
+    out = b"\x81\x04\x00" + col("Id", b"\x38") + col("Email", b"\xe7\xc8\x00" + coll) + col("Name", b"\xe7\x64\x00" + coll) + col("Amount", b"\x6e\x08")
+    body = []
+    for i in range(rows):
+        email = f"user{i % 997}@example.com".encode("utf-16le")
+        name = f"Customer {i}".encode("utf-16le")
+        body.append(b"\xd1" + struct.pack("<i", i) + struct.pack("<H", len(email)) + email + struct.pack("<H", len(name)) + name + b"\x08" + struct.pack("<q", i * 100))
+    return out + b"".join(body) + b"\xfd" + b"\x00" * 12
+
+
+def bench_bulk(rows=100000, chunk=4088):
+    """MB/s decoding a bulk load fed in packet-sized chunks: no column watched vs. one watched column."""
+    msg = _sample_bulk_load(rows)
+    out = []
+    for select in (lambda cols: [], lambda cols: [1]):
+        dec = BulkLoadDecoder(select)
+        s = time.time()
+        for off in range(0, len(msg), chunk):
+            dec.feed(msg[off:off + chunk])
+            dec.take()
+        out.append(len(msg) / 1e6 / max(time.time() - s, 1e-9))
+    return out
+
+
+def bench_stage_timing(n=20000):
+    """
+    µs per SQL Batch inspection with STAGE_TIMING off and on, and what the disabled spans
+    cost per batch (spans per batch x ns per no-op span).
+    """
+    from src.policy.engine import PolicyEngine, Rule
+    from src.proxy.tds_proxy import _inspect_sql_batch
+    engine = PolicyEngine([Rule(id="email", target="column", selector="dbo.Users.Email", action="autocorrect")])
+    payload = "INSERT INTO dbo.Users (Email, Age) VALUES ('someone@example.com', 42)".encode("utf-16le")
+    per_call = []
+    for on in (False, True):
+        stage_timing.configure(on)
+        _inspect_sql_batch(engine, payload, 1, "log")
+        s = time.perf_counter()
+        for _ in range(n):
+            _inspect_sql_batch(engine, payload, 1, "log")
+        per_call.append((time.perf_counter() - s) / n * 1e6)
+    spans = sum(row["count"] for kinds in stage_timing.snapshot()["stages"].values() for row in kinds.values()) / (n + 1)
+    stage_timing.configure(False)
+    stage_timing.reset()
+    s = time.perf_counter()
+    for _ in range(n * 10):
+        with stage_timing.span("match"):
+            pass
+    per_span = (time.perf_counter() - s) / (n * 10) * 1e9
+    return per_call[0], per_call[1], spans * per_span / 1000.0
+
+
+def bench_counters(n=2000):
+    """µs per metrics_store.inc with METRICS_BACKEND=json and shm (in a scratch directory)."""
+    from src.metrics import shm
+    from src.metrics import store as metrics_store
+    out = []
+    saved = {k: os.environ.get(k) for k in ("METRICS_BACKEND", "METRICS_SHM_DIR")}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            os.environ["METRICS_SHM_DIR"] = os.path.join(tmp, "shm")
+            for backend in ("json", "shm"):
+                os.environ["METRICS_BACKEND"] = backend
+                metrics_store.inc("allowed")
+                s = time.perf_counter()
+                for _ in range(n):
+                    metrics_store.inc("allowed")
+                out.append((time.perf_counter() - s) / n * 1e6)
+            shm.reset()
+        finally:
+            os.chdir(cwd)
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+    return out[0], out[1]
+
+
 def main():
     t1 = bench_parse()
     t2 = bench_rpc()
+    t3, t4 = bench_rpc_parse()
     print(f"parse: {t1:.3f}s for 10k; rpc: {t2:.3f}s for 5k")
+    print(f"rpc parse: regex {t3:.3f}s vs token {t4:.3f}s for 20k")
+    skip, watched = bench_bulk()
+    print(f"bulk: {skip:.0f} MB/s no watched column; {watched:.0f} MB/s one watched column")
+    off, on, disabled = bench_stage_timing()
+    print(f"stage timing: {off:.1f}us/batch off vs {on:.1f}us/batch on; disabled spans {disabled:.2f}us/batch")
+    js, sh = bench_counters()
+    print(f"counters: json {js:.1f}us/inc vs shm {sh:.1f}us/inc")
 
 
 if __name__ == "__main__":
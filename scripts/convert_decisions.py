@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Convert a decisions log file between JSONL and the binary format (DECISIONS_FORMAT=binary).
+
+    PYTHONPATH=. python scripts/convert_decisions.py data/metrics/decisions/decisions-20260110.jsonl
+    PYTHONPATH=. python scripts/convert_decisions.py data/metrics/decisions.jsonl /tmp/decisions.bin
+
+The output format follows the extension of DST (`.bin` or `.jsonl`). Without DST the file
+is converted in place: the result is written next to SRC with the other extension and
+replaces it, and the dry-run rollups take over SRC's counts so nothing is counted twice.
+Convert sealed segments, or stop the proxy before converting the file it appends to.
+Prints the record count, both sizes and the read, convert and read-back rates.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from src.metrics import binlog, decisions, rollups
+
+
+def _other(path: str) -> str:
+    root, ext = os.path.splitext(path)
+    return root + (".jsonl" if ext == ".bin" else ".bin")
+
+
+def _as_source(path: str) -> str:
+    """`path` spelled the way the rollups know it, if it is one of the log files."""
+    for src in decisions.sources():
+        if os.path.abspath(src["path"]) == os.path.abspath(path):
+            return src["path"]
+    return path
+
+
+def _read(path: str) -> int:
+    return sum(1 for rec, _ in decisions._records(path) if rec is not None)
+
+
+def convert(src: str, dst: str) -> int:
+    """Write every record of `src` to `dst` in the format of its extension; returns the count."""
+    d = binlog.dictionary(os.path.dirname(dst)) if dst.endswith(".bin") else None
+    n = 0
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as out:
+        for rec, _ in decisions._records(src):
+            if rec is None:
+                continue
+            out.write(binlog.encode(rec, d) if d is not None else (json.dumps(rec) + "\n").encode("utf-8"))
+            n += 1
+    os.replace(tmp, dst)
+    return n
+
+
+def _rate(n: int, seconds: float) -> int:
+    return round(n / seconds) if seconds > 0 else 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("src")
+    ap.add_argument("dst", nargs="?", help="output file (default: SRC with the other extension, replacing SRC)")
+    args = ap.parse_args(argv)
+    src = _as_source(args.src)
+    dst = args.dst or _other(src)
+    if os.path.splitext(src)[1] == os.path.splitext(dst)[1] or os.path.exists(dst):
+        print(f"refusing to write {dst}: same format as {src} or already exists", file=sys.stderr)
+        return 2
+    s = time.perf_counter()
+    _read(src)
+    read_s = time.perf_counter() - s
+    src_bytes = os.path.getsize(src)
+    result = {}
+
+    def run() -> None:
+        s = time.perf_counter()
+        result["n"] = convert(src, dst)
+        result["convert_s"] = time.perf_counter() - s
+
+    def replace() -> None:
+        run()
+        decisions._remove(src)
+
+    if args.dst:
+        run()
+    elif not rollups.handover([src], dst, replace):
+        print(f"{src} is still being written; try again once it is sealed", file=sys.stderr)
+        return 1
+    s = time.perf_counter()
+    _read(dst)
+    back_s = time.perf_counter() - s
+    n = result["n"]
+    dst_bytes = os.path.getsize(dst)
+    print(json.dumps({
+        "records": n,
+        "src_bytes": src_bytes,
+        "dst_bytes": dst_bytes,
+        "size_ratio": round(dst_bytes / src_bytes, 3) if src_bytes else None,
+        "read_src_per_s": _rate(n, read_s),
+        "convert_per_s": _rate(n, result["convert_s"]),
+        "read_dst_per_s": _rate(n, back_s),
+    }))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,49 +1,38 @@
 #!/usr/bin/env python3
-import json
 import datetime as dt
+import sys
 from pathlib import Path
-from collections import defaultdict, Counter
+from collections import Counter
 
-DECISIONS = Path("data/metrics/decisions.jsonl")
 REPORTS_DIR = Path("reports")
 
-
-def iter_decisions_for_date(date: dt.date):
-    if not DECISIONS.exists():
-        return []
-    target_prefix = date.isoformat()
-    with DECISIONS.open("r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                d = json.loads(line)
-                ts = d.get("ts", "")
-                if ts.startswith(target_prefix):
-                    yield d
-            except Exception:
-                continue
+# Ensure project root is importable when run as `python scripts/generate_dryrun_report.py`
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
 
 
 def main():
+    from src.metrics import rollups
     today = dt.datetime.now(dt.timezone.utc).date()
+    # exact weighted counts from the hourly rollups (see src/metrics/rollups.py)
+    summary = rollups.query(today.isoformat())
+    per_rule = {rule: Counter(acts) for rule, acts in summary["rules"].items()}
     actions_total = Counter()
-    per_rule = defaultdict(lambda: Counter())
-    samples = defaultdict(list)
-
-    for d in iter_decisions_for_date(today):
-        action = str(d.get("action", "")).lower()
-        rule_id = d.get("rule_id") or "(no_rule)"
-        actions_total[action] += 1
-        per_rule[rule_id][action] += 1
-        if len(samples[rule_id]) < 3:
-            samples[rule_id].append(d.get("sample") or d.get("before") or "")
+    for cnts in per_rule.values():
+        actions_total.update(cnts)
+    samples = rollups.samples(today.isoformat())
+    sampled = summary["sampled"]
 
     REPORTS_DIR.mkdir(exist_ok=True)
     out = REPORTS_DIR / f"dryrun-{today.isoformat()}.md"
     lines = [
         f"# Dry‑Run Enforcement Summary – {today.isoformat()}",
         "",
-        "## Totals by Action",
     ]
+    if sampled:
+        lines += ["_Inspection was sampled (INSPECT_SAMPLE_RATE); counts are extrapolated from decision weights._", ""]
+    lines.append("## Totals by Action")
     for k, v in actions_total.most_common():
         lines.append(f"- {k}: {v}")
     lines.append("")
@@ -51,7 +40,7 @@ def main():
     for rule, cnts in per_rule.items():
         parts = ", ".join(f"{k}:{v}" for k, v in cnts.most_common())
         lines.append(f"- {rule}: {parts}")
-        for s in samples[rule]:
+        for s in samples.get(rule, []):
             if s:
                 clean = s.replace("\n", " ")
                 lines.append(f"  - sample: {clean[:160]}")
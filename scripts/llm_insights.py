@@ -5,27 +5,22 @@ Outputs reports/insights-YYYY-MM-DD.md. Falls back to heuristic scoring when LLM
 """
 import os
 import json
+import sys
 import datetime as dt
 from pathlib import Path
 
-DECISIONS = Path("data/metrics/decisions.jsonl")
 PROFILES = Path("data/aggregations/field_profiles.json")
 REPORTS = Path("reports")
 
+# Ensure project root is importable when run as `python scripts/llm_insights.py`
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
 
 def load_decisions_for_date(date_iso: str):
-    out = []
-    if not DECISIONS.exists():
-        return out
-    with DECISIONS.open("r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                d = json.loads(line)
-                if d.get("ts", "").startswith(date_iso):
-                    out.append(d)
-            except Exception:
-                continue
-    return out
+    from src.metrics import decisions as decisions_store
+    return list(decisions_store.iter_day(date_iso))
 
 
 def try_llm(prompt: str) -> str | None:
@@ -64,6 +59,7 @@ def try_llm(prompt: str) -> str | None:
 
 def main():
     date = dt.datetime.now(dt.timezone.utc).date().isoformat()
+    from src.metrics.aggregate import count
     decisions = load_decisions_for_date(date)
     profiles = {}
     if PROFILES.exists():
@@ -79,7 +75,7 @@ def main():
         by_rule.setdefault(rid, {"block": 0, "autocorrect": 0, "rpc_autocorrect_inplace": 0}).update()
         act = (d.get("action") or "").lower()
         if act in by_rule[rid]:
-            by_rule[rid][act] += 1
+            by_rule[rid][act] += count(d)
     top_profiles = list(profiles.items())[:30]
 
     prompt_lines = [
@@ -52,6 +52,7 @@ except Exception:  # minimal shim for environments without pydantic  # pragma: n
 from typing import List, Literal, Optional
 import json
 import os
+import time
 from threading import RLock
 from src.metrics import store as metrics_store
 from src.metrics import decisions as decisions_store
@@ -124,7 +125,9 @@ def delete_rule(rule_id: str):
 
 @app.get("/healthz")
 def healthz():
-    return {"status": "ok", "version": __version__}
+    # The proxy keeps forwarding while inspection is degraded, so status stays "ok"
+    from src.proxy import breaker
+    return {"status": "ok", "version": __version__, "inspection": breaker.snapshot()}
 
 
 @app.get("/version")
@@ -142,13 +145,103 @@ def decisions(limit: int = 50):
     return decisions_store.tail(limit)
 
 
+@app.get("/decisions/query")
+def decisions_query(rule: str | None = None, action: str | None = None, column: str | None = None,
+                    since: str | None = None, until: str | None = None, spid: int | None = None,
+                    limit: int = 100, cursor: int | None = None):
+    """
+    Decisions newest first, filtered by rule, action, column, spid and ts range [since, until).
+    Pass the returned `next_cursor` as `cursor` for the next page. Needs DECISIONS_BACKEND=sqlite.
+    """
+    from src.metrics import sqlite_store
+    if not sqlite_store.available():
+        raise HTTPException(status_code=404, detail="Decision queries need DECISIONS_BACKEND=sqlite")
+    limit = max(1, min(limit, 1000))
+    return sqlite_store.query(rule=rule, action=action, column=column, since=since, until=until, spid=spid, limit=limit, cursor=cursor)
+
+
+@app.get("/proxy/buffers")
+def proxy_buffers():
+    """Bytes currently held for c2s message reassembly, per connection and in total."""
+    from src.proxy import buffers
+    return buffers.snapshot()
+
+
+@app.get("/proxy/loop")
+def proxy_loop():
+    """Event loop lag shared by the proxy and the API (last, p50, p99, max over the recent samples)."""
+    from src.runtime import loop_lag
+    return loop_lag.snapshot()
+
+
+@app.get("/connections")
+def list_connections(sort: str = "inspect_ms", limit: int = 100):
+    """Active proxy connections, most expensive first (sort: inspect_ms, age_s, c2s_bytes, s2c_bytes, messages, decisions, buffered_bytes)."""
+    from src.proxy import connections
+    return connections.snapshot(sort, limit)
+
+
+@app.get("/debug/profile")
+async def debug_profile(seconds: float = 10, hz: int = 100, format: str = "json"):
+    """
+    Sample the event loop thread (proxy + API) for `seconds`; collapsed stacks and top functions.
+    `format=collapsed` returns only the flamegraph.pl input as text. Off unless DEBUG_PROFILE=true.
+    """
+    if os.getenv("DEBUG_PROFILE", "false").lower() != "true":
+        raise HTTPException(status_code=404, detail="Profiler disabled")
+    import asyncio
+    import threading
+    from src.runtime import profiler
+    if profiler.running():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    loop_thread = threading.get_ident()
+    try:
+        # sampled from a worker thread while this loop keeps serving traffic
+        out = await asyncio.get_running_loop().run_in_executor(None, profiler.profile, loop_thread, seconds, hz)
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    if format == "collapsed":
+        return Response(content=out["collapsed"] + "\n", media_type="text/plain")
+    return out
+
+
+@app.get("/stats/statements")
+def statement_stats(limit: int = 50, sort: str = "total_ms"):
+    """Server response latency/rows/errors per statement fingerprint, as seen by the proxy."""
+    from src.metrics import stmt_stats
+    return stmt_stats.top(limit, sort)
+
+
+@app.get("/stats/stages")
+def stage_stats():
+    """p50/p90/p99/p999 (µs) per inspection stage and statement kind (STAGE_TIMING=true)."""
+    from src.metrics import stage_timing
+    return stage_timing.snapshot()
+
+
+@app.get("/stats/statements/{fingerprint}")
+def statement_stats_detail(fingerprint: str):
+    from src.metrics import stmt_stats
+    out = stmt_stats.get(fingerprint)
+    if out is None:
+        raise HTTPException(status_code=404, detail="Unknown fingerprint")
+    return out
+
+
+@app.get("/rpc/catalog")
+def rpc_catalog(proc: str | None = None):
+    """Parameter types learned from observed RPC calls, per procedure."""
+    from src.tds import rpc_catalog as catalog
+    return catalog.snapshot(proc)
+
+
 @app.get("/metrics.html")
 def metrics_html(limit: int = 50):
     metrics = metrics_store.get_all()
     decs = decisions_store.tail(limit)
     # Simple HTML rendering
     rows = "".join(
-        f"<tr><td>{d.get('ts','')}</td><td>{d.get('action','')}</td><td>{d.get('rule_id','')}</td><td>{(d.get('reason','') or '')[:120]}</td></tr>"
+        f"<tr><td>{d.get('ts','')}</td><td>{d.get('action','')}{' ×' + str(d['count']) if d.get('count') else ''}</td><td>{d.get('rule_id','')}</td><td>{(d.get('reason','') or '')[:120]}</td></tr>"
         for d in decs
     )
     html = f"""
@@ -170,28 +263,53 @@ def metrics_html(limit: int = 50):
     return html
 
 
-@app.get("/metrics/prom")
-def metrics_prom():
+_prom_lock = RLock()
+_prom_cache: dict = {"at": None, "content": b"", "media_type": "text/plain"}
+
+
+def _prom_render():
     try:
         from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
-        payload = generate_latest()  # includes our custom counters/histograms if imported
-        return Response(content=payload, media_type=CONTENT_TYPE_LATEST)
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            # aggregate the samples every worker process wrote to the shared directory
+            from prometheus_client import CollectorRegistry, multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return generate_latest(registry), CONTENT_TYPE_LATEST
+        return generate_latest(), CONTENT_TYPE_LATEST  # includes our custom counters/histograms if imported
     except Exception:
-        # Fallback to simple text exposition from JSON counters
-        data = metrics_store.get_all()
+        # Fallback to simple text exposition from JSON counters (same names and rule cap)
+        from src.metrics import labels
+        events: dict = {}
+        typed = {"rule": {}, "shadow": {}}
+        for k, v in metrics_store.get_all().items():
+            family, rid, act = labels.split_key(k)
+            if rid is None:
+                events[k] = int(v)
+            else:
+                lk = (labels.rules.get(rid), act)
+                typed[family][lk] = typed[family].get(lk, 0) + int(v)
         lines = [
-            "# TYPE sqlumai_metric counter",
-            "# HELP sqlumai_metric SQLumAI counters (by key)",
+            "# HELP sqlumai_events_total SQLumAI event counters by key",
+            "# TYPE sqlumai_events_total counter",
         ]
-        for k, v in data.items():
-            if k.startswith("rule:"):
-                parts = k.split(":", 2)
-                if len(parts) == 3:
-                    _, rid, act = parts
-                    lines.append(f'sqlumai_metric{{key="rule",rule="{rid}",action="{act}"}} {int(v)}')
-                    continue
-            lines.append(f'sqlumai_metric{{key="{k}"}} {int(v)}')
-    return Response(content="\n".join(lines) + "\n", media_type="text/plain")
+        lines += [f'sqlumai_events_total{{key="{k}"}} {v}' for k, v in events.items()]
+        for family, name in (("rule", "sqlumai_rule_actions_total"), ("shadow", "sqlumai_shadow_actions_total")):
+            lines += [f"# HELP {name} SQLumAI {family} decisions by rule and action", f"# TYPE {name} counter"]
+            lines += [f'{name}{{rule="{rid}",action="{act}"}} {v}' for (rid, act), v in typed[family].items()]
+    return "\n".join(lines) + "\n", "text/plain"
+
+
+@app.get("/metrics/prom")
+def metrics_prom():
+    # Rendered at most once per PROM_CACHE_SECONDS; concurrent scrapes wait for and share one render
+    ttl = float(os.getenv("PROM_CACHE_SECONDS", "1"))
+    with _prom_lock:
+        now = time.monotonic()
+        if _prom_cache["at"] is None or now - _prom_cache["at"] >= ttl:
+            content, media_type = _prom_render()
+            _prom_cache.update(at=now, content=content, media_type=media_type)
+        return Response(content=_prom_cache["content"], media_type=_prom_cache["media_type"])
 
 @app.get("/insights.html")
 def insights_html():
@@ -223,25 +341,19 @@ def insights_html():
     return Response(content=html_doc, media_type="text/html")
 
 
+@app.get("/proxy/sampling")
+def proxy_sampling():
+    from src.proxy import sampling
+    return sampling.snapshot()
+
+
 @app.get("/dryrun.html")
 def dryrun_html(rule: str | None = None, action: str | None = None, date: str | None = None):
-    # Aggregate decisions by rule and action for today
+    # Decisions by rule and action for the day, from the hourly rollups
     import datetime as dt
+    from src.metrics import rollups
     day = (date or dt.datetime.now(dt.timezone.utc).date().isoformat())
-    all_decs = decisions_store.tail(5000)
-    agg = {}
-    for d in all_decs:
-        ts = d.get("ts", "")
-        if not ts.startswith(day):
-            continue
-        rid = d.get("rule_id") or "(no_rule)"
-        act = (d.get("action") or "").lower()
-        if rule and rid != rule:
-            continue
-        if action and act != action:
-            continue
-        agg.setdefault(rid, {}).setdefault(act, 0)
-        agg[rid][act] += 1
+    agg = rollups.query(day, rule=rule, action=action)["rules"]
     rows = "".join(f"<tr><td>{rid}</td><td>{', '.join(f'{k}:{v}' for k,v in acts.items())}</td></tr>" for rid, acts in agg.items())
     html = f"""
     <html><head><title>Dry‑Run Dashboard</title><style>body{{font-family:Arial,sans-serif}} table{{border-collapse:collapse}} td,th{{border:1px solid #ccc;padding:4px}}</style></head>
@@ -265,24 +377,15 @@ def dryrun_html(rule: str | None = None, action: str | None = None, date: str |
 
 
 @app.get("/dryrun.json")
-def dryrun_json(rule: str | None = None, action: str | None = None, date: str | None = None):
+def dryrun_json(rule: str | None = None, action: str | None = None, date: str | None = None, end: str | None = None):
     import datetime as dt
+    from src.metrics import rollups
     day = (date or dt.datetime.now(dt.timezone.utc).date().isoformat())
-    all_decs = decisions_store.tail(10000)
-    agg = {}
-    for d in all_decs:
-        ts = d.get("ts", "")
-        if not ts.startswith(day):
-            continue
-        rid = d.get("rule_id") or "(no_rule)"
-        act = (d.get("action") or "").lower()
-        if rule and rid != rule:
-            continue
-        if action and act != action:
-            continue
-        agg.setdefault(rid, {}).setdefault(act, 0)
-        agg[rid][act] += 1
-    return {"date": day, "rules": agg}
+    out = rollups.query(day, end, rule=rule, action=action)
+    res = {"date": day, "rules": out["rules"], "sampled": out["sampled"]}
+    if end:
+        res["end"] = end
+    return res
 
 
 @app.get("/rules/ui")
@@ -394,6 +497,23 @@ def rules_diff():
     return {"added": added, "removed": removed, "changed": changed}
 
 
+@app.get("/rules/shadow")
+def rules_shadow():
+    """Would-be hits of the proposed rules on live traffic (SHADOW_RULES=true) next to the active counters."""
+    from src.proxy import shadow
+    proposed = shadow.counters()
+    ids = sorted({r.id for r in _read_rules()} | {r.id for r in _read_rules_from(PROPOSED_RULES_PATH)} | set(proposed))
+    rules = {rid: {"active": metrics_store.get_rule_counters(rid), "proposed": proposed.get(rid, {})} for rid in ids}
+    return {"shadow": shadow.snapshot(), "rules": rules}
+
+
+@app.get("/rules/gating")
+def rules_gating():
+    """Hits toward min_hits_to_enforce per rule and the rules already promoted to enforcement."""
+    from src.policy import gating
+    return gating.snapshot()
+
+
 @app.post("/rules/promote")
 def rules_promote():
     proposed = _read_rules_from(PROPOSED_RULES_PATH)
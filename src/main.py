@@ -12,6 +12,9 @@ from src.proxy.tds_proxy import run_proxy
 from src.proxy.tds_tls import run_tls_terminating_proxy
 from src.runtime.api_runner import run_api
 from src.runtime.scheduler import run_scheduler
+from src.runtime.loop_lag import run_loop_lag_monitor
+from src.proxy import shadow
+from src.metrics import rollups
 
 
 async def main() -> None:
@@ -47,8 +50,12 @@ async def main() -> None:
         proxy_task = asyncio.create_task(
             run_proxy(listen_host, listen_port, sql_host, sql_port, stop_event)
         )
-    tasks = [proxy_task]
+    tasks = [proxy_task, asyncio.create_task(run_loop_lag_monitor(stop_event))]
+    # dry-run rollups catch up with the log in a worker thread, not in a request or an append
+    tasks.append(asyncio.create_task(rollups.run_rollup_refresher(stop_event)))
 
+    if shadow.enabled():
+        tasks.append(asyncio.create_task(shadow.run_shadow_worker(stop_event)))
     if enable_api:
         tasks.append(asyncio.create_task(run_api(stop_event)))
     if enable_scheduler:
@@ -57,6 +64,17 @@ async def main() -> None:
     await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
     stop_event.set()
     await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        from src.metrics import decisions
+        decisions.flush()  # aggregated decisions still in their window
+        decisions.wait_maintenance(10)
+    except Exception:
+        pass
+    try:
+        from src.metrics.prom_registry import mark_process_dead
+        mark_process_dead()
+    except Exception:
+        pass
 
 
 if __name__ == "__main__":
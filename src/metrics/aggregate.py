@@ -0,0 +1,172 @@
+"""
+Windowed aggregation of repeated decisions (DECISIONS_AGGREGATE_WINDOW_SECONDS > 0).
+
+Rewrite decisions (those with `before`/`after`, i.e. autocorrects) that agree on rule_id,
+column, action, before, after and weight are held from the first one for the length of
+the window and then written as one record: the first decision plus
+
+    count      decisions the record stands for
+    last_ts    time of the last one
+    exemplars  the fields that differ (ts, spid, param, ...) of the first
+               DECISIONS_AGGREGATE_EXEMPLARS (3) decisions
+
+A group of one is written as the plain decision. Everything else is written at once.
+Readers that count (rollups, the SQLite rollup, the segment index, the reports) multiply
+by `count`, so totals stay exact. Groups are written when their window is over (a flusher
+thread checks every half window), when a decision of the same group arrives after it, and
+on `flush()` (shutdown, process exit). More than DECISIONS_AGGREGATE_MAX_KEYS open groups:
+new decisions are written directly.
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+KEY_FIELDS = ("rule_id", "column", "action", "before", "after", "weight")
+
+_lock = threading.Lock()
+_groups: Dict[Tuple, Dict[str, Any]] = {}
+_state: Dict[str, Any] = {"pid": None, "thread": None, "atexit": False}
+
+
+def window_seconds() -> float:
+    try:
+        return max(0.0, float(os.getenv("DECISIONS_AGGREGATE_WINDOW_SECONDS", "0")))
+    except ValueError:
+        return 0.0
+
+
+def _exemplars() -> int:
+    return max(1, int(os.getenv("DECISIONS_AGGREGATE_EXEMPLARS", "3")))
+
+
+def _max_keys() -> int:
+    return int(os.getenv("DECISIONS_AGGREGATE_MAX_KEYS", "10000"))
+
+
+def count(rec: Dict[str, Any]) -> int:
+    """Decisions a log record stands for."""
+    try:
+        return max(1, int(rec.get("count", 1)))
+    except Exception:
+        return 1
+
+
+def _key(decision: Dict[str, Any]) -> Optional[Tuple]:
+    if "before" not in decision and "after" not in decision:
+        return None
+    key = tuple(decision.get(k) for k in KEY_FIELDS)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _exemplar(decision: Dict[str, Any], ts: datetime) -> Dict[str, Any]:
+    ex = {"ts": ts.isoformat()}
+    ex.update((k, v) for k, v in decision.items() if k not in KEY_FIELDS and k != "reason")
+    return ex
+
+
+def _record(group: Dict[str, Any]) -> Dict[str, Any]:
+    rec = dict(group["first"])
+    if group["count"] > 1:
+        rec["count"] = group["count"]
+        rec["last_ts"] = group["last"].isoformat()
+        rec["exemplars"] = group["exemplars"]
+    return rec
+
+
+def hold(decision: Dict[str, Any], now: datetime, write: Callable[[Dict[str, Any], datetime], None]) -> bool:
+    """
+    Take `decision` into its group; False when it is not aggregated and the caller writes
+    it. `write(record, first_ts)` writes a finished group.
+    """
+    window = window_seconds()
+    key = _key(decision) if window > 0 else None
+    if key is None:
+        return False
+    due = None
+    with _lock:
+        _reset_after_fork()
+        group = _groups.get(key)
+        if group is not None and (now - group["start"]).total_seconds() >= window:
+            due = _groups.pop(key)
+            group = None
+        if group is None:
+            if len(_groups) >= _max_keys():
+                held = False
+            else:
+                _groups[key] = {"first": dict(decision), "start": now, "last": now, "count": 1,
+                                "exemplars": [_exemplar(decision, now)], "write": write}
+                held = True
+        else:
+            group["count"] += 1
+            group["last"] = now
+            if len(group["exemplars"]) < _exemplars():
+                group["exemplars"].append(_exemplar(decision, now))
+            held = True
+        if held:
+            _start_flusher()
+    if due is not None:
+        due["write"](_record(due), due["start"])
+    return held
+
+
+def _take(expired_before: Optional[datetime]) -> List[Dict[str, Any]]:
+    with _lock:
+        _reset_after_fork()
+        keys = [k for k, g in _groups.items() if expired_before is None or g["start"] <= expired_before]
+        return [_groups.pop(k) for k in keys]
+
+
+def flush_expired(now: Optional[datetime] = None) -> int:
+    """Write the groups whose window is over; returns how many."""
+    now = now or datetime.now(timezone.utc)
+    due = _take(now - timedelta(seconds=window_seconds()))
+    for group in sorted(due, key=lambda g: g["start"]):
+        group["write"](_record(group), group["start"])
+    return len(due)
+
+
+def flush() -> int:
+    """Write every open group."""
+    due = _take(None)
+    for group in sorted(due, key=lambda g: g["start"]):
+        group["write"](_record(group), group["start"])
+    return len(due)
+
+
+def pending() -> int:
+    with _lock:
+        return len(_groups)
+
+
+def _reset_after_fork() -> None:
+    if _state["pid"] != os.getpid():  # a forked child must not write its parent's groups
+        _groups.clear()
+        _state.update(pid=os.getpid(), thread=None)
+
+
+def _run() -> None:
+    while True:
+        window = window_seconds() or 1.0
+        time.sleep(min(1.0, max(0.05, window / 2)))
+        try:
+            flush_expired()
+        except Exception:
+            pass
+
+
+def _start_flusher() -> None:
+    t = _state["thread"]
+    if t is None or not t.is_alive():
+        t = threading.Thread(target=_run, name="decisions-aggregate", daemon=True)
+        _state["thread"] = t
+        t.start()
+    if not _state["atexit"]:
+        _state["atexit"] = True
+        atexit.register(flush)
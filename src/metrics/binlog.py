@@ -0,0 +1,314 @@
+"""
+Binary decision records (DECISIONS_FORMAT=binary).
+
+A `.bin` log file is a sequence of length-prefixed records:
+
+    u32 length | body | u32 length        (the trailing copy lets tail() read backwards)
+    body       flags u8 | ts i64 | spid i32 | confidence f64
+               | rule_id u32 | action u32 | column u32 | reason u32
+               | sample, before, after: u16 length + UTF-8 each, if set | extras
+
+`ts` is microseconds since the epoch (UTC). `rule_id`, `action`, `column` and `reason` are
+ids in the dictionary `decisions.dict` next to the file (0: not set). `flags` says which of
+ts, spid, confidence and the three texts are set. Any other field, or one of the above of
+an unexpected type, is kept as compact JSON in `extras`, so the usual proxy record needs no
+JSON at all. `sample`, `before`, `after` and `value` are cut to DECISIONS_TEXT_MAX
+characters (0 keeps them whole).
+
+The dictionary is one JSON string per line, id = line number. New strings are appended
+under a file lock, so several writer processes share it; readers reload it when they meet
+an id they do not know yet.
+"""
+import json
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+DICT_NAME = "decisions.dict"
+_LEN = struct.Struct("<I")
+_BODY = struct.Struct("<BqidIIII")
+_U16 = struct.Struct("<H")
+_INTERNED = ("rule_id", "action", "column", "reason")
+_TEXT = ("sample", "before", "after")
+_HAS_SPID = 1
+_HAS_TS = 2
+_HAS_CONFIDENCE = 4
+_HAS_TEXT = 8  # << index in _TEXT
+_ANY_TEXT = 8 | 16 | 32
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_CHUNK = 1 << 20
+_BLOCK = 65536
+
+_json_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=str).encode
+_json_decode = json.JSONDecoder().raw_decode
+_lock = Lock()
+_dicts: Dict[Tuple[str, str], "Dictionary"] = {}
+_by_path: Dict[str, "Dictionary"] = {}
+_last_hour: Tuple[Optional[int], str] = (None, "")  # swapped whole, never mutated
+
+
+# read once, like DECISIONS_PATH: an env lookup costs as much as a third of an encode
+TEXT_MAX = int(os.getenv("DECISIONS_TEXT_MAX", "200"))
+
+
+class Dictionary:
+    """Interned strings of one directory's `.bin` files."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.offset = 0
+
+    def _reload(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except OSError:
+            return
+        end = data.rfind(b"\n") + 1
+        for raw in data[:end].split(b"\n")[:-1]:
+            try:
+                s = json.loads(raw)
+            except Exception:
+                s = ""  # keep the numbering
+            self.strings.append(s)
+            self.ids.setdefault(s, len(self.strings))
+        self.offset += end
+
+    def id_for(self, s: str) -> int:
+        i = self.ids.get(s)
+        if i is not None:
+            return i
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._reload()  # another process may have added it
+                i = self.ids.get(s)
+                if i is None:
+                    f.write(json.dumps(s).encode("utf-8") + b"\n")
+                    f.flush()
+                    self._reload()
+                    i = self.ids[s]
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        return i
+
+    def string(self, i: int) -> str:
+        if i > len(self.strings):
+            self._reload()
+        if i > len(self.strings):
+            return f"#{i}"
+        return self.strings[i - 1]
+
+
+def dictionary(directory: str) -> Dictionary:
+    """The dictionary shared by the `.bin` files in `directory`."""
+    key = (os.getcwd(), directory)  # cheaper than abspath on every append
+    d = _dicts.get(key)
+    if d is None:
+        dpath = os.path.join(os.path.abspath(directory or "."), DICT_NAME)
+        with _lock:
+            d = _by_path.get(dpath)
+            if d is None:
+                d = _by_path[dpath] = Dictionary(dpath)
+            _dicts[key] = d
+    return d
+
+
+def ts_micros(ts: Any) -> Optional[int]:
+    try:
+        dt = ts if isinstance(ts, datetime) else datetime.fromisoformat(str(ts))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _iso(ts_us: int) -> str:
+    """Same string as datetime.isoformat() of the UTC time; the hour part is cached."""
+    global _last_hour
+    hour, rest = divmod(ts_us, 3_600_000_000)
+    cached = _last_hour  # one read, so another thread's swap can't split hour and prefix
+    if cached[0] != hour:
+        cached = (hour, (_EPOCH + timedelta(hours=hour)).isoformat()[:14])
+        _last_hour = cached
+    prefix = cached[1]
+    sec, us = divmod(rest, 1_000_000)
+    m, sec = divmod(sec, 60)
+    if us:
+        return f"{prefix}{m:02d}:{sec:02d}.{us:06d}+00:00"
+    return f"{prefix}{m:02d}:{sec:02d}+00:00"
+
+
+def encode(rec: Dict[str, Any], d: Dictionary, text_max: Optional[int] = None) -> bytes:
+    """One framed record; `ts` may be an ISO string or a datetime."""
+    text_max = TEXT_MAX if text_max is None else text_max
+    extras = dict(rec)
+    flags = 0
+    ts_us = ts_micros(extras["ts"]) if "ts" in extras else None
+    if ts_us is None:
+        ts_us = 0
+    else:
+        flags |= _HAS_TS
+        del extras["ts"]
+    spid = extras.get("spid")
+    if type(spid) is int and -2**31 <= spid < 2**31:
+        flags |= _HAS_SPID
+        del extras["spid"]
+    else:
+        spid = 0
+    confidence = extras.get("confidence")
+    if type(confidence) is float:
+        flags |= _HAS_CONFIDENCE
+        del extras["confidence"]
+    else:
+        confidence = 0.0
+    refs = [0, 0, 0, 0]
+    for n, key in enumerate(_INTERNED):
+        v = extras.get(key)
+        if type(v) is str:
+            refs[n] = d.id_for(v)
+            del extras[key]
+    texts = []
+    for n, key in enumerate(_TEXT):
+        v = extras.get(key)
+        if type(v) is str:
+            raw = (v[:text_max] if text_max > 0 else v).encode("utf-8")
+            if len(raw) <= 0xFFFF:
+                flags |= _HAS_TEXT << n
+                texts.append(_U16.pack(len(raw)) + raw)
+                del extras[key]
+    v = extras.get("value")
+    if type(v) is str and text_max > 0 and len(v) > text_max:
+        extras["value"] = v[:text_max]
+    body = _BODY.pack(flags, ts_us, spid, confidence, *refs)
+    if texts:
+        body += b"".join(texts)
+    if extras:
+        body += _json_encode(extras).encode("utf-8")
+    n = _LEN.pack(len(body))
+    return n + body + n
+
+
+def decode(buf: bytes, d: Dictionary, start: int = 0, end: Optional[int] = None) -> Dict[str, Any]:
+    """The record whose body is `buf[start:end]`."""
+    flags, ts_us, spid, confidence, rule_id, action, column, reason = _BODY.unpack_from(buf, start)
+    rec: Dict[str, Any] = {}
+    if flags & _HAS_TS:
+        rec["ts"] = _iso(ts_us)
+    if flags & _HAS_SPID:
+        rec["spid"] = spid
+    if flags & _HAS_CONFIDENCE:
+        rec["confidence"] = confidence
+    strings = d.strings
+    top = max(rule_id, action, column, reason)
+    if top > len(strings):
+        d.string(top)  # reloads the dictionary
+        if top > len(strings):
+            strings = [d.string(i) for i in range(1, top + 1)]
+    if rule_id:
+        rec["rule_id"] = strings[rule_id - 1]
+    if action:
+        rec["action"] = strings[action - 1]
+    if column:
+        rec["column"] = strings[column - 1]
+    if reason:
+        rec["reason"] = strings[reason - 1]
+    at = start + _BODY.size
+    if flags & _ANY_TEXT:
+        for n, key in enumerate(_TEXT):
+            if flags & (_HAS_TEXT << n):
+                size = _U16.unpack_from(buf, at)[0]
+                rec[key] = buf[at + 2: at + 2 + size].decode("utf-8")
+                at += 2 + size
+    end = len(buf) if end is None else end
+    if end > at:
+        rec.update(_json_decode(buf[at:end].decode("utf-8"))[0])
+    return rec
+
+
+def iter_records(path: str, offset: int = 0, end: Optional[int] = None) -> Iterator[Tuple[Dict[str, Any], int]]:
+    """(record, offset after it) for every complete record between `offset` and `end`."""
+    d = dictionary(os.path.dirname(path))
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            buf = b""
+            pos = offset  # file offset of buf[0]
+            remaining = (end if end is not None else os.fstat(f.fileno()).st_size) - offset
+            while True:
+                at = 0
+                while len(buf) - at >= 4:
+                    n = _LEN.unpack_from(buf, at)[0]
+                    stop = at + 4 + n + 4
+                    if len(buf) < stop:
+                        break
+                    if _LEN.unpack_from(buf, stop - 4)[0] != n:
+                        return  # torn or foreign data: stop like at a partial line
+                    try:
+                        rec = decode(buf, d, at + 4, stop - 4)
+                    except Exception:
+                        rec = None
+                    at = stop
+                    if rec is not None:
+                        yield rec, pos + at
+                buf, pos = buf[at:], pos + at
+                if remaining <= 0:
+                    return
+                chunk = f.read(min(_CHUNK, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                buf += chunk
+    except OSError:
+        return
+
+
+def read_backwards(path: str, limit: int) -> List[Dict[str, Any]]:
+    """Up to `limit` records from the end of a `.bin` file, newest first."""
+    out: List[Dict[str, Any]] = []
+    d = dictionary(os.path.dirname(path))
+    try:
+        with open(path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)  # file offset of buf[0]
+            buf = b""
+            end = len(buf)  # records before buf[end] are still to read
+            while len(out) < limit and pos + end >= 8:
+                n = _LEN.unpack_from(buf, end - 4)[0] if end >= 4 else 0
+                if n + 8 > pos + end:
+                    break  # torn record at the end
+                if end < 8 or n + 8 > end:
+                    step = min(_BLOCK, pos)
+                    pos -= step
+                    f.seek(pos)
+                    buf = f.read(step) + buf[:end]
+                    end += step
+                    continue
+                start = end - 8 - n
+                if _LEN.unpack_from(buf, start)[0] != n:
+                    break  # torn record at the end
+                try:
+                    out.append(decode(buf, d, start + 4, end - 4))
+                except Exception:
+                    pass
+                end = start
+            torn = len(out) < limit and pos + end >= 8
+    except OSError:
+        return out
+    if torn:  # the last record is still being written: fall back to a forward pass
+        out = [rec for rec, _ in iter_records(path)][::-1][:limit]
+    return out
@@ -1,30 +1,431 @@
+"""
+Decisions log.
+
+By default every decision is appended to DECISIONS_PATH (data/metrics/decisions.jsonl).
+With DECISIONS_SEGMENTS=true the log is split into hourly segments in DECISIONS_DIR
+(default `decisions/` next to DECISIONS_PATH), named `decisions-YYYYMMDDTHH-NNN.jsonl`
+(UTC hour, NNN increments when a segment passes DECISIONS_SEGMENT_MAX_BYTES). With
+DECISIONS_FORMAT=binary records are written in the compact format of binlog.py instead, to
+`decisions.bin` or `.bin` segments; readers take both formats. With
+DECISIONS_AGGREGATE_WINDOW_SECONDS > 0 repeated autocorrects are collapsed into one record
+before they are written (aggregate.py). Once a
+segment is sealed (its hour is over or a newer part exists) it gets a sidecar
+`<segment>.idx` with its time range, line count, the byte offset of every
+DECISIONS_INDEX_STRIDE-th line and the decision count per rule and action (aggregated
+records, see aggregate.py, count for their `count`).
+
+`tail()` reads backwards from the newest segment (and the legacy file), so its cost
+depends on `limit`, not on the size of the log. `maintain()` runs in a background thread
+when a writer moves to a new hour (the append itself only opens the new segment): it brings the rollups (rollups.py) up to date, indexes sealed segments, merges
+whole days older than DECISIONS_COMPACT_AFTER_HOURS into one `decisions-YYYYMMDD.jsonl`
+segment and deletes segments older than DECISIONS_RETENTION_HOURS (0 disables either).
+"""
 import json
 import os
-from datetime import datetime, timezone
-from typing import Any, Dict, List
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
 
 _path = os.getenv("DECISIONS_PATH", "data/metrics/decisions.jsonl")
+_bin_path = os.path.splitext(_path)[0] + ".bin"
+_SEGMENT_RE = re.compile(r"^decisions-(\d{8})(?:T(\d{2})-(\d{3}))?(\.jsonl|\.bin)$")
+_BLOCK = 65536
+
+_wlock = Lock()
+_current: Dict[str, Any] = {"hour": None, "seq": 0, "dir": None, "ext": None}
+_mlock = Lock()
+_maint: Dict[str, Any] = {"thread": None, "pending": None}
+
+
+def segments_enabled() -> bool:
+    return os.getenv("DECISIONS_SEGMENTS", "false").lower() == "true"
+
+
+def segments_dir() -> str:
+    return os.getenv("DECISIONS_DIR") or os.path.join(os.path.dirname(_path) or ".", "decisions")
+
+
+def _max_bytes() -> int:
+    return int(os.getenv("DECISIONS_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def _stride() -> int:
+    return max(1, int(os.getenv("DECISIONS_INDEX_STRIDE", "1000")))
+
+
+def binary_enabled() -> bool:
+    return os.getenv("DECISIONS_FORMAT", "jsonl").lower() == "binary"
+
+
+def _legacy_paths() -> List[str]:
+    """The single-file log in both formats, oldest (JSONL) first."""
+    return [_path, _bin_path]
+
+
+def _segment_name(hour: str, seq: int, ext: str = ".jsonl") -> str:
+    return f"decisions-{hour}-{seq:03d}{ext}"
 
 
 def append(decision: Dict[str, Any]) -> None:
-    os.makedirs(os.path.dirname(_path) or ".", exist_ok=True)
-    d = {"ts": datetime.now(timezone.utc).isoformat(), **decision}
-    with open(_path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(d) + "\n")
+    now = datetime.now(timezone.utc)
+    from src.metrics import aggregate
+    if not aggregate.hold(decision, now, _write_held):
+        _write(decision, now)
 
 
-def tail(limit: int = 50) -> List[Dict[str, Any]]:
-    if not os.path.exists(_path):
+def flush() -> None:
+    """Write decisions held for aggregation (shutdown)."""
+    from src.metrics import aggregate
+    aggregate.flush()
+
+
+def _write_held(record: Dict[str, Any], first: datetime) -> None:
+    # stamped with the first decision, filed under the current hour
+    _write(record, first, datetime.now(timezone.utc))
+
+
+def _write(decision: Dict[str, Any], ts: datetime, now: Optional[datetime] = None) -> None:
+    if os.getenv("DECISIONS_BACKEND", "jsonl").lower() == "sqlite":
+        from src.metrics import sqlite_store
+        sqlite_store.append_decision({"ts": ts.isoformat(), **decision})
+        return
+    segmented = segments_enabled()
+    if binary_enabled():
+        from src.metrics import binlog
+        ext, path = ".bin", _bin_path
+        d = binlog.dictionary(segments_dir() if segmented else os.path.dirname(path))
+        data = binlog.encode({"ts": ts, **decision}, d)
+    else:
+        ext, path = ".jsonl", _path
+        data = (json.dumps({"ts": ts.isoformat(), **decision}) + "\n").encode("utf-8")
+    if segmented:
+        _append_segment(now or ts, data, ext)
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def _append_segment(now: datetime, data: bytes, ext: str = ".jsonl") -> None:
+    hour = now.strftime("%Y%m%dT%H")
+    d = segments_dir()
+    rotated = False
+    with _wlock:
+        if _current["hour"] != hour or _current["dir"] != d or _current["ext"] != ext:
+            os.makedirs(d, exist_ok=True)
+            parts = [s for s in segments() if s["hour"] == hour]
+            seq = max((s["seq"] for s in parts), default=0)
+            if any(s["seq"] == seq and s["ext"] != ext for s in parts):
+                seq += 1  # the format changed: new part
+            _current.update(hour=hour, seq=seq, dir=d, ext=ext)
+            rotated = True
+        while True:
+            with open(os.path.join(d, _segment_name(hour, _current["seq"], ext)), "ab") as f:
+                size = f.tell()
+                if size and size >= _max_bytes():
+                    _current["seq"] += 1
+                    continue
+                f.write(data)
+                break
+    if rotated:
+        _maintain_later(now, d)
+
+
+def _maintain_later(now: datetime, d: str) -> None:
+    """Run `maintain(now)` in the background; a run asked for while one is going follows it."""
+    with _mlock:
+        _maint["pending"] = (now, os.path.abspath(d))
+        t = _maint["thread"]
+        if t is None or not t.is_alive():
+            t = threading.Thread(target=_maintain_loop, name="decisions-maintain", daemon=True)
+            _maint["thread"] = t
+            t.start()
+
+
+def _maintain_loop() -> None:
+    while True:
+        with _mlock:
+            job = _maint["pending"]
+            _maint["pending"] = None
+            if job is None:
+                _maint["thread"] = None
+                return
+        now, d = job
+        if os.path.abspath(segments_dir()) != d:
+            continue  # the log moved (DECISIONS_DIR or working directory changed)
+        try:
+            maintain(now)
+        except Exception:
+            pass
+
+
+def wait_maintenance(timeout: Optional[float] = None) -> None:
+    """Wait for background maintenance to finish (tests, shutdown)."""
+    t = _maint["thread"]
+    if t is not None:
+        t.join(timeout)
+
+
+def segments() -> List[Dict[str, Any]]:
+    """Segments in DECISIONS_DIR, oldest first, with their UTC time bounds."""
+    d = segments_dir()
+    try:
+        names = os.listdir(d)
+    except OSError:
         return []
-    lines: List[str] = []
-    with open(_path, "r", encoding="utf-8") as f:
-        for line in f:
-            lines.append(line)
     out: List[Dict[str, Any]] = []
-    for line in lines[-limit:]:
+    for name in names:
+        m = _SEGMENT_RE.match(name)
+        if not m:
+            continue
+        day, hh, seq, ext = m.groups()
+        start = datetime.strptime(day + (hh or "00"), "%Y%m%d%H").replace(tzinfo=timezone.utc)
+        out.append({
+            "name": name,
+            "path": os.path.join(d, name),
+            "hour": f"{day}T{hh}" if hh else None,
+            "seq": int(seq or 0),
+            "ext": ext,
+            "start": start,
+            "end": start + (timedelta(hours=1) if hh else timedelta(days=1)),
+        })
+    out.sort(key=lambda s: (s["start"], s["hour"] is not None, s["seq"], s["ext"] == ".bin"))
+    return out
+
+
+def _sealed(seg: Dict[str, Any], all_segments: List[Dict[str, Any]], now: datetime) -> bool:
+    if seg["end"] <= now:
+        return True
+    return any(s["hour"] == seg["hour"] and s["seq"] > seg["seq"] for s in all_segments)
+
+
+def _records(path: str) -> Iterator[Tuple[Optional[Dict[str, Any]], int]]:
+    """(record or None, byte size) for every line or binary record of a log file."""
+    if path.endswith(".bin"):
+        from src.metrics import binlog
+        pos = 0
+        for rec, nxt in binlog.iter_records(path):
+            yield rec, nxt - pos
+            pos = nxt
+        return
+    with open(path, "rb") as f:
+        for raw in f:
+            try:
+                rec = json.loads(raw)
+            except Exception:
+                rec = None
+            yield (rec if isinstance(rec, dict) else None), len(raw)
+
+
+def _scan(path: str) -> Dict[str, Any]:
+    from src.metrics import aggregate
+    stride = _stride()
+    first = last = None
+    lines = 0
+    offsets: List[int] = []
+    counts: Dict[str, Dict[str, int]] = {}
+    pos = 0
+    for rec, size in _records(path):
+        if lines % stride == 0:
+            offsets.append(pos)
+        pos += size
+        lines += 1
+        if rec is None:
+            continue
+        ts = rec.get("ts")
+        if ts:
+            first = ts if first is None or ts < first else first
+            last = ts if last is None or ts > last else last
+        by_action = counts.setdefault(rec.get("rule_id") or "", {})
+        action = rec.get("action") or ""
+        by_action[action] = by_action.get(action, 0) + aggregate.count(rec)
+    return {"first_ts": first, "last_ts": last, "lines": lines, "bytes": pos, "stride": stride, "offsets": offsets, "counts": counts}
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def index(path: str, write: bool = True) -> Dict[str, Any]:
+    """Sidecar index of a segment, rebuilt when missing or stale (the segment grew)."""
+    try:
+        with open(path + ".idx", "r", encoding="utf-8") as f:
+            idx = json.load(f)
+        if idx.get("bytes") == os.path.getsize(path):
+            return idx
+    except Exception:
+        pass
+    idx = _scan(path)
+    if write:
+        _write_json(path + ".idx", idx)
+    return idx
+
+
+def _remove(path: str) -> None:
+    for p in (path, path + ".idx"):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+
+def _compact(day: str, parts: List[Dict[str, Any]]) -> bool:
+    from src.metrics import rollups
+    target = os.path.join(segments_dir(), f"decisions-{day}{parts[0]['ext']}")
+
+    def merge() -> None:
+        tmp = f"{target}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as out:
+            for seg in parts:
+                with open(seg["path"], "rb") as f:
+                    while True:
+                        chunk = f.read(_BLOCK)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+        os.replace(tmp, target)
+        for seg in parts:
+            _remove(seg["path"])
+
+    # the rollups must not count the merged day twice
+    if not rollups.handover([seg["path"] for seg in parts], target, merge):
+        return False
+    _write_json(target + ".idx", _scan(target))
+    return True
+
+
+def maintain(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Index sealed segments, compact old days and apply retention (one process at a time)."""
+    now = now or datetime.now(timezone.utc)
+    d = segments_dir()
+    if not os.path.isdir(d):
+        return {}
+    retention = float(os.getenv("DECISIONS_RETENTION_HOURS", "0"))
+    compact_after = float(os.getenv("DECISIONS_COMPACT_AFTER_HOURS", "0"))
+    stats = {"removed": 0, "compacted": 0, "indexed": 0}
+    with open(os.path.join(d, ".maintain.lock"), "a") as lockf:
+        if fcntl:
+            try:
+                fcntl.flock(lockf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return stats  # another process is at it
         try:
-            out.append(json.loads(line))
+            from src.metrics import rollups
+            rollups.refresh()  # count segments before retention deletes them
         except Exception:
-            continue
+            pass
+        segs = segments()
+        if retention > 0:
+            cutoff = now - timedelta(hours=retention)
+            for seg in [s for s in segs if s["end"] <= cutoff]:
+                _remove(seg["path"])
+                stats["removed"] += 1
+            segs = segments()
+        if compact_after > 0:
+            cutoff = now - timedelta(hours=compact_after)
+            days: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+            for seg in segs:
+                if seg["hour"] is not None:  # one merged file per day and format
+                    days.setdefault((seg["hour"][:8], seg["ext"]), []).append(seg)
+            for (day, ext), parts in sorted(days.items()):
+                day_end = datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc) + timedelta(days=1)
+                if day_end <= cutoff and not any(s["hour"] is None and s["name"] == f"decisions-{day}{ext}" for s in segs):
+                    if _compact(day, parts):
+                        stats["compacted"] += len(parts)
+            segs = segments()
+        for seg in segs:
+            if _sealed(seg, segs, now) and not os.path.exists(seg["path"] + ".idx"):
+                index(seg["path"])
+                stats["indexed"] += 1
+    return stats
+
+
+def _read_backwards(path: str, limit: int) -> List[Dict[str, Any]]:
+    """Up to `limit` valid records from the end of a log file, newest first."""
+    if path.endswith(".bin"):
+        from src.metrics import binlog
+        return binlog.read_backwards(path, limit)
+    out: List[Dict[str, Any]] = []
+    try:
+        with open(path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            rest = b""
+            while pos > 0 and len(out) < limit:
+                step = min(_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                lines = (f.read(step) + rest).split(b"\n")
+                rest = lines.pop(0) if pos > 0 else b""
+                for raw in reversed(lines):
+                    if not raw.strip():
+                        continue
+                    try:
+                        out.append(json.loads(raw))
+                    except Exception:
+                        continue
+                    if len(out) >= limit:
+                        break
+    except OSError:
+        return out
+    return out
+
+
+def sources() -> List[Dict[str, Any]]:
+    """
+    Every decisions log file, oldest first: `path` and the UTC bounds `start`/`end` (None
+    for decisions.jsonl/.bin), plus the fields of `segments()` for segments. The legacy
+    files are the oldest when segments are on. Readers that follow the log (rollups, the
+    converter) go through this instead of the directory layout.
+    """
+    legacy = [{"path": p, "start": None, "end": None} for p in _legacy_paths()]
+    segs = segments()
+    return legacy + segs if segments_enabled() else segs + legacy
+
+
+def tail(limit: int = 50) -> List[Dict[str, Any]]:
+    """The last `limit` decisions, oldest first."""
+    out: List[Dict[str, Any]] = []
+    if limit <= 0:
+        return out
+    from src.metrics import sqlite_store
+    if sqlite_store.decisions_enabled():  # newer than anything in the files
+        out = sqlite_store.tail(limit)
+        out.reverse()
+    for src in reversed(sources()):
+        if len(out) >= limit:
+            break
+        out.extend(_read_backwards(src["path"], limit - len(out)))
+        if len(out) >= limit:
+            break
+    out.reverse()
     return out
 
+
+def iter_day(day: str) -> Iterator[Dict[str, Any]]:
+    """Decisions whose `ts` falls on `day` (YYYY-MM-DD); segments of other days are not read."""
+    from src.metrics import aggregate
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    window = aggregate.window_seconds()
+    # aggregated records are written up to about two windows after their `ts`
+    end = start + timedelta(days=1, seconds=2 * window + 1 if window else 0)
+    for src in sources():
+        if src["start"] is not None and (src["end"] <= start or src["start"] >= end):
+            continue
+        try:
+            for d, _ in _records(src["path"]):
+                if d is not None and str(d.get("ts", "")).startswith(day):
+                    yield d
+        except OSError:
+            continue
+    from src.metrics import sqlite_store
+    yield from sqlite_store.iter_day(day)
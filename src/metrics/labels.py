@@ -0,0 +1,56 @@
+"""
+Bounded label values for the Prometheus counters.
+
+Rule ids are free-form and churn as rules are added and retired; every distinct id would
+otherwise become a new time series that lives until the process restarts. The first
+PROM_MAX_RULE_LABELS (default 200) rule ids seen keep their own label, later ones are
+folded into `other`. No prometheus_client import here, so the JSON fallback exposition
+in the API applies the same cap.
+"""
+import os
+from threading import Lock
+from typing import Optional, Tuple
+
+OTHER = "other"
+
+
+class BoundedLabels:
+    def __init__(self, limit: int):
+        self.limit = max(0, limit)
+        self._seen: set = set()
+        self._lock = Lock()
+        self.folded = 0  # lookups answered with OTHER
+
+    def get(self, value: Optional[str]) -> str:
+        value = value or ""
+        if value in self._seen:
+            return value
+        with self._lock:
+            if value in self._seen:
+                return value
+            if len(self._seen) < self.limit:
+                self._seen.add(value)
+                return value
+            self.folded += 1
+        return OTHER
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._seen.clear()
+            self.folded = 0
+
+
+rules = BoundedLabels(int(os.getenv("PROM_MAX_RULE_LABELS", "200")))
+
+
+def split_key(key: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """`rule:<id>:<action>` / `shadow:<id>:<action>` -> (family, id, action); plain keys -> (key, None, None)."""
+    family, sep, rest = key.partition(":")
+    if sep and family in ("rule", "shadow"):
+        rule_id, _, action = rest.rpartition(":")
+        if rule_id and action:
+            return family, rule_id, action
+    return key, None, None
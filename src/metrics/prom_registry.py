@@ -1,9 +1,38 @@
-from prometheus_client import Counter, Histogram
+"""
+Prometheus metrics of the proxy.
 
-metric_counter = Counter(
-    "sqlumai_metric_total",
-    "SQLumAI counters (key or rule/action)",
-    labelnames=("key", "rule", "action"),
+With PROMETHEUS_MULTIPROC_DIR set (in the process environment, before start) every worker
+process writes its samples to files in that directory and `/metrics/prom` aggregates them:
+counters and histograms are summed, gauges are summed (connections, buffered bytes) or
+maxed (loop lag, breaker state) over the live processes. Empty the directory before
+starting a new set of workers.
+"""
+import os
+from typing import Dict, Tuple
+
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from src.metrics import labels
+
+events_counter = Counter(
+    "sqlumai_events_total",
+    "SQLumAI event counters by key (allowed, blocks, autocorrect_suggested, ...)",
+    labelnames=("key",),
+)
+
+rule_actions_counter = Counter(
+    "sqlumai_rule_actions_total",
+    "Rule decisions by rule and action (rules past PROM_MAX_RULE_LABELS count as 'other')",
+    labelnames=("rule", "action"),
+)
+
+shadow_actions_counter = Counter(
+    "sqlumai_shadow_actions_total",
+    "Proposed-rule decisions in shadow evaluation by rule and action",
+    labelnames=("rule", "action"),
 )
 
 bytes_hist = Histogram(
@@ -18,6 +47,70 @@ latency_hist = Histogram(
     buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 250),
 )
 
+buffered_gauge = Gauge(
+    "sqlumai_reassembly_buffered_bytes",
+    "Bytes of client messages currently held for reassembly (all connections)",
+    multiprocess_mode="livesum",
+)
+
+loop_lag_gauge = Gauge(
+    "sqlumai_event_loop_lag_ms",
+    "Most recent event loop lag (ms): how late a periodic timer fired",
+    multiprocess_mode="livemax",
+)
+
+loop_lag_hist = Histogram(
+    "sqlumai_event_loop_lag_hist_ms",
+    "Event loop lag (ms)",
+    buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000),
+)
+
+breaker_gauge = Gauge(
+    "sqlumai_inspection_breaker_state",
+    "Inspection circuit breaker state (0 closed, 1 half-open, 2 open)",
+    multiprocess_mode="livemax",
+)
+
+connections_gauge = Gauge(
+    "sqlumai_connections_active",
+    "Client connections currently open through the proxy",
+    multiprocess_mode="livesum",
+)
+
+stage_hist = Histogram(
+    "sqlumai_stage_ms",
+    "Inspection pipeline time per stage and statement kind (ms, STAGE_TIMING=true)",
+    labelnames=("stage", "kind"),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 100),
+)
+
+# pre-bound children per (key, rule, action) as passed in; the label lookup runs once
+_children: Dict[Tuple[str, str, str], object] = {}
+_CHILDREN_MAX = 10000  # retired rule ids would otherwise pin cache entries forever
+
+
+def _child(key: str, rule: str, action: str):
+    family, rid, act = (key, rule, action) if rule else labels.split_key(key)
+    if rid is None:
+        return events_counter.labels(key=family)
+    counter = shadow_actions_counter if family == "shadow" else rule_actions_counter
+    return counter.labels(rule=labels.rules.get(rid), action=act or "")
+
+
 def inc_counter(key: str, rule: str | None = None, action: str | None = None, by: int = 1):
-    metric_counter.labels(key=key or "", rule=rule or "", action=action or "").inc(by)
+    """`inc_counter("allowed")`, `inc_counter("rule", rule_id, action)` or a `rule:<id>:<action>` key."""
+    k = (key or "", rule or "", action or "")
+    child = _children.get(k)
+    if child is None:
+        if len(_children) >= _CHILDREN_MAX:
+            _children.clear()
+        child = _children[k] = _child(*k)
+    child.inc(by)
+
 
+def mark_process_dead(pid: int | None = None) -> None:
+    """Drop a stopped worker's live gauges from the multiprocess directory."""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid(), path)
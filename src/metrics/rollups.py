@@ -0,0 +1,305 @@
+"""
+Per-hour decision rollups behind `/dryrun.json`, `/dryrun.html` and the dry-run report.
+
+ROLLUPS_PATH (default data/metrics/rollups.json) holds weighted decision counts per
+(UTC hour, rule_id, action) for every decisions log file, plus up to three sample
+statements per day and rule. It is maintained incrementally: `refresh()` reads only what
+was appended to each log file (decisions.jsonl or .bin and the segments) since that
+file's watermark, the byte offset already counted. Queries therefore give exact totals for
+any date range at a cost set by the number of hours and rules, not by the size of the log.
+The proxy keeps the watermarks close to the end of the log with `run_rollup_refresher`,
+which refreshes in a worker thread at start (the catch-up after a deploy, which reads the
+whole log once) and then every ROLLUPS_REFRESH_SECONDS (60); appends never refresh.
+
+A file that shrank or was replaced is recounted from the start. Counts of deleted files
+(segment retention) move to `archived` and are kept. Compaction hands the counts of a
+day's segments to the merged file (`handover`). The state is updated under a file lock,
+so several processes can refresh it. Decisions stored in SQLite (sqlite_store.py) have
+their own rollup table, which queries add in.
+"""
+import asyncio
+import json
+import os
+from contextlib import contextmanager
+from threading import RLock
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+SAMPLES_PER_RULE = 3
+_CHUNK = 1 << 20
+_lock = RLock()
+_cache: Dict[str, Any] = {"key": None, "state": None}
+
+
+def rollups_path() -> str:
+    return os.getenv("ROLLUPS_PATH", "data/metrics/rollups.json")
+
+
+def _empty_counts() -> Dict[str, Any]:
+    return {"hours": {}, "sampled": []}
+
+
+def _new_state() -> Dict[str, Any]:
+    return {"sources": {}, "archived": _empty_counts(), "samples": {}}
+
+
+def _weight(rec: Dict[str, Any]) -> int:
+    """
+    Messages a record stands for: sampled inspections (INSPECT_SAMPLE_RATE) carry a weight,
+    aggregated records (aggregate.py) the number of decisions they collapse.
+    """
+    from src.metrics.aggregate import count
+    try:
+        weight = max(1, int(rec.get("weight", 1)))
+    except Exception:
+        weight = 1
+    return weight * count(rec)
+
+
+def _hour(ts: str) -> Optional[str]:
+    if len(ts) >= 13 and ts[10] == "T":
+        return ts[:13]
+    if len(ts) >= 10:
+        return ts[:10] + "T00"
+    return None
+
+
+def _merge(into: Dict[str, Any], other: Dict[str, Any]) -> None:
+    for hour, rules in other["hours"].items():
+        dst = into["hours"].setdefault(hour, {})
+        for rid, acts in rules.items():
+            d = dst.setdefault(rid, {})
+            for act, n in acts.items():
+                d[act] = d.get(act, 0) + n
+    into["sampled"] = sorted(set(into["sampled"]) | set(other["sampled"]))
+
+
+def _ingest(state: Dict[str, Any], src: Dict[str, Any], rec: Dict[str, Any]) -> None:
+    hour = _hour(str(rec.get("ts", "")))
+    if hour is None:
+        return
+    rid = rec.get("rule_id") or "(no_rule)"
+    act = (rec.get("action") or "").lower()
+    acts = src["hours"].setdefault(hour, {}).setdefault(rid, {})
+    acts[act] = acts.get(act, 0) + _weight(rec)
+    if "weight" in rec and hour not in src["sampled"]:
+        src["sampled"].append(hour)
+    sample = rec.get("sample") or rec.get("before")
+    if sample:
+        kept = state["samples"].setdefault(hour[:10], {}).setdefault(rid, [])
+        if len(kept) < SAMPLES_PER_RULE:
+            kept.append(str(sample)[:200])
+
+
+def _count_lines(state: Dict[str, Any], src: Dict[str, Any], data: bytes) -> None:
+    for raw in data.split(b"\n"):
+        if not raw.strip():
+            continue
+        try:
+            rec = json.loads(raw)
+        except Exception:
+            continue
+        if isinstance(rec, dict):
+            _ingest(state, src, rec)
+
+
+def _read_new(state: Dict[str, Any], path: str, src: Dict[str, Any], size: int) -> None:
+    """Count the complete records between the watermark and `size`, advancing the watermark."""
+    if path.endswith(".bin"):
+        from src.metrics import binlog
+        for rec, nxt in binlog.iter_records(path, src["offset"], size):
+            _ingest(state, src, rec)
+            src["offset"] = nxt
+        return
+    with open(path, "rb") as f:
+        f.seek(src["offset"])
+        rest = b""
+        remaining = size - src["offset"]
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            data = rest + chunk
+            end = data.rfind(b"\n") + 1
+            _count_lines(state, src, data[:end])
+            src["offset"] += end
+            rest = data[end:]
+    if rest.strip():
+        try:  # last line without a newline: counted if it is a whole record
+            json.loads(rest)
+        except Exception:
+            return  # still being written
+        _count_lines(state, src, rest)
+        src["offset"] += len(rest)
+
+
+def _load() -> Dict[str, Any]:
+    path = rollups_path()
+    try:
+        st = os.stat(path)
+    except OSError:
+        return _new_state()
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if _cache["key"] == key:
+        return _cache["state"]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except Exception:
+        state = _new_state()
+    _cache.update(key=key, state=state)
+    return state
+
+
+def _save(state: Dict[str, Any]) -> None:
+    path = rollups_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+    st = os.stat(path)
+    _cache.update(key=(os.path.abspath(path), st.st_mtime_ns, st.st_size), state=state)
+
+
+@contextmanager
+def _locked():
+    path = rollups_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _lock, open(path + ".lock", "a") as lockf:
+        if fcntl:
+            fcntl.flock(lockf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lockf, fcntl.LOCK_UN)
+
+
+def _refresh_locked() -> Dict[str, Any]:
+    from src.metrics import decisions as decisions_store
+    state = _load()
+    changed = False
+    live = set()
+    for source in decisions_store.sources():
+        path = source["path"]
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        live.add(path)
+        src = state["sources"].get(path)
+        if src is not None and (src["ino"] != st.st_ino or st.st_size < src["offset"]):
+            src = None  # rewritten: recount
+        if src is None:
+            src = state["sources"][path] = {"ino": st.st_ino, "offset": 0, **_empty_counts()}
+            changed = True
+        if st.st_size > src["offset"]:
+            before = src["offset"]
+            _read_new(state, path, src, st.st_size)
+            changed = changed or src["offset"] != before
+    for path in [p for p in state["sources"] if p not in live]:
+        _merge(state["archived"], state["sources"].pop(path))  # retention removed it
+        changed = True
+    if changed:
+        _save(state)
+    return state
+
+
+def refresh() -> Dict[str, Any]:
+    """Count what was appended since the last refresh; returns the state."""
+    with _locked():
+        try:
+            return _refresh_locked()
+        except Exception:
+            reset()  # the cached state may be half updated
+            raise
+
+
+def handover(paths: List[str], target: str, merge: Callable[[], None]) -> bool:
+    """
+    Run `merge()` (which concatenates `paths` into `target` and removes them) and move
+    their counts to `target`. Skipped (False) unless every part is fully counted.
+    """
+    with _locked():
+        state = _refresh_locked()
+        for p in paths:
+            src = state["sources"].get(p)
+            if src is None or src["offset"] != os.path.getsize(p):
+                return False
+        merge()
+        merged = {"ino": os.stat(target).st_ino, "offset": os.path.getsize(target), **_empty_counts()}
+        for p in paths:
+            _merge(merged, state["sources"].pop(p))
+        state["sources"][target] = merged
+        _save(state)
+    return True
+
+
+def _refresh_seconds() -> float:
+    return float(os.getenv("ROLLUPS_REFRESH_SECONDS", "60"))
+
+
+async def run_rollup_refresher(stop_event: asyncio.Event) -> None:
+    """Refresh off the event loop: once at start, then every ROLLUPS_REFRESH_SECONDS (0: only at start)."""
+    while not stop_event.is_set():
+        try:
+            await asyncio.to_thread(refresh)
+        except Exception:
+            pass
+        interval = _refresh_seconds()
+        if interval <= 0:
+            return
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            continue
+
+
+def query(start: str, end: Optional[str] = None, rule: Optional[str] = None, action: Optional[str] = None) -> Dict[str, Any]:
+    """Weighted counts per rule and action for the days `start`..`end` (inclusive, YYYY-MM-DD)."""
+    end = end or start
+    state = refresh()
+    rules: Dict[str, Dict[str, int]] = {}
+    sampled = False
+    for counts in [state["archived"], *state["sources"].values()]:
+        for hour, by_rule in counts["hours"].items():
+            if not start <= hour[:10] <= end:
+                continue
+            for rid, acts in by_rule.items():
+                if rule and rid != rule:
+                    continue
+                for act, n in acts.items():
+                    if action and act != action:
+                        continue
+                    dst = rules.setdefault(rid, {})
+                    dst[act] = dst.get(act, 0) + n
+        sampled = sampled or any(start <= h[:10] <= end for h in counts["sampled"])
+    from src.metrics import sqlite_store
+    if sqlite_store.available():  # DECISIONS_BACKEND=sqlite keeps its rollup in the database
+        db = sqlite_store.rollup(start, end, rule, action)
+        for rid, acts in db["rules"].items():
+            dst = rules.setdefault(rid, {})
+            for act, n in acts.items():
+                dst[act] = dst.get(act, 0) + n
+        sampled = sampled or db["sampled"]
+    return {"rules": rules, "sampled": sampled}
+
+
+def samples(day: str) -> Dict[str, List[str]]:
+    """Up to three sample statements per rule for `day`."""
+    out = {rid: list(kept) for rid, kept in refresh()["samples"].get(day, {}).items()}
+    from src.metrics import sqlite_store
+    if sqlite_store.available():
+        for rid, kept in sqlite_store.samples(day).items():
+            out[rid] = (out.get(rid, []) + kept)[:SAMPLES_PER_RULE]
+    return out
+
+
+def reset() -> None:
+    _cache.update(key=None, state=None)
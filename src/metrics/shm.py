@@ -0,0 +1,274 @@
+"""
+Shared-memory counter plane (METRICS_BACKEND=shm).
+
+Every process owns one fixed-layout segment file in METRICS_SHM_DIR (default
+data/metrics/shm; point it at /dev/shm for a RAM-backed one), mapped with mmap:
+
+    header  magic (8) | seq u64 | nkeys u32 | slots u32 | key_bytes u32, padded to 64 bytes
+    keys    slots x key_bytes: u16 length + UTF-8 key
+    values  slots x i64
+
+Only the owning process writes its segment, so an increment is a plain in-memory add with
+no cross-process lock. The sequence counter is odd while a write is in progress; readers
+retry until they copy a segment between two equal, even values (a seqlock), so
+`snapshot()` never sees half of an `inc_many`. It sums the segments of the live processes
+and `base.json`, into which it folds (and then removes) the segments of exited processes,
+so totals survive restarts and the directory does not grow with every restart. Folding
+holds an exclusive lock on `.lock`; readers and new segments hold it shared. Keys that do
+not fit (directory full, key longer than key_bytes - 2) are returned to the caller, which
+keeps them in the JSON file.
+"""
+import glob
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from threading import RLock
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+MAGIC = b"SQLMCTR1"
+HEADER_BYTES = 64
+_HDR = struct.Struct("<8sQIII")
+_SEQ = struct.Struct("<Q")
+_NKEYS = struct.Struct("<I")
+_LEN = struct.Struct("<H")
+_I64 = struct.Struct("<q")
+SEQ_AT = 8
+NKEYS_AT = 16
+BASE_NAME = "base.json"
+
+_lock = RLock()
+_segment: Optional["Segment"] = None
+
+
+def shm_dir() -> str:
+    return os.getenv("METRICS_SHM_DIR", "data/metrics/shm")
+
+
+def _slots() -> int:
+    return int(os.getenv("METRICS_SHM_SLOTS", "4096"))
+
+
+def _key_bytes() -> int:
+    return int(os.getenv("METRICS_SHM_KEY_BYTES", "128"))
+
+
+@contextmanager
+def _dir_lock(exclusive: bool):
+    """Lock on the directory's `.lock` file: shared to read or create, exclusive to fold."""
+    directory = shm_dir()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "ab") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, owned by someone else
+    return True
+
+
+def _pid(path: str) -> Optional[int]:
+    try:
+        return int(os.path.basename(path)[len("counters-"):-len(".shm")])
+    except ValueError:
+        return None
+
+
+def _entries(buf, nkeys: int, slots: int, key_bytes: int) -> Dict[str, int]:
+    values_at = HEADER_BYTES + slots * key_bytes
+    out: Dict[str, int] = {}
+    for i in range(min(nkeys, slots)):
+        at = HEADER_BYTES + i * key_bytes
+        n = _LEN.unpack_from(buf, at)[0]
+        key = bytes(buf[at + 2: at + 2 + n]).decode("utf-8", "replace")
+        out[key] = _I64.unpack_from(buf, values_at + 8 * i)[0]
+    return out
+
+
+class Segment:
+    """The current process's counters (single writer)."""
+
+    def __init__(self, path: str, slots: int, key_bytes: int):
+        self.path = path
+        key_bytes = max(8, (key_bytes + 7) // 8 * 8)  # keep the value array 8-byte aligned
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, _HDR.size, 0)
+            adopt = len(header) == _HDR.size and header[:8] == MAGIC
+            if adopt:  # a segment left by an earlier process with our pid
+                _, _, _, slots, key_bytes = _HDR.unpack(header)
+            size = HEADER_BYTES + slots * (key_bytes + 8)
+            if not adopt:
+                os.ftruncate(fd, 0)
+            os.ftruncate(fd, max(size, os.fstat(fd).st_size))
+            self.buf = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.slots = slots
+        self.key_bytes = key_bytes
+        self.values_at = HEADER_BYTES + slots * key_bytes
+        if adopt:
+            seq = _SEQ.unpack_from(self.buf, SEQ_AT)[0]
+            if seq & 1:  # the previous owner died mid-write
+                _SEQ.pack_into(self.buf, SEQ_AT, seq + 1)
+            nkeys = _NKEYS.unpack_from(self.buf, NKEYS_AT)[0]
+            self.index = {k: i for i, k in enumerate(_entries(self.buf, nkeys, slots, key_bytes))}
+        else:
+            _HDR.pack_into(self.buf, 0, MAGIC, 0, 0, slots, key_bytes)
+            self.index = {}
+
+    def _slot(self, key: str) -> Optional[int]:
+        i = self.index.get(key)
+        if i is not None:
+            return i
+        raw = key.encode("utf-8")
+        if len(raw) > self.key_bytes - 2 or len(self.index) >= self.slots:
+            return None
+        i = len(self.index)
+        at = HEADER_BYTES + i * self.key_bytes
+        _LEN.pack_into(self.buf, at, len(raw))
+        self.buf[at + 2: at + 2 + len(raw)] = raw
+        _NKEYS.pack_into(self.buf, NKEYS_AT, i + 1)
+        self.index[key] = i
+        return i
+
+    def add(self, counts: Dict[str, int]) -> Dict[str, int]:
+        """Add `counts`; returns the ones without a slot."""
+        rest: Dict[str, int] = {}
+        buf = self.buf
+        seq = _SEQ.unpack_from(buf, SEQ_AT)[0]
+        _SEQ.pack_into(buf, SEQ_AT, seq + 1)
+        try:
+            for key, by in counts.items():
+                i = self._slot(key)
+                if i is None:
+                    rest[key] = by
+                    continue
+                at = self.values_at + 8 * i
+                _I64.pack_into(buf, at, _I64.unpack_from(buf, at)[0] + int(by))
+        finally:
+            _SEQ.pack_into(buf, SEQ_AT, seq + 2)
+        return rest
+
+    def close(self) -> None:
+        try:
+            self.buf.close()
+        except Exception:
+            pass
+
+
+def read_segment(path: str, retries: int = 1000) -> Dict[str, int]:
+    """Consistent copy of one segment's counters (empty if it is not a segment)."""
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER_BYTES:
+                return {}
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return {}
+    try:
+        magic, _, _, slots, key_bytes = _HDR.unpack_from(buf, 0)
+        if magic != MAGIC or len(buf) < HEADER_BYTES + slots * (key_bytes + 8):
+            return {}
+        data: Dict[str, int] = {}
+        for _ in range(retries):
+            seq = _SEQ.unpack_from(buf, SEQ_AT)[0]
+            if seq & 1:
+                continue
+            data = _entries(buf, _NKEYS.unpack_from(buf, NKEYS_AT)[0], slots, key_bytes)
+            if _SEQ.unpack_from(buf, SEQ_AT)[0] == seq:
+                return data
+        return data  # writer never paused; best effort
+    finally:
+        buf.close()
+
+
+def segment() -> Segment:
+    """This process's segment, (re)opened after a fork or a change of METRICS_SHM_DIR."""
+    global _segment
+    path = os.path.join(shm_dir(), f"counters-{os.getpid()}.shm")
+    if _segment is None or _segment.path != path:
+        with _dir_lock(exclusive=False):  # not while an old segment with our pid is folded
+            _segment = Segment(path, _slots(), _key_bytes())
+    return _segment
+
+
+def add(counts: Dict[str, int]) -> Dict[str, int]:
+    with _lock:
+        return segment().add(counts)
+
+
+def _segments():
+    return sorted(glob.glob(os.path.join(shm_dir(), "counters-*.shm")))
+
+
+def _read_base(path: str) -> Dict[str, int]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def fold_exited() -> int:
+    """Add the segments of exited processes to `base.json` and remove them; returns how many."""
+    me = os.getpid()
+    if not any(p != me and not _alive(p) for p in map(_pid, _segments()) if p is not None):
+        return 0
+    base_path = os.path.join(shm_dir(), BASE_NAME)
+    with _dir_lock(exclusive=True):
+        dead = [path for path in _segments() if _pid(path) not in (None, me) and not _alive(_pid(path))]
+        if not dead:
+            return 0
+        base = _read_base(base_path)
+        for path in dead:
+            for key, v in read_segment(path).items():
+                base[key] = base.get(key, 0) + v
+        tmp = f"{base_path}.{me}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(base, f)
+        os.replace(tmp, base_path)
+        for path in dead:
+            os.remove(path)
+    return len(dead)
+
+
+def snapshot() -> Dict[str, int]:
+    """Counters summed over `base.json` and every segment in METRICS_SHM_DIR."""
+    try:
+        fold_exited()
+    except Exception:
+        pass
+    with _dir_lock(exclusive=False):
+        out = _read_base(os.path.join(shm_dir(), BASE_NAME))
+        for path in _segments():
+            for key, v in read_segment(path).items():
+                out[key] = out.get(key, 0) + v
+    return out
+
+
+def reset() -> None:
+    """Drop this process's mapping (tests); the next add reopens the segment."""
+    global _segment
+    with _lock:
+        if _segment is not None:
+            _segment.close()
+        _segment = None
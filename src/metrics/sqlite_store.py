@@ -0,0 +1,357 @@
+"""
+SQLite storage for decisions (DECISIONS_BACKEND=sqlite) and counters (METRICS_BACKEND=sqlite).
+
+One database file (SQLITE_PATH, default data/metrics/sqlumai.db) in WAL mode, so readers
+never block the writer. Callers only enqueue: a writer thread per process takes everything
+queued (up to SQLITE_BATCH_MAX items) and writes it in one transaction. The same
+transaction updates the decisions table (indexed on ts, rule_id, action, spid and column),
+the hourly rollup behind the dry-run views, up to three samples per day and rule, and the
+counters. When the queue (SQLITE_QUEUE_MAX) is full, the caller writes its item itself
+rather than dropping it. A batch that fails is logged and retried once before it is dropped.
+
+`query()` pages through decisions newest first with a cursor (the last id returned), so
+every page is an index range scan whatever the table size.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS decisions (
+    id INTEGER PRIMARY KEY,
+    ts TEXT NOT NULL,
+    spid INTEGER,
+    rule_id TEXT,
+    action TEXT,
+    column_name TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS decisions_ts ON decisions(ts);
+CREATE INDEX IF NOT EXISTS decisions_rule ON decisions(rule_id);
+CREATE INDEX IF NOT EXISTS decisions_action ON decisions(action);
+CREATE INDEX IF NOT EXISTS decisions_spid ON decisions(spid);
+CREATE INDEX IF NOT EXISTS decisions_column ON decisions(column_name);
+CREATE TABLE IF NOT EXISTS rollup_hourly (
+    hour TEXT NOT NULL,
+    rule_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    sampled INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, rule_id, action)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_samples (
+    day TEXT NOT NULL,
+    rule_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    sample TEXT NOT NULL,
+    PRIMARY KEY (day, rule_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+logger = logging.getLogger("sqlite_store")
+_lock = threading.Lock()
+_writer: Optional["_Writer"] = None
+_local = threading.local()
+
+
+def db_path() -> str:
+    return os.getenv("SQLITE_PATH", "data/metrics/sqlumai.db")
+
+
+def decisions_enabled() -> bool:
+    return os.getenv("DECISIONS_BACKEND", "jsonl").lower() == "sqlite"
+
+
+def counters_enabled() -> bool:
+    return os.getenv("METRICS_BACKEND", "json").lower() == "sqlite"
+
+
+def available() -> bool:
+    return os.path.exists(db_path())
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _conn() -> sqlite3.Connection:
+    """Connection of the calling thread (reads and the queue-full fallback)."""
+    path = db_path()
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != path or _local.pid != os.getpid():
+        conn = _local.conn = _connect(path)
+        _local.path, _local.pid = path, os.getpid()
+    return conn
+
+
+def _write_batch(conn: sqlite3.Connection, items: List[Tuple[str, Any]], kept: Dict[Tuple[str, str], int]) -> None:
+    """
+    Write `items` in one transaction. `kept` caches the sample count per (day, rule); it
+    only takes the new counts once the transaction commits, and forgets days before the
+    newest one in the batch (a late record for them reads its count again).
+    """
+    from src.metrics.rollups import _hour, _weight
+    seen: Dict[Tuple[str, str], int] = {}
+    rows = []
+    hourly: Dict[Tuple[str, str, str], List[int]] = {}
+    samples = []
+    counters: Dict[str, int] = {}
+    for kind, payload in items:
+        if kind == "c":
+            for key, by in payload.items():
+                counters[key] = counters.get(key, 0) + int(by)
+            continue
+        rec = payload
+        ts = str(rec.get("ts", ""))
+        rid = rec.get("rule_id")
+        action = rec.get("action")
+        rows.append((ts, rec.get("spid"), rid, action, rec.get("column"), json.dumps(rec)))
+        hour = _hour(ts)
+        if hour is None:
+            continue
+        key = (hour, rid or "(no_rule)", (action or "").lower())
+        agg = hourly.setdefault(key, [0, 0])
+        agg[0] += _weight(rec)
+        agg[1] = agg[1] or int("weight" in rec)
+        sample = rec.get("sample") or rec.get("before")
+        if sample:
+            day_rule = (hour[:10], key[1])
+            if day_rule not in seen:
+                n = kept.get(day_rule)
+                if n is None:
+                    n = conn.execute("SELECT count(*) FROM rollup_samples WHERE day=? AND rule_id=?", day_rule).fetchone()[0]
+                seen[day_rule] = n
+            if seen[day_rule] < 3:
+                samples.append((*day_rule, seen[day_rule], str(sample)[:200]))
+                seen[day_rule] += 1
+    with conn:
+        if rows:
+            conn.executemany("INSERT INTO decisions(ts, spid, rule_id, action, column_name, data) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if hourly:
+            conn.executemany(
+                "INSERT INTO rollup_hourly(hour, rule_id, action, n, sampled) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(hour, rule_id, action) DO UPDATE SET n = n + excluded.n, sampled = max(sampled, excluded.sampled)",
+                [(*k, v[0], v[1]) for k, v in hourly.items()],
+            )
+        if samples:
+            conn.executemany("INSERT OR IGNORE INTO rollup_samples(day, rule_id, seq, sample) VALUES (?, ?, ?, ?)", samples)
+        if counters:
+            conn.executemany(
+                "INSERT INTO counters(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                list(counters.items()),
+            )
+    if seen:
+        kept.update(seen)
+        newest = max(day for day, _ in seen)
+        for old in [k for k in kept if k[0] < newest]:
+            del kept[old]
+
+
+class _Writer(threading.Thread):
+    def __init__(self, path: str):
+        super().__init__(name="sqlite-writer", daemon=True)
+        self.path = path
+        self.pid = os.getpid()
+        self.q: queue.Queue = queue.Queue(maxsize=int(os.getenv("SQLITE_QUEUE_MAX", "100000")))
+        self.batch_max = int(os.getenv("SQLITE_BATCH_MAX", "1000"))
+        self.kept: Dict[Tuple[str, str], int] = {}
+        self.errors = 0
+
+    def run(self) -> None:
+        conn = _connect(self.path)
+        while True:
+            item = self.q.get()
+            if item is None:
+                self.q.task_done()
+                conn.close()
+                return
+            batch = [item]
+            while len(batch) < self.batch_max:
+                try:
+                    nxt = self.q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self.q.put(None)  # stop after this batch
+                    self.q.task_done()
+                    break
+                batch.append(nxt)
+            try:
+                self._write(conn, batch)
+            finally:
+                for _ in batch:
+                    self.q.task_done()
+
+    def _write(self, conn: sqlite3.Connection, batch: List[Tuple[str, Any]]) -> None:
+        try:
+            _write_batch(conn, batch, self.kept)
+            return
+        except Exception:
+            logger.exception(f"sqlite writer: batch of {len(batch)} items failed, retrying once")
+        try:
+            _write_batch(conn, batch, self.kept)
+        except Exception:
+            self.errors += 1
+            logger.exception(f"sqlite writer: dropped a batch of {len(batch)} items")
+
+
+def _get_writer() -> "_Writer":
+    global _writer
+    path = db_path()
+    with _lock:
+        if _writer is None or _writer.path != path or _writer.pid != os.getpid() or not _writer.is_alive():
+            _writer = _Writer(path)
+            _writer.start()
+        return _writer
+
+
+def _enqueue(item: Tuple[str, Any]) -> None:
+    w = _get_writer()
+    try:
+        w.q.put_nowait(item)
+    except queue.Full:
+        _write_batch(_conn(), [item], {})  # back-pressure instead of loss
+
+
+def append_decision(rec: Dict[str, Any]) -> None:
+    _enqueue(("d", rec))
+
+
+def inc_counters(counts: Dict[str, int]) -> None:
+    _enqueue(("c", dict(counts)))
+
+
+def flush() -> None:
+    """Wait until everything this process queued is written."""
+    w = _writer
+    if w is not None and w.pid == os.getpid() and w.is_alive():
+        w.q.join()
+
+
+def counters() -> Dict[str, int]:
+    flush()
+    if not available():
+        return {}
+    return {k: int(v) for k, v in _conn().execute("SELECT key, value FROM counters")}
+
+
+def _rows(cur) -> List[Dict[str, Any]]:
+    out = []
+    for row_id, data in cur:
+        try:
+            rec = json.loads(data)
+        except Exception:
+            continue
+        rec["id"] = row_id
+        out.append(rec)
+    return out
+
+
+def tail(limit: int = 50) -> List[Dict[str, Any]]:
+    """The last `limit` decisions, oldest first."""
+    flush()
+    if limit <= 0 or not available():
+        return []
+    rows = _rows(_conn().execute("SELECT id, data FROM decisions ORDER BY id DESC LIMIT ?", (limit,)))
+    rows.reverse()
+    return rows
+
+
+def query(rule: Optional[str] = None, action: Optional[str] = None, column: Optional[str] = None,
+          since: Optional[str] = None, until: Optional[str] = None, spid: Optional[int] = None,
+          limit: int = 100, cursor: Optional[int] = None) -> Dict[str, Any]:
+    """A page of decisions, newest first; pass `next_cursor` back to get the next page."""
+    flush()
+    if not available():
+        return {"items": [], "next_cursor": None}
+    where, args = [], []
+    for col, val in (("rule_id", rule), ("action", action), ("column_name", column), ("spid", spid)):
+        if val is not None:
+            where.append(f"{col} = ?")
+            args.append(val)
+    if since:
+        where.append("ts >= ?")
+        args.append(since)
+    if until:
+        where.append("ts < ?")
+        args.append(until)
+    if cursor is not None:
+        where.append("id < ?")
+        args.append(int(cursor))
+    sql = "SELECT id, data FROM decisions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"
+    items = _rows(_conn().execute(sql, (*args, limit + 1)))
+    more = len(items) > limit
+    items = items[:limit]
+    return {"items": items, "next_cursor": items[-1]["id"] if more and items else None}
+
+
+def iter_day(day: str) -> Iterator[Dict[str, Any]]:
+    flush()
+    if not available():
+        return
+    cur = _conn().execute("SELECT id, data FROM decisions WHERE ts >= ? AND ts < ? ORDER BY id", (day, day + "\uffff"))
+    for rec in _rows(cur):
+        rec.pop("id", None)
+        if str(rec.get("ts", "")).startswith(day):
+            yield rec
+
+
+def rollup(start: str, end: str, rule: Optional[str] = None, action: Optional[str] = None) -> Dict[str, Any]:
+    """Counts per rule and action for days `start`..`end` from the hourly rollup table."""
+    flush()
+    rules: Dict[str, Dict[str, int]] = {}
+    if not available():
+        return {"rules": rules, "sampled": False}
+    conn = _conn()
+    lo, hi = start, end + "T\uffff"
+    sql, args = "SELECT rule_id, action, sum(n) FROM rollup_hourly WHERE hour >= ? AND hour <= ?", [lo, hi]
+    if rule:
+        sql += " AND rule_id = ?"
+        args.append(rule)
+    if action:
+        sql += " AND action = ?"
+        args.append(action)
+    for rid, act, n in conn.execute(sql + " GROUP BY rule_id, action", args):
+        rules.setdefault(rid, {})[act] = int(n)
+    sampled = conn.execute("SELECT 1 FROM rollup_hourly WHERE hour >= ? AND hour <= ? AND sampled = 1 LIMIT 1", (lo, hi)).fetchone()
+    return {"rules": rules, "sampled": bool(sampled)}
+
+
+def samples(day: str) -> Dict[str, List[str]]:
+    flush()
+    out: Dict[str, List[str]] = {}
+    if not available():
+        return out
+    for rid, sample in _conn().execute("SELECT rule_id, sample FROM rollup_samples WHERE day = ? ORDER BY rule_id, seq", (day,)):
+        out.setdefault(rid, []).append(sample)
+    return out
+
+
+def reset() -> None:
+    """Stop the writer after it drains and drop this thread's connection (tests)."""
+    global _writer
+    with _lock:
+        w, _writer = _writer, None
+    if w is not None and w.is_alive():
+        w.q.put(None)
+        w.join(timeout=10)
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
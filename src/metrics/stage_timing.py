@@ -0,0 +1,165 @@
+"""
+Per-stage latency of the inspection pipeline.
+
+With STAGE_TIMING=true the proxy times each stage of client message handling: framing
+(packet reassembly and re-framing, excluding inspection), decode (payload to SQL text / RPC
+parameters / bulk rows), parse (statement analysis), match (rule decisions), normalize
+(autocorrect suggestions), rewrite (rebuilding changed payloads) and write (forwarding to
+the server, including back-pressure). Every sample goes to the `sqlumai_stage_ms`
+Prometheus histogram and to an in-process log-linear (HDR-style) histogram per stage and
+statement kind, which `GET /stats/stages` turns into p50/p90/p99/p999 (microseconds).
+
+Disabled (the default), `span()` returns a shared no-op context manager: one global check
+per call site, no clock reads.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+try:
+    from src.metrics.prom_registry import stage_hist
+except Exception:
+    stage_hist = None
+
+STAGES = ("framing", "decode", "parse", "match", "normalize", "rewrite", "write")
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))
+
+_on = os.getenv("STAGE_TIMING", "false").lower() == "true"
+_kind: ContextVar = ContextVar("stage_kind", default="other")
+
+
+class HdrHistogram:
+    """
+    Log-linear histogram of integer nanoseconds: values below 2**bits are exact, above that
+    each power of two is split into 2**(bits-1) buckets (relative error under 2**(1-bits)).
+    """
+
+    def __init__(self, bits: int = 7):
+        self.bits = bits
+        self.linear = 1 << bits
+        self.half = 1 << (bits - 1)
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.max = 0
+
+    def _index(self, v: int) -> int:
+        m = v.bit_length()
+        if m <= self.bits:
+            return v
+        shift = m - self.bits
+        return self.linear + (shift - 1) * self.half + (v >> shift) - self.half
+
+    def _value(self, idx: int) -> int:
+        """Midpoint of a bucket."""
+        if idx < self.linear:
+            return idx
+        k = idx - self.linear
+        shift = k // self.half + 1
+        lo = (k % self.half + self.half) << shift
+        return lo + (1 << shift) // 2
+
+    def record(self, ns: int) -> None:
+        ns = max(0, int(ns))
+        idx = self._index(ns)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.total += 1
+        self.max = max(self.max, ns)
+
+    def quantile(self, q: float) -> Optional[int]:
+        if not self.total:
+            return None
+        rank = max(1, int(q * self.total + 0.5))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                return min(self._value(idx), self.max)
+        return self.max
+
+
+_hists: Dict[Tuple[str, str], HdrHistogram] = {}
+_prom_children: Dict[Tuple[str, str], object] = {}
+
+
+def enabled() -> bool:
+    return _on
+
+
+def configure(on: Optional[bool] = None) -> bool:
+    """Re-read STAGE_TIMING (or force a value); the proxy calls this once per connection."""
+    global _on
+    _on = os.getenv("STAGE_TIMING", "false").lower() == "true" if on is None else on
+    return _on
+
+
+def set_kind(kind: str) -> None:
+    """Statement kind the following stages are attributed to (per task)."""
+    if _on:
+        _kind.set(kind)
+
+
+def observe(stage: str, seconds: float, kind: Optional[str] = None) -> None:
+    key = (stage, kind or _kind.get())
+    h = _hists.get(key)
+    if h is None:
+        h = _hists[key] = HdrHistogram()
+    h.record(seconds * 1e9)
+    try:
+        child = _prom_children.get(key)
+        if child is None and stage_hist is not None:
+            child = _prom_children[key] = stage_hist.labels(stage=key[0], kind=key[1])
+        if child is not None:
+            child.observe(seconds * 1000.0)
+    except Exception:
+        pass
+
+
+class _Span:
+    __slots__ = ("kind", "stage", "t0")
+
+    def __init__(self, stage: str, kind: Optional[str] = None):
+        self.stage = stage
+        self.kind = kind
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.t0, self.kind)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoSpan()
+
+
+def span(stage: str, kind: Optional[str] = None):
+    """`with span("match"): ...` times the block when STAGE_TIMING is on."""
+    return _Span(stage, kind) if _on else _NOOP
+
+
+def snapshot() -> Dict[str, object]:
+    """Quantiles (microseconds) per stage and statement kind."""
+    out: Dict[str, Dict[str, dict]] = {}
+    for (stage, kind), h in sorted(_hists.items()):
+        row = {"count": h.total, "max_us": round(h.max / 1000.0, 3)}
+        for name, q in QUANTILES:
+            v = h.quantile(q)
+            row[f"{name}_us"] = round(v / 1000.0, 3) if v is not None else None
+        out.setdefault(stage, {})[kind] = row
+    return {"enabled": _on, "stages": out}
+
+
+def reset() -> None:
+    _hists.clear()
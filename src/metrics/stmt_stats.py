@@ -0,0 +1,129 @@
+"""
+Per-statement server response statistics, keyed by statement fingerprint.
+
+The proxy times each request from the moment it is forwarded until the last packet of the
+server's response, and reads row counts and errors from the response's DONE/ERROR tokens.
+Everything is kept in memory: fixed-bucket histograms per fingerprint, at most
+STMT_STATS_MAX fingerprints (least recently seen are evicted).
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional
+
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+_lock = Lock()
+_stats: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _max() -> int:
+    return int(os.getenv("STMT_STATS_MAX", "1000"))
+
+
+def _bucket(bounds: tuple, v: float) -> int:
+    for i, b in enumerate(bounds):
+        if v <= b:
+            return i
+    return len(bounds)
+
+
+def _quantile(bounds: tuple, counts: List[int], q: float, top: float) -> Optional[float]:
+    """Upper bound of the bucket holding the q-quantile; `top` (the observed max) past the last bound."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, c in enumerate(counts):
+        seen += c
+        if seen >= rank:
+            return min(bounds[i], top) if i < len(bounds) else top
+    return top
+
+
+def record(fingerprint: str, sample: str, latency_ms: float, rows: int = 0, error: Optional[str] = None, cancelled: bool = False) -> None:
+    with _lock:
+        st = _stats.get(fingerprint)
+        if st is None:
+            st = {
+                "sample": (sample or "")[:200],
+                "count": 0,
+                "errors": 0,
+                "cancelled": 0,
+                "rows": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "latency_buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                "row_buckets": [0] * (len(ROW_BUCKETS) + 1),
+                "last_error": None,
+                "first_seen": time.time(),
+            }
+            _stats[fingerprint] = st
+            while len(_stats) > _max():
+                _stats.popitem(last=False)
+        else:
+            _stats.move_to_end(fingerprint)
+        st["count"] += 1
+        st["rows"] += rows
+        st["total_ms"] += latency_ms
+        if latency_ms > st["max_ms"]:
+            st["max_ms"] = latency_ms
+        st["latency_buckets"][_bucket(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        st["row_buckets"][_bucket(ROW_BUCKETS, rows)] += 1
+        if error is not None:
+            st["errors"] += 1
+            st["last_error"] = error[:200]
+        if cancelled:
+            st["cancelled"] += 1
+        st["last_seen"] = time.time()
+
+
+def _summary(fp: str, st: dict) -> Dict[str, object]:
+    n = st["count"]
+    return {
+        "fingerprint": fp,
+        "sample": st["sample"],
+        "count": n,
+        "errors": st["errors"],
+        "cancelled": st["cancelled"],
+        "rows": st["rows"],
+        "avg_rows": round(st["rows"] / n, 2) if n else 0,
+        "total_ms": round(st["total_ms"], 3),
+        "avg_ms": round(st["total_ms"] / n, 3) if n else 0,
+        "max_ms": round(st["max_ms"], 3),
+        "p50_ms": _quantile(LATENCY_BUCKETS_MS, st["latency_buckets"], 0.5, round(st["max_ms"], 3)),
+        "p95_ms": _quantile(LATENCY_BUCKETS_MS, st["latency_buckets"], 0.95, round(st["max_ms"], 3)),
+        "p99_ms": _quantile(LATENCY_BUCKETS_MS, st["latency_buckets"], 0.99, round(st["max_ms"], 3)),
+        "last_error": st["last_error"],
+        "first_seen": st["first_seen"],
+        "last_seen": st.get("last_seen"),
+    }
+
+
+def top(limit: int = 50, sort: str = "total_ms") -> List[Dict[str, object]]:
+    """Summaries ordered by `sort` (total_ms, avg_ms, max_ms, count, errors, rows), descending."""
+    with _lock:
+        rows = [_summary(fp, st) for fp, st in _stats.items()]
+    if sort not in ("total_ms", "avg_ms", "max_ms", "count", "errors", "rows"):
+        sort = "total_ms"
+    rows.sort(key=lambda r: r[sort], reverse=True)
+    return rows[:max(0, limit)]
+
+
+def get(fingerprint: str) -> Optional[Dict[str, object]]:
+    with _lock:
+        st = _stats.get(fingerprint)
+        if st is None:
+            return None
+        out = _summary(fingerprint, st)
+        out["latency_buckets_ms"] = dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"], st["latency_buckets"]))
+        out["row_buckets"] = dict(zip([str(b) for b in ROW_BUCKETS] + ["+Inf"], st["row_buckets"]))
+    return out
+
+
+def clear() -> None:
+    with _lock:
+        _stats.clear()
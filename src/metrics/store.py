@@ -33,32 +33,83 @@ def _write(data: Dict[str, int]):
         json.dump(data, f, indent=2)
 
 
-def inc(key: str, by: int = 1):
+def _shm() -> bool:
+    return os.getenv("METRICS_BACKEND", "json").lower() == "shm"
+
+
+def _add(counts: Dict[str, int]):
+    if os.getenv("METRICS_BACKEND", "json").lower() == "sqlite":
+        try:
+            from src.metrics import sqlite_store
+            sqlite_store.inc_counters(counts)  # written in batches by the writer thread
+            return
+        except Exception:
+            pass
+    if _shm():
+        try:
+            from src.metrics import shm
+            counts = shm.add(counts)  # keys without a shared-memory slot stay in the file
+        except Exception:
+            pass
+    if not counts:
+        return
     with _lock:
         data = _read()
-        data[key] = int(data.get(key, 0)) + by
+        for key, by in counts.items():
+            data[key] = int(data.get(key, 0)) + by
         _write(data)
+
+
+def inc(key: str, by: int = 1):
+    _add({key: by})
     try:
         prom_inc(key, None, None, by)
     except Exception:
         pass
 
 
+def inc_many(counts: Dict[str, int]):
+    """Add several counters in one write (one metrics file rewrite, or one shared-memory update)."""
+    _add(dict(counts))
+    for key, by in counts.items():
+        try:
+            prom_inc(key, None, None, by)
+        except Exception:
+            pass
+
+
 def get_all() -> Dict[str, int]:
     with _lock:
-        return _read()
+        data = _read()
+    if _shm():
+        try:
+            from src.metrics import shm
+            for key, v in shm.snapshot().items():
+                data[key] = int(data.get(key, 0)) + v
+        except Exception:
+            pass
+    try:
+        from src.metrics import sqlite_store
+        if sqlite_store.counters_enabled():
+            for key, v in sqlite_store.counters().items():
+                data[key] = int(data.get(key, 0)) + v
+    except Exception:
+        pass
+    return data
 
 
 def inc_rule_action(rule_id: str, action: str, by: int = 1):
-    inc(f"rule:{rule_id}:{action}", by)
     try:
-        prom_inc("rule", rule_id, action, by)
+        # before the file write: a first-use seed from metrics.json must not see this hit twice
+        from src.policy import gating
+        gating.record(rule_id, action, by)
     except Exception:
         pass
+    inc(f"rule:{rule_id}:{action}", by)  # also counts sqlumai_rule_actions_total
 
 
 def get_rule_counters(rule_id: str) -> Dict[str, int]:
-    data = _read()
+    data = get_all()
     out = {}
     prefix = f"rule:{rule_id}:"
     for k, v in data.items():
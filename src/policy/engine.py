@@ -30,6 +30,8 @@ class Rule:
     reason: str = ""
     confidence: float = 1.0
     enabled: bool = True
+    apply_in_envs: Optional[List[str]] = None
+    min_hits_to_enforce: int = 0  # enforce mode: block only after this many recorded hits
 
 
 class PolicyEngine:
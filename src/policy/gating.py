@@ -0,0 +1,172 @@
+"""
+Enforcement gating for rules with `min_hits_to_enforce`.
+
+A rule with min_hits_to_enforce > 0 only blocks in enforce mode once it has recorded that
+many hits (block, autocorrect and rpc_autocorrect_inplace actions). Hits and the set of
+promoted rules are kept in memory and updated as decisions are counted, so the gate check
+does no file I/O. Every GATING_CHECKPOINT_SECONDS (default 5), and right away when a rule
+is promoted, the local hits are merged into GATING_STATE_PATH (default
+data/metrics/gating.json) under an exclusive file lock; the merged totals are read back, so
+workers sharing the file see each other's hits. Without a state file the hits are seeded
+from the rule counters in metrics.json.
+"""
+import json
+import os
+import time
+from threading import RLock
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+GATE_ACTIONS = ("block", "autocorrect", "rpc_autocorrect_inplace")
+
+_lock = RLock()
+_base: Dict[str, int] = {}  # shared totals as of the last checkpoint
+_delta: Dict[str, int] = {}  # hits recorded here since then
+_promoted: set = set()
+_loaded = False
+_dirty = False
+_last_checkpoint = 0.0
+
+
+def state_path() -> str:
+    return os.getenv("GATING_STATE_PATH", "data/metrics/gating.json")
+
+
+def _interval() -> float:
+    return float(os.getenv("GATING_CHECKPOINT_SECONDS", "5"))
+
+
+def _seed() -> Dict[str, int]:
+    """Hits per rule from the metrics.json rule counters (first start without a state file)."""
+    from src.metrics import store as metrics_store
+    hits: Dict[str, int] = {}
+    for key, v in metrics_store.get_all().items():
+        if not key.startswith("rule:"):
+            continue
+        rule_id, _, action = key[len("rule:"):].rpartition(":")
+        if action in GATE_ACTIONS:
+            hits[rule_id] = hits.get(rule_id, 0) + int(v)
+    return hits
+
+
+def _read_state() -> Optional[dict]:
+    try:
+        with open(state_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        return {}
+
+
+def _ensure_loaded() -> None:
+    global _loaded, _base, _promoted, _last_checkpoint
+    if _loaded:
+        return
+    state = _read_state()
+    if state is None:
+        _base = _seed()
+    else:
+        _base = {k: int(v) for k, v in (state.get("hits") or {}).items()}
+        _promoted = set(state.get("promoted") or [])
+    _loaded = True
+    _last_checkpoint = time.monotonic()
+
+
+def hits(rule_id: str) -> int:
+    with _lock:
+        _ensure_loaded()
+        return _base.get(rule_id, 0) + _delta.get(rule_id, 0)
+
+
+def record(rule_id: Optional[str], action: str, by: int = 1) -> None:
+    """Count a rule action toward its gate (called with every rule counter increment)."""
+    if not rule_id or action not in GATE_ACTIONS:
+        return
+    global _dirty
+    with _lock:
+        _ensure_loaded()
+        _delta[rule_id] = _delta.get(rule_id, 0) + by
+        _dirty = True
+    _maybe_checkpoint()
+
+
+def gated(rule) -> bool:
+    """True while `rule` is below its min_hits_to_enforce (block must not be enforced yet)."""
+    need = int(getattr(rule, "min_hits_to_enforce", 0) or 0)
+    if need <= 0:
+        return False
+    with _lock:
+        _ensure_loaded()
+        if rule.id in _promoted:
+            return False
+        if _base.get(rule.id, 0) + _delta.get(rule.id, 0) < need:
+            _maybe_checkpoint()
+            return True
+        _promoted.add(rule.id)
+    checkpoint()  # publish the promotion to the other workers now
+    return False
+
+
+def _maybe_checkpoint() -> None:
+    if time.monotonic() - _last_checkpoint >= _interval():
+        checkpoint()
+
+
+def checkpoint() -> None:
+    """Merge local hits and promotions into the shared state file and read back the totals."""
+    global _base, _delta, _promoted, _dirty, _last_checkpoint
+    with _lock:
+        _ensure_loaded()
+        _last_checkpoint = time.monotonic()
+        path = state_path()
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path + ".lock", "a") as lockf:
+                if fcntl:
+                    fcntl.flock(lockf, fcntl.LOCK_EX)
+                try:
+                    state = _read_state()
+                    shared = dict(_base) if state is None else {k: int(v) for k, v in (state.get("hits") or {}).items()}
+                    promoted = _promoted | set((state or {}).get("promoted") or [])
+                    if _dirty or state is None or promoted != set((state or {}).get("promoted") or []):
+                        for rule_id, n in _delta.items():
+                            shared[rule_id] = shared.get(rule_id, 0) + n
+                        tmp = f"{path}.{os.getpid()}.tmp"
+                        with open(tmp, "w", encoding="utf-8") as f:
+                            json.dump({"hits": shared, "promoted": sorted(promoted)}, f)
+                        os.replace(tmp, path)
+                finally:
+                    if fcntl:
+                        fcntl.flock(lockf, fcntl.LOCK_UN)
+        except Exception:
+            return  # keep counting in memory; the next checkpoint retries
+        _base = shared
+        _delta = {}
+        _promoted = promoted
+        _dirty = False
+
+
+def snapshot() -> Dict[str, object]:
+    with _lock:
+        _ensure_loaded()
+        rules = set(_base) | set(_delta)
+        return {
+            "path": state_path(),
+            "hits": {r: _base.get(r, 0) + _delta.get(r, 0) for r in sorted(rules)},
+            "promoted": sorted(_promoted),
+            "unsaved": sum(_delta.values()),
+        }
+
+
+def reset() -> None:
+    """Forget the in-memory state (tests); the next use reloads it from disk."""
+    global _base, _delta, _promoted, _loaded, _dirty, _last_checkpoint
+    with _lock:
+        _base, _delta, _promoted = {}, {}, set()
+        _loaded = _dirty = False
+        _last_checkpoint = 0.0
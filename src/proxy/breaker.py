@@ -0,0 +1,182 @@
+"""
+Circuit breaker for the inspection path.
+
+Every inspected client message reports its outcome (error or not) and how long inspection
+took. The breaker trips when, over the last BREAKER_WINDOW messages (at least
+BREAKER_MIN_SAMPLES), the error rate exceeds BREAKER_ERROR_RATE, the p99 inspection
+latency exceeds BREAKER_LATENCY_P99_MS, or the event loop lag exceeds BREAKER_LOOP_LAG_MS.
+While open, messages are forwarded without inspection for BREAKER_COOLDOWN_SECONDS;
+then BREAKER_PROBES messages are inspected again (half-open) and the breaker closes if
+they stay under the thresholds, or re-opens otherwise.
+"""
+import logging
+import os
+import time
+from collections import deque
+from threading import Lock
+from typing import Dict, Optional
+
+try:
+    from src.metrics.prom_registry import breaker_gauge
+except Exception:
+    breaker_gauge = None
+
+logger = logging.getLogger("tds_proxy")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def _enabled() -> bool:
+    return os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+
+
+def _f(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self._lock = Lock()
+        self.state = CLOSED
+        self.since = time.time()
+        self.reason: Optional[str] = None
+        self.transitions = 0
+        self._opened_at = 0.0
+        self._half_open_at = 0.0
+        self._probes = 0
+        self.skipped = 0  # messages forwarded without inspection while open
+        self._window: deque = deque(maxlen=int(_f("BREAKER_WINDOW", "200")))
+        self._errors = 0
+        self._pending = 0  # records since the last threshold evaluation
+
+    def allow(self) -> bool:
+        """True when the next message should be inspected."""
+        if self.state == CLOSED or not _enabled():
+            return True
+        with self._lock:
+            cooldown = _f("BREAKER_COOLDOWN_SECONDS", "30")
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < cooldown:
+                    self.skipped += 1
+                    return False
+                self._transition(HALF_OPEN, "cool-down elapsed")
+            if self._probes >= int(_f("BREAKER_PROBES", "20")):
+                if time.monotonic() - self._half_open_at < cooldown:
+                    self.skipped += 1
+                    return False  # probes in flight; wait for their verdict
+                self._transition(HALF_OPEN, "probes unanswered")  # e.g. their connections closed
+            self._probes += 1
+            return True
+
+    def record(self, error: bool, latency_ms: float) -> None:
+        if not _enabled():
+            return
+        with self._lock:
+            if len(self._window) == self._window.maxlen and self._window[0][0]:
+                self._errors -= 1
+            self._window.append((error, latency_ms))
+            self._errors += error
+            if self.state == HALF_OPEN:
+                reason = self._violation(probe=(error, latency_ms))
+                if reason:
+                    self._trip(reason)
+                elif self._probes >= int(_f("BREAKER_PROBES", "20")) and len(self._window) >= self._probes:
+                    self._transition(CLOSED, "probes passed")
+                return
+            if self.state != CLOSED:
+                return
+            self._pending += 1
+            if self._pending < 10:
+                return
+            self._pending = 0
+            reason = self._violation()
+            if reason:
+                self._trip(reason)
+
+    def _violation(self, probe=None) -> Optional[str]:
+        from src.runtime import loop_lag
+        lag_limit = _f("BREAKER_LOOP_LAG_MS", "250")
+        if loop_lag.last_ms() > lag_limit:
+            return f"event loop lag {loop_lag.last_ms():.0f}ms > {lag_limit:.0f}ms"
+        lat_limit = _f("BREAKER_LATENCY_P99_MS", "100")
+        if probe is not None:
+            if probe[0]:
+                return "inspection error while probing"
+            if probe[1] > lat_limit:
+                return f"probe latency {probe[1]:.0f}ms > {lat_limit:.0f}ms"
+            return None
+        n = len(self._window)
+        if n < int(_f("BREAKER_MIN_SAMPLES", "50")):
+            return None
+        rate_limit = _f("BREAKER_ERROR_RATE", "0.2")
+        if self._errors / n > rate_limit:
+            return f"error rate {self._errors / n:.2f} > {rate_limit}"
+        lat = sorted(v[1] for v in self._window)
+        p99 = lat[min(n - 1, int(n * 0.99))]
+        if p99 > lat_limit:
+            return f"p99 inspection latency {p99:.0f}ms > {lat_limit:.0f}ms"
+        return None
+
+    def _trip(self, reason: str) -> None:
+        self._opened_at = time.monotonic()
+        self._transition(OPEN, reason)
+
+    def _transition(self, state: str, reason: str) -> None:
+        prev = self.state
+        self.state = state
+        self.since = time.time()
+        self.reason = reason
+        self.transitions += 1
+        self._probes = 0
+        self._pending = 0
+        if state == HALF_OPEN:
+            self._half_open_at = time.monotonic()
+            self._window.clear()
+            self._errors = 0
+        log = logger.warning if state == OPEN else logger.info
+        log(f"inspection breaker {prev} -> {state}: {reason}")
+        try:
+            from src.metrics import store as metrics_store
+            metrics_store.inc(f"breaker_{state}")
+        except Exception:
+            pass
+        try:
+            if breaker_gauge:
+                breaker_gauge.set(_STATE_VALUE[state])
+        except Exception:
+            pass
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            n = len(self._window)
+            return {
+                "state": self.state,
+                "since": self.since,
+                "reason": self.reason,
+                "transitions": self.transitions,
+                "window": n,
+                "error_rate": round(self._errors / n, 4) if n else 0.0,
+                "skipped": self.skipped,
+                "enabled": _enabled(),
+            }
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+breaker = CircuitBreaker()
+
+
+def allow() -> bool:
+    return breaker.allow()
+
+
+def record(error: bool, latency_ms: float) -> None:
+    breaker.record(error, latency_ms)
+
+
+def snapshot() -> Dict[str, object]:
+    return breaker.snapshot()
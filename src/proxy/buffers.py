@@ -0,0 +1,87 @@
+"""
+Memory budgets for c2s message reassembly.
+
+SQL Batch and RPC messages are held until EOM so they can be inspected (and rewritten)
+as a whole. Every held byte is charged to its connection and to the process:
+REASSEMBLY_MAX_BYTES per connection (default 8 MiB) and REASSEMBLY_TOTAL_MAX_BYTES across
+all connections (default 128 MiB). A message that does not fit is no longer held: with
+REASSEMBLY_OVERFLOW=passthrough (default) it is streamed to the server uninspected, with
+REASSEMBLY_OVERFLOW=block it is dropped.
+"""
+import os
+from threading import Lock
+from typing import Dict
+
+try:
+    from src.metrics.prom_registry import buffered_gauge
+except Exception:
+    buffered_gauge = None
+
+_lock = Lock()
+_by_conn: Dict[str, int] = {}
+_total = 0
+
+
+def conn_limit() -> int:
+    return int(os.getenv("REASSEMBLY_MAX_BYTES", "8388608"))
+
+
+def total_limit() -> int:
+    return int(os.getenv("REASSEMBLY_TOTAL_MAX_BYTES", "134217728"))
+
+
+def overflow_action() -> str:
+    return "block" if os.getenv("REASSEMBLY_OVERFLOW", "passthrough").lower() == "block" else "passthrough"
+
+
+def _publish() -> None:
+    try:
+        if buffered_gauge:
+            buffered_gauge.set(_total)
+    except Exception:
+        pass
+
+
+def charge(conn_id: str, n: int, force: bool = False) -> bool:
+    """Account `n` more held bytes; False (nothing charged) when a budget would be exceeded."""
+    global _total
+    with _lock:
+        cur = _by_conn.get(conn_id, 0)
+        if not force and (cur + n > conn_limit() or _total + n > total_limit()):
+            return False
+        _by_conn[conn_id] = cur + n
+        _total += n
+    _publish()
+    return True
+
+
+def release(conn_id: str, n: int) -> None:
+    global _total
+    with _lock:
+        cur = _by_conn.get(conn_id, 0)
+        n = min(n, cur)
+        if cur - n:
+            _by_conn[conn_id] = cur - n
+        else:
+            _by_conn.pop(conn_id, None)
+        _total -= n
+    _publish()
+
+
+def forget(conn_id: str) -> None:
+    """Release everything a closed connection still holds."""
+    release(conn_id, _by_conn.get(conn_id, 0))
+
+
+def held(conn_id: str) -> int:
+    return _by_conn.get(conn_id, 0)
+
+
+def total() -> int:
+    return _total
+
+
+def snapshot() -> Dict[str, object]:
+    with _lock:
+        conns = dict(_by_conn)
+    return {"total_bytes": _total, "total_limit": total_limit(), "connection_limit": conn_limit(), "overflow": overflow_action(), "connections": conns}
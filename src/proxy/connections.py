@@ -0,0 +1,92 @@
+"""
+Registry of the proxy's active client connections.
+
+Connection ids are sequential (`conn-1`, `conn-2`, ...). Each registered connection keeps
+its live statistics in the shared per-connection state dict under `_stats`, updated by the
+c2s/s2c pipes; `snapshot()` renders them (plus the session's login user/app, buffered
+reassembly bytes and the global event loop lag) for `GET /connections`.
+"""
+import itertools
+import time
+from typing import Dict, List, Optional
+
+try:
+    from src.metrics.prom_registry import connections_gauge
+except Exception:
+    connections_gauge = None
+
+_ids = itertools.count(1)
+_active: Dict[str, dict] = {}
+
+SORT_KEYS = ("inspect_ms", "age_s", "c2s_bytes", "s2c_bytes", "messages", "decisions", "buffered_bytes")
+
+
+def next_id() -> str:
+    return f"conn-{next(_ids)}"
+
+
+def new_stats() -> Dict[str, float]:
+    return {"c2s_packets": 0, "s2c_packets": 0, "messages": 0, "decisions": 0, "rewrites": 0, "blocked": 0, "inspect_ms": 0.0}
+
+
+def register(conn_id: str, peer, counter: dict) -> dict:
+    stats = counter.setdefault("_stats", new_stats())
+    _active[conn_id] = {"peer": peer, "since": time.time(), "started": time.monotonic(), "counter": counter}
+    _publish()
+    return stats
+
+
+def unregister(conn_id: str) -> None:
+    _active.pop(conn_id, None)
+    _publish()
+
+
+def _publish() -> None:
+    try:
+        if connections_gauge:
+            connections_gauge.set(len(_active))
+    except Exception:
+        pass
+
+
+def count() -> int:
+    return len(_active)
+
+
+def _row(conn_id: str, entry: dict) -> Dict[str, object]:
+    from src.proxy import buffers
+    counter = entry["counter"]
+    stats = counter.get("_stats") or new_stats()
+    session = counter.get("_session")
+    peer = entry["peer"]
+    return {
+        "id": conn_id,
+        "peer": f"{peer[0]}:{peer[1]}" if isinstance(peer, tuple) and len(peer) >= 2 else (str(peer) if peer else None),
+        "user": getattr(session, "user", None) or None,
+        "app": getattr(session, "app", None) or None,
+        "database": getattr(session, "database", None) or None,
+        "since": entry["since"],
+        "age_s": round(time.monotonic() - entry["started"], 3),
+        "c2s_bytes": counter.get("c2s", 0),
+        "s2c_bytes": counter.get("s2c", 0),
+        "c2s_packets": stats["c2s_packets"],
+        "s2c_packets": stats["s2c_packets"],
+        "messages": stats["messages"],
+        "decisions": stats["decisions"],
+        "rewrites": stats["rewrites"],
+        "blocked": stats["blocked"],
+        "inspect_ms": round(stats["inspect_ms"], 3),
+        "buffered_bytes": buffers.held(conn_id),
+        "passthrough": bool(counter.get("_passthrough")),
+    }
+
+
+def snapshot(sort: str = "inspect_ms", limit: Optional[int] = None) -> Dict[str, object]:
+    """Active connections, most expensive first, with the global event loop lag."""
+    from src.runtime import loop_lag
+    rows: List[Dict[str, object]] = [_row(cid, e) for cid, e in list(_active.items())]
+    key = sort if sort in SORT_KEYS else "inspect_ms"
+    rows.sort(key=lambda r: r[key], reverse=True)
+    if limit is not None:
+        rows = rows[: max(0, limit)]
+    return {"count": len(_active), "loop_lag": loop_lag.snapshot(), "connections": rows}
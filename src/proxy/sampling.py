@@ -0,0 +1,68 @@
+"""
+Stratified inspection sampling for dry-run (ENFORCEMENT_MODE=log).
+
+With INSPECT_SAMPLE_RATE below 1, statements are sampled per fingerprint: within each
+INSPECT_SAMPLE_WINDOW_SECONDS window the first INSPECT_SAMPLE_MIN_PER_SHAPE occurrences of
+a fingerprint are always inspected (rare shapes are never missed); after that only every
+k-th occurrence is, with k = round(1 / rate), and its decisions carry weight k so totals
+can be extrapolated. The rule counters (and so the hit counts behind min_hits_to_enforce)
+add the same weight. Enforce mode always inspects everything.
+"""
+import os
+import time
+from threading import Lock
+from typing import Dict
+
+_lock = Lock()
+_counts: Dict[str, int] = {}
+_window_start = 0.0
+_stats = {"seen": 0, "inspected": 0, "skipped": 0}
+
+
+def rate() -> float:
+    try:
+        return min(1.0, max(0.0, float(os.getenv("INSPECT_SAMPLE_RATE", "1"))))
+    except ValueError:
+        return 1.0
+
+
+def active(enforcement: str) -> bool:
+    return enforcement == "log" and rate() < 1.0
+
+
+def weight(fingerprint: str) -> int:
+    """0 to skip this statement; otherwise inspect it and count each decision `weight` times."""
+    global _window_start
+    r = rate()
+    floor = int(os.getenv("INSPECT_SAMPLE_MIN_PER_SHAPE", "10"))
+    k = max(1, round(1.0 / r)) if r > 0 else 0
+    now = time.monotonic()
+    with _lock:
+        if now - _window_start > float(os.getenv("INSPECT_SAMPLE_WINDOW_SECONDS", "60")) or len(_counts) >= int(os.getenv("INSPECT_SAMPLE_MAX_SHAPES", "10000")):
+            _counts.clear()
+            _window_start = now
+        n = _counts.get(fingerprint, 0) + 1
+        _counts[fingerprint] = n
+        _stats["seen"] += 1
+        if n <= floor:
+            w = 1
+        elif k and (n - floor) % k == 0:
+            w = k  # stands for itself and the k-1 skipped before it
+        else:
+            w = 0
+        _stats["inspected" if w else "skipped"] += 1
+    return w
+
+
+def snapshot() -> Dict[str, object]:
+    with _lock:
+        return {"rate": rate(), "shapes": len(_counts), **_stats}
+
+
+def reset() -> None:
+    global _window_start
+    with _lock:
+        _counts.clear()
+        _window_start = 0.0
+        for k in _stats:
+            _stats[k] = 0
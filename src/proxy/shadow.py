@@ -0,0 +1,171 @@
+"""
+Shadow evaluation of the proposed rule set on live traffic.
+
+With SHADOW_RULES=true every policy event the proxy decides is also queued for the rules
+in PROPOSED_RULES_PATH (default config/rules_proposed.json). A background task drains the
+queue off the forwarding path and counts would-be hits as `shadow:<rule>:<action>` next to
+the active `rule:<rule>:<action>` counters in metrics.json. The queue holds at most
+SHADOW_QUEUE_MAX events (default 10000); when it is full, events are dropped (counted as
+`dropped`) instead of slowing the proxy down. The task evaluates at most SHADOW_DRAIN_MAX
+events (default 200) before it yields to the proxy again, and writes the counters every
+SHADOW_FLUSH_SECONDS (default 5) from a worker thread. `differs` counts decided events
+(statement and column level) whose proposed decision differs from the active one.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from src.policy.engine import PolicyEngine
+from src.policy.loader import load_rules
+
+logger = logging.getLogger("tds_proxy")
+
+_queue: deque = deque()
+_pending: Dict[str, int] = {}  # shadow counters not yet flushed to metrics.json
+_stats = {"queued": 0, "evaluated": 0, "dropped": 0, "differs": 0, "errors": 0}
+_engine: Optional[PolicyEngine] = None
+_engine_key = None
+
+
+def enabled() -> bool:
+    return os.getenv("SHADOW_RULES", "false").lower() == "true"
+
+
+def rules_path() -> str:
+    return os.getenv("PROPOSED_RULES_PATH", "config/rules_proposed.json")
+
+
+def _queue_max() -> int:
+    return int(os.getenv("SHADOW_QUEUE_MAX", "10000"))
+
+
+def _drain_max() -> int:
+    return max(1, int(os.getenv("SHADOW_DRAIN_MAX", "200")))
+
+
+def submit(event, active=None, weight: int = 1) -> bool:
+    """Queue one decided event (and the active decision) for shadow evaluation; False when dropped."""
+    if not enabled():
+        return False
+    if len(_queue) >= _queue_max():
+        _stats["dropped"] += 1
+        return False
+    _queue.append((event, getattr(active, "rule_id", None), getattr(active, "action", None), weight))
+    _stats["queued"] += 1
+    return True
+
+
+def _proposed_engine() -> Optional[PolicyEngine]:
+    """Engine over the proposed rules, rebuilt when the file changes."""
+    global _engine, _engine_key
+    path = rules_path()
+    try:
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = (path, None, None)
+    if key != _engine_key:
+        _engine = PolicyEngine(load_rules(path), environment=os.getenv("ENVIRONMENT")) if key[1] is not None else None
+        _engine_key = key
+    return _engine
+
+
+def drain(limit: Optional[int] = None) -> int:
+    """Evaluate up to `limit` queued events against the proposed rules; returns how many."""
+    engine = _proposed_engine()
+    n = 0
+    while _queue and (limit is None or n < limit):
+        event, rule_id, action, weight = _queue.popleft()
+        n += 1
+        if engine is None:
+            continue
+        try:
+            d = engine.decide(event)
+        except Exception:
+            _stats["errors"] += 1
+            continue
+        _stats["evaluated"] += 1
+        if (d.rule_id, d.action) != (rule_id, action):
+            _stats["differs"] += weight
+        rule = engine.get_rule(d.rule_id)
+        # Pattern rules are counted on the statement event, table/column rules on column events
+        if rule is not None and (rule.target == "pattern") == (getattr(event, "column", None) is None):
+            key = f"shadow:{d.rule_id}:{d.action}"
+            _pending[key] = _pending.get(key, 0) + weight
+    return n
+
+
+def _take_pending() -> Dict[str, int]:
+    """The unflushed counters; drain() starts a new map, so a flush in a thread can't lose any."""
+    global _pending
+    counts, _pending = _pending, {}
+    return counts
+
+
+def _write(counts: Dict[str, int]) -> None:
+    if not counts:
+        return
+    try:
+        from src.metrics import store as metrics_store
+        metrics_store.inc_many(counts)
+    except Exception:
+        pass
+
+
+def flush() -> None:
+    """Add the pending shadow counters to metrics.json in one write."""
+    _write(_take_pending())
+
+
+def counters() -> Dict[str, Dict[str, int]]:
+    """Per-rule would-be hits from metrics.json plus the unflushed ones."""
+    from src.metrics import store as metrics_store
+    data = dict(metrics_store.get_all())
+    for k, v in _pending.items():
+        data[k] = int(data.get(k, 0)) + v
+    out: Dict[str, Dict[str, int]] = {}
+    for k, v in data.items():
+        if k.startswith("shadow:"):
+            rule_id, _, action = k[len("shadow:"):].rpartition(":")
+            out.setdefault(rule_id, {})[action] = v
+    return out
+
+
+def snapshot() -> Dict[str, object]:
+    return {"enabled": enabled(), "rules_path": rules_path(), "queue": len(_queue), "queue_max": _queue_max(), **_stats}
+
+
+def reset() -> None:
+    global _engine, _engine_key
+    _queue.clear()
+    _pending.clear()
+    _engine = None
+    _engine_key = None
+    for k in _stats:
+        _stats[k] = 0
+
+
+async def run_shadow_worker(stop_event: asyncio.Event):
+    """
+    Drain the shadow queue in batches of SHADOW_DRAIN_MAX between proxy work; every
+    SHADOW_FLUSH_SECONDS the counters are written from a worker thread, off the event loop.
+    """
+    flush_s = float(os.getenv("SHADOW_FLUSH_SECONDS", "5"))
+    last_flush = time.monotonic()
+    while not stop_event.is_set():
+        try:
+            busy = drain(limit=_drain_max())
+        except Exception as e:
+            busy = 0
+            logger.warning(f"shadow evaluation failed: {e}")
+        if time.monotonic() - last_flush >= flush_s:
+            counts = _take_pending()
+            if counts:
+                await asyncio.to_thread(_write, counts)
+            last_flush = time.monotonic()
+        await asyncio.sleep(0 if busy else 0.05)
+    drain()
+    await asyncio.to_thread(flush)
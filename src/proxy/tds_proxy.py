@@ -3,9 +3,13 @@ import logging
 import os
 import time
 import contextlib
+from collections import deque
+from contextvars import ContextVar
 from src.policy.loader import load_rules
 from src.policy.engine import PolicyEngine, Event
-from src.metrics import store as metrics_store
+from src.policy import gating
+from src.metrics import stage_timing, store as metrics_store
+from src.proxy import breaker, buffers, connections, sampling, shadow
 from typing import Optional
 try:
     from src.metrics.prom_registry import bytes_hist, latency_hist
@@ -17,6 +21,740 @@ logger = logging.getLogger("tds_proxy")
 logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s %(name)s: %(message)s")
 
 
+# Messages a sampled inspection stands for (set per statement; each connection is its own task)
+_sample_weight: ContextVar = ContextVar("sample_weight", default=1)
+# Live statistics of the connection whose c2s pipe runs in this task (see connections.py)
+_conn_stats: ContextVar = ContextVar("conn_stats", default=None)
+
+
+def _append_decision(rec: dict) -> None:
+    """Decisions log entry; decisions of a sampled inspection carry its weight."""
+    from src.metrics import decisions as dec_store
+    w = _sample_weight.get()
+    if w != 1:
+        rec["weight"] = w
+    stats = _conn_stats.get()
+    if stats is not None:
+        stats["decisions"] += 1
+    dec_store.append(rec)
+
+
+def _packet_size(counter: dict) -> int:
+    return int(counter.get("_packet_size") or os.getenv("TDS_PACKET_SIZE", "4096"))
+
+
+def _event(session, sql_text: Optional[str], table: Optional[str] = None, column: Optional[str] = None, value=None) -> Event:
+    """Policy event carrying the session's login user and current database when known."""
+    if session is None:
+        return Event(database=None, user=None, sql_text=sql_text, table=table, column=column, value=value)
+    return Event(database=session.database or None, user=session.user or None, sql_text=sql_text, table=table, column=column, value=value)
+
+
+def _decide(engine: PolicyEngine, event: Event):
+    """engine.decide, mirrored to the proposed rule set when shadow evaluation is on."""
+    with stage_timing.span("match"):
+        d = engine.decide(event)
+    if shadow.enabled():
+        shadow.submit(event, d, _sample_weight.get())
+    return d
+
+
+def _decide_statement(engine: PolicyEngine, sql_text: str, spid: int, enforcement: str, session=None) -> str:
+    """
+    Whole-statement decision (pattern/table rules), shared by SQL Batch and parameterized RPCs.
+    Returns "block" (drop the statement), "gated" (block below min_hits_to_enforce) or "inspect".
+    """
+    decision = _decide(engine, _event(session, sql_text))
+    _append_decision({"spid": spid, "action": decision.action, "reason": decision.reason, "confidence": decision.confidence, "rule_id": decision.rule_id, "sample": (sql_text[:200] or "")})
+    if decision.rule_id:
+        metrics_store.inc_rule_action(decision.rule_id, decision.action, _sample_weight.get())
+    if decision.action == "block" and enforcement == "enforce":
+        # Per-rule threshold gating (in-memory hit counts, see src/policy/gating.py)
+        r = engine.get_rule(decision.rule_id)
+        if r and gating.gated(r):
+            metrics_store.inc("gated_by_threshold")
+            return "gated"
+        metrics_store.inc("blocks")
+        return "block"
+    return "inspect"
+
+
+def _slice_seconds() -> float:
+    return float(os.getenv("INSPECT_SLICE_MS", "5")) / 1000.0
+
+
+def _run_steps(steps):
+    """Run an inspection generator to completion (synchronous callers)."""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+async def _run_steps_async(steps, busy=None):
+    """
+    Run an inspection generator, yielding to the event loop between slices so other connections
+    keep moving. `busy[0]` adds up the seconds spent in the generator itself.
+    """
+    while True:
+        t0 = time.perf_counter()
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            if busy is not None:
+                busy[0] += time.perf_counter() - t0
+        await asyncio.sleep(0)
+
+
+def _call_steps(fn, *args):
+    """A synchronous inspector as a single-step generator."""
+    return fn(*args)
+    yield  # makes this a generator
+
+
+async def _inspect_guarded(conn_id: str, original: bytes, steps):
+    """
+    Run one message's inspection under the circuit breaker. Returns the inspector's result;
+    `original` (forward unchanged) when the breaker is open or inspection raised.
+    """
+    if not breaker.allow():
+        return original
+    busy = [0.0]  # inspection time only: other connections run while the steps yield
+    failed = False
+    try:
+        out = await _run_steps_async(steps, busy)
+    except Exception as e:
+        logger.debug(f"{conn_id} inspection failed, forwarding unchanged: {e}")
+        metrics_store.inc("inspection_errors")
+        failed = True
+        out = original
+    breaker.record(failed, busy[0] * 1000.0)
+    return out
+
+
+def _autocorrect_sql(engine: PolicyEngine, sql_text: str, spid: int, enforcement: str, session=None) -> str:
+    return _run_steps(_autocorrect_sql_steps(engine, sql_text, spid, enforcement, session))
+
+
+def _autocorrect_sql_steps(engine: PolicyEngine, sql_text: str, spid: int, enforcement: str, session=None):
+    """
+    Column-level autocorrect of literal values in simple INSERT/UPDATE statements.
+    Generator: yields after every INSPECT_SLICE_MS (default 5) of multi-row work and returns the SQL text.
+    """
+    from src.tds.sqlparse_simple import extract_table_and_columns, extract_values, reconstruct_insert, reconstruct_update
+    from src.tds.sqlparse_simple import extract_multirow_values, reconstruct_multirow_insert
+    from agents.normalizers import suggest_normalizations
+    with stage_timing.span("parse"):
+        table, cols = extract_table_and_columns(sql_text)
+        multi_rows = extract_multirow_values(sql_text)
+    if multi_rows and table and cols and all(len(r) == len(cols) for r in multi_rows):
+        changed_any = False
+        new_rows = []
+        slice_s = _slice_seconds()
+        t_slice = time.perf_counter()
+        for row in multi_rows:
+            if time.perf_counter() - t_slice > slice_s:
+                yield
+                t_slice = time.perf_counter()
+            row_new = list(row)
+            row_changed = False
+            for idx, col in enumerate(cols):
+                col_selector = f"{table}.{col}"
+                d = _decide(engine, _event(session, sql_text, table, col_selector, row[idx]))
+                if d.action == "autocorrect":
+                    with stage_timing.span("normalize"):
+                        sug = suggest_normalizations(row[idx])
+                    if sug and sug.get("normalized") and sug["normalized"] != row[idx]:
+                        before = row[idx]
+                        after = sug["normalized"]
+                        row_new[idx] = after
+                        row_changed = True
+                        metrics_store.inc("autocorrect_suggested", _sample_weight.get())
+                        _append_decision({"spid": spid, "action": "autocorrect", "rule_id": d.rule_id, "reason": d.reason, "before": before, "after": after, "column": col_selector})
+                        if d.rule_id:
+                            metrics_store.inc_rule_action(d.rule_id, "autocorrect", _sample_weight.get())
+            changed_any = changed_any or row_changed
+            new_rows.append(row_new)
+        if changed_any and enforcement == "enforce":
+            with stage_timing.span("rewrite"):
+                new_sql = reconstruct_multirow_insert(sql_text, new_rows)
+            if new_sql:
+                return new_sql
+        return sql_text
+    with stage_timing.span("parse"):
+        vals = extract_values(sql_text)
+    if table and cols and vals and len(cols) == len(vals):
+        changed = False
+        new_vals = list(vals)
+        for idx, col in enumerate(cols):
+            col_selector = f"{table}.{col}"
+            d = _decide(engine, _event(session, sql_text, table, col_selector, vals[idx]))
+            if d.action == "autocorrect":
+                # try normalizers
+                with stage_timing.span("normalize"):
+                    sug = suggest_normalizations(vals[idx])
+                if sug and sug.get("normalized") and sug["normalized"] != vals[idx]:
+                    before = vals[idx]
+                    after = sug["normalized"]
+                    new_vals[idx] = after
+                    changed = True
+                    metrics_store.inc("autocorrect_suggested", _sample_weight.get())
+                    _append_decision({"spid": spid, "action": "autocorrect", "rule_id": d.rule_id, "reason": d.reason, "before": before, "after": after, "column": col_selector})
+                    if d.rule_id:
+                        metrics_store.inc_rule_action(d.rule_id, "autocorrect", _sample_weight.get())
+        if changed and enforcement == "enforce":
+            # Reconstruct simple INSERT/UPDATE
+            with stage_timing.span("rewrite"):
+                new_sql = reconstruct_insert(sql_text, new_vals) or reconstruct_update(sql_text, cols, new_vals)
+            if new_sql:
+                return new_sql
+    return sql_text
+
+
+def _inspect_sql_batch(engine: Optional[PolicyEngine], sql_payload: bytes, spid: int, enforcement: str, conn: Optional[dict] = None) -> Optional[bytes]:
+    """
+    Evaluate rules for one reassembled SQL Batch.
+    Returns the payload to forward (the same object when unchanged) or None when blocked.
+    """
+    return _run_steps(_inspect_sql_batch_steps(engine, sql_payload, spid, enforcement, conn))
+
+
+def _inspect_sql_batch_steps(engine: Optional[PolicyEngine], sql_payload: bytes, spid: int, enforcement: str, conn: Optional[dict] = None):
+    """Generator form of `_inspect_sql_batch` (the proxy awaits it slice by slice)."""
+    from src.tds.parser import extract_sqlbatch_text, split_all_headers
+    if engine is None:
+        return sql_payload
+    with stage_timing.span("decode"):
+        headers, body = split_all_headers(sql_payload)
+        sql_text = extract_sqlbatch_text([body])
+    if not sql_text:
+        return sql_payload
+    from src.tds.statements import statement_fingerprint
+    session = None
+    if conn is not None:
+        from src.tds.sqlparse_simple import detect_insert_bulk
+        session = conn.get("_session")
+        conn["_stmt"] = (statement_fingerprint(sql_text), sql_text)
+        bulk_table = detect_insert_bulk(sql_text)
+        if bulk_table:
+            conn["_bulk_table"] = bulk_table  # the Bulk Load message that follows writes here
+    weight = 1
+    if sampling.active(enforcement):
+        weight = sampling.weight(statement_fingerprint(sql_text))
+        if not weight:
+            return sql_payload
+    token = _sample_weight.set(weight)
+    try:
+        verdict = _decide_statement(engine, sql_text, spid, enforcement, session)
+        if verdict == "block":
+            return None
+        if verdict == "inspect":
+            new_sql = yield from _autocorrect_sql_steps(engine, sql_text, spid, enforcement, session)
+            if new_sql != sql_text:
+                with stage_timing.span("rewrite"):
+                    return headers + new_sql.encode("utf-16le")
+        return sql_payload
+    finally:
+        _sample_weight.reset(token)
+
+
+def _proc_key(proc: Optional[str]) -> str:
+    """Bare, lower-cased procedure name: [sys].[sp_executesql] -> sp_executesql."""
+    return (proc or "").replace("[", "").replace("]", "").split(".")[-1].lower()
+
+
+# Parameter layout of the statement-carrying system procedures: (@stmt index, @params index, first value index)
+_STMT_LAYOUT = {
+    "sp_executesql": (0, 1, 2),
+    "sp_prepexec": (2, 1, 3),
+    "sp_prepare": (2, 1, 4),
+}
+
+
+def _prepared_handle(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _inspect_rpc(engine: Optional[PolicyEngine], rpc_payload: bytes, spid: int, enforcement: str, conn: Optional[dict] = None) -> Optional[bytes]:
+    """
+    Evaluate rules for one reassembled RPC request.
+    Returns the payload to forward (the same object when unchanged) or None when the call is blocked.
+    Parameters are located with the token parser; the regex heuristic is only a fallback.
+    For sp_executesql/sp_prepexec/sp_prepare the statement text goes through the SQL Batch
+    statement decision and parameters are mapped to the columns they write, so table/column
+    rules apply. With a connection state dict (`conn`), prepared statements are remembered
+    until the server returns their handle; sp_execute then reuses that analysis and only
+    evaluates parameter values. sp_unprepare releases the handle.
+    Every RPC of a batched request is decided on its own and the message is blocked when one
+    of them is; RPCs after one that does not parse are forwarded unchecked (rpc_batch_unparsed).
+    """
+    from src.tds.rpc_parse import RpcParseError, split_rpc_batch
+    session = conn.get("_session") if conn is not None else None
+    try:
+        with stage_timing.span("decode"):
+            parts, rest = split_rpc_batch(rpc_payload, getattr(session, "tds_version", None))
+    except RpcParseError:
+        return _inspect_one_rpc(engine, rpc_payload, spid, enforcement, conn, None)
+    if rest:
+        metrics_store.inc("rpc_batch_unparsed")
+    if len(parts) == 1:
+        return _inspect_one_rpc(engine, rpc_payload, spid, enforcement, conn, parts[0][2])
+    out = []
+    changed = False
+    for sep, part, req in parts:
+        part_new = _inspect_one_rpc(engine, part, spid, enforcement, conn, req)
+        if part_new is None:
+            return None
+        changed = changed or part_new is not part
+        out.append(sep + part_new)
+    if not changed:
+        return rpc_payload
+    return b"".join(out) + rest
+
+
+def _inspect_one_rpc(engine: Optional[PolicyEngine], rpc_payload: bytes, spid: int, enforcement: str, conn: Optional[dict], req) -> Optional[bytes]:
+    """One RPC of `_inspect_rpc`; `req` is its parsed form, None for the regex fallback."""
+    from src.tds.rpc_parse import extract_proc_and_params
+    stmt = None
+    decide_stmt = False
+    # (param index, name, value, table, column); index is None on the heuristic path
+    targets: list = []
+    if req is not None:
+        proc = req.proc
+        key = _proc_key(proc)
+        params = req.params
+        info = None
+        first = 0
+        if key in _STMT_LAYOUT and len(params) > _STMT_LAYOUT[key][0]:
+            from src.tds.statements import analyze_statement
+            i_stmt, i_decl, first = _STMT_LAYOUT[key]
+            stmt = params[i_stmt].value
+            decl = params[i_decl].value if len(params) > i_decl else ""
+            if stmt:
+                with stage_timing.span("parse"):
+                    info = analyze_statement(stmt, decl or "")
+                decide_stmt = True
+                if key != "sp_executesql" and conn is not None:
+                    conn["_prepare_pending"] = (stmt, info)
+        elif key in ("sp_execute", "sp_unprepare") and params:
+            handle = _prepared_handle(params[0].value)
+            prepared = conn.get("_prepared", {}) if conn is not None else {}
+            if key == "sp_unprepare":
+                prepared.pop(handle, None)
+            elif handle in prepared:
+                metrics_store.inc("prepared_handle_hit")
+                stmt, info = prepared[handle]
+            elif conn is not None:
+                metrics_store.inc("prepared_handle_miss")
+            first = 1 if key == "sp_execute" else len(params)
+        declared = info.param_types if info else []
+        for k in range(first, len(params)):
+            p = params[k]
+            pname = p.name
+            if not pname and k - first < len(declared):
+                pname = declared[k - first][0]  # positional parameter: take the declared name
+            if not pname:
+                continue
+            name = pname.lstrip("@")
+            col = info.column_for(pname) if info else None
+            targets.append((k, name, p.value, info.table if col else None, col or name))
+        corrected = [(p.name, p.value) for p in params]
+        try:
+            from src.tds import rpc_catalog
+            rpc_catalog.observe(req)
+        except Exception:
+            pass
+    else:
+        metrics_store.inc("rpc_parse_fallback")
+        with stage_timing.span("decode"):
+            proc, params = extract_proc_and_params(rpc_payload)
+        targets = [(None, n, v, None, n) for n, v in params]
+        corrected = list(params)
+    if conn is not None or sampling.active(enforcement):
+        from src.tds.statements import statement_fingerprint
+        if stmt:
+            fp = (info.fingerprint if info else statement_fingerprint(stmt), stmt)
+        else:
+            fp = (statement_fingerprint(f"exec {proc}"), f"EXEC {proc}")
+        if conn is not None:
+            conn["_stmt"] = fp
+    if engine is None:
+        return rpc_payload
+    weight = 1
+    if sampling.active(enforcement):
+        weight = sampling.weight(fp[0])
+        if not weight:
+            return rpc_payload
+    token = _sample_weight.set(weight)
+    try:
+        return _decide_rpc(engine, rpc_payload, spid, enforcement, conn, req, proc, stmt, decide_stmt, targets, corrected)
+    finally:
+        _sample_weight.reset(token)
+
+
+def _decide_rpc(engine: PolicyEngine, rpc_payload: bytes, spid: int, enforcement: str, conn, req, proc, stmt, decide_stmt: bool, targets: list, corrected: list) -> Optional[bytes]:
+    """Rule decisions and in-place autocorrect for a parsed RPC (second half of `_inspect_rpc`)."""
+    from src.tds.rpc_parse import rewrite_param_values
+    from src.tds.typeinfo import encode_text_value
+    session = conn.get("_session") if conn is not None else None
+    if decide_stmt:
+        verdict = _decide_statement(engine, stmt, spid, enforcement, session)
+        if verdict == "block":
+            metrics_store.inc("rpc_blocked")
+            return None
+        if verdict == "gated":
+            return rpc_payload
+    if not targets:
+        return rpc_payload
+    decided = []
+    block_rpc = False
+    for _, name, val, table, column in targets:
+        d = _decide(engine, _event(session, stmt, table, column, val))
+        decided.append(d)
+        rec = {"spid": spid, "action": d.action, "rule_id": d.rule_id, "reason": d.reason, "param": name, "value": (val[:80] if isinstance(val, str) else val)}
+        if table:
+            rec["column"] = column
+        _append_decision(rec)
+        if d.action == "block":
+            block_rpc = True
+    if block_rpc and enforcement == "enforce":
+        metrics_store.inc("rpc_blocked")
+        return None
+    inplace = os.getenv("RPC_AUTOCORRECT_INPLACE", "true").lower() == "true"
+    if not (inplace and enforcement == "enforce"):
+        return rpc_payload
+    from agents.normalizers import suggest_normalizations
+    truncate = os.getenv("RPC_TRUNCATE_ON_AUTOCORRECT", "false").lower() == "true"
+    payload_new = rpc_payload
+    replacements = {}
+    for t_idx, ((k, name, val, table, column), d) in enumerate(zip(targets, decided)):
+        if d.action != "autocorrect" or not isinstance(val, str):
+            continue
+        with stage_timing.span("normalize"):
+            sug = suggest_normalizations(val)
+        if not sug or not sug.get("normalized"):
+            continue
+        new_val = str(sug["normalized"]) or ""
+        if req is not None:
+            # Exact byte-range patch: length prefix follows the new value
+            p = req.params[k]
+            new_b = encode_text_value(p.type_info, new_val)
+            if new_b is None or new_val == val:
+                continue
+            limit = p.type_info.max_length if p.type_info.len_kind in ("ushort", "byte") else None
+            if limit is not None and len(new_b) > limit:
+                if not truncate:
+                    continue
+                new_b = new_b[: limit - (limit % 2 if p.type_info.is_unicode else 0)]
+            replacements[k] = new_b
+            corrected[k] = (p.name, new_val)
+        else:
+            # Heuristic fallback: same-or-shorter UTF-16LE replacement (pad with spaces)
+            old_b = (val or "").encode("utf-16le", errors="ignore")
+            new_b = new_val.encode("utf-16le", errors="ignore")
+            if len(new_b) > len(old_b):
+                if truncate:
+                    new_b = new_b[: len(old_b)]
+                else:
+                    continue
+            if len(new_b) < len(old_b):
+                pad = (len(old_b) - len(new_b)) // 2
+                new_b = new_b + (" " * pad).encode("utf-16le")
+            if old_b not in payload_new:
+                continue
+            payload_new = payload_new.replace(old_b, new_b, 1)
+            corrected[t_idx] = (name, new_val)
+        rec = {"spid": spid, "action": "rpc_autocorrect_inplace", "rule_id": d.rule_id, "reason": d.reason, "param": name, "before": val, "after": new_val}
+        if table:
+            rec["column"] = column
+        _append_decision(rec)
+        metrics_store.inc("rpc_autocorrect_inplace")
+        if d.rule_id:
+            metrics_store.inc_rule_action(d.rule_id, "rpc_autocorrect_inplace")
+    if replacements:
+        with stage_timing.span("rewrite"):
+            payload_new = rewrite_param_values(rpc_payload, req, replacements)
+    if payload_new is rpc_payload:
+        return rpc_payload
+    if req is None and os.getenv("RPC_REPACK_BUILDER", "false").lower() == "true":
+        # Heuristic patch only: rebuild the RPC payload with the builder. Types come from the
+        # learned catalog, then the operator map; without a known type we keep the patch.
+        # A token-parsed request keeps its exact patch (status, TYPE_INFO, collation, batch).
+        try:
+            from src.tds.rpc_build import build_rpc_payload, supports
+            from src.tds import rpc_catalog
+            from src.tds.rpc_types import get_param_types
+            proc = proc or "sp_executesql"
+            proc_map = get_param_types().get(proc.lower(), {})
+            mapped = []
+            for n, v in corrected:
+                t = rpc_catalog.lookup(proc, n) or proc_map.get(n.lstrip("@").lower())
+                if v is None or not t or not supports(t):
+                    metrics_store.inc("rpc_repack_skipped")
+                    mapped = None
+                    break
+                mapped.append((n, v, t.lower()))
+            if mapped is not None:
+                with stage_timing.span("rewrite"):
+                    payload_new = build_rpc_payload(proc, mapped)
+        except Exception:
+            pass
+    return payload_new
+
+
+def _bulk_columns(engine: PolicyEngine, conn: dict, columns: list, spid: int) -> list:
+    """Decide each bulk load column once; return the indexes whose values must be seen."""
+    table = conn.get("_bulk_table")
+    session = conn.get("_session")
+    stats = conn["_bulk"]["columns"]
+    watch = []
+    for idx, (name, _ti) in enumerate(columns):
+        column = f"{table}.{name}" if table else name
+        d = _decide(engine, _event(session, None, table, column, None))
+        if d.action == "allow":
+            continue
+        stats[idx] = {"column": column, "decision": d, "values": 0, "nulls": 0, "autocorrect_suggested": 0, "memo": {}}
+        watch.append(idx)
+    return watch
+
+
+def _inspect_bulk(engine: Optional[PolicyEngine], conn: dict, chunk: bytes, spid: int, eom: bool) -> None:
+    """
+    Observe one packet of a Bulk Load message. The packet is forwarded as is; rows are decoded
+    as they stream past, column rules are decided once per column (from COLMETADATA) and
+    only the value vectors of columns with a non-allow decision are examined.
+    Per-column counts are written to the decisions log when the message ends.
+    """
+    state = conn.get("_bulk")
+    if state is None:
+        from src.tds.bulk import BulkLoadDecoder
+        state = conn["_bulk"] = {"columns": {}}
+        select = (lambda cols: _bulk_columns(engine, conn, cols, spid)) if engine is not None else None
+        state["decoder"] = BulkLoadDecoder(select)
+    decoder = state["decoder"]
+    with stage_timing.span("decode"):
+        decoder.feed(chunk)
+    vectors = decoder.take()
+    if vectors:
+        from agents.normalizers import suggest_normalizations
+        for idx, values in vectors.items():
+            st = state["columns"][idx]
+            nulls = values.count(None)
+            st["nulls"] += nulls
+            st["values"] += len(values) - nulls
+            if st["decision"].action != "autocorrect":
+                continue
+            memo = st["memo"]
+            changed = 0
+            for v in values:
+                if v is None:
+                    continue
+                hit = memo.get(v)
+                if hit is None:
+                    with stage_timing.span("normalize"):
+                        sug = suggest_normalizations(v)
+                    hit = bool(sug and sug.get("normalized") and sug["normalized"] != v)
+                    if len(memo) < 4096:
+                        memo[v] = hit
+                changed += hit
+            st["autocorrect_suggested"] += changed
+    if not eom:
+        return
+    conn.pop("_bulk", None)
+    table = conn.pop("_bulk_table", None)
+    metrics_store.inc("bulk_loads")
+    if decoder.complete:
+        metrics_store.inc("bulk_rows", decoder.rows)
+    elif decoder.broken:
+        metrics_store.inc("bulk_unparsed")
+    elif decoder.truncated:
+        metrics_store.inc("bulk_scan_truncated")
+    for st in state["columns"].values():
+        d = st["decision"]
+        rec = {"spid": spid, "action": d.action, "rule_id": d.rule_id, "reason": d.reason, "column": st["column"], "bulk": True, "rows": decoder.rows, "values": st["values"], "nulls": st["nulls"]}
+        if not decoder.complete:
+            rec["partial"] = True  # counts cover the rows walked before the scan stopped
+        if d.action == "autocorrect":
+            rec["autocorrect_suggested"] = st["autocorrect_suggested"]
+        _append_decision(rec)
+        if d.rule_id and st["values"]:
+            metrics_store.inc_rule_action(d.rule_id, f"bulk_{d.action}", st["values"])
+    if table:
+        from src.tds.statements import statement_fingerprint
+        conn["_stmt"] = (statement_fingerprint(f"bulk load {table}"), f"BULK LOAD {table}")
+
+
+def _reassembly_overflow(counter: dict, conn_id: str, typ: int, held: list, packet: bytes, eom: bool) -> bytes:
+    """
+    A message no longer fits the reassembly budget: stop holding it. Returns the bytes to
+    forward now (held packets + this one) for pass-through, nothing when it is blocked.
+    The rest of the message is handled the same way as it arrives.
+    """
+    action = buffers.overflow_action()
+    metrics_store.inc("reassembly_overflow")
+    logger.warning(f"{conn_id} message 0x{typ:02x} over reassembly budget ({buffers.held(conn_id)} bytes held, {buffers.total()} total): {action}")
+    buffers.release(conn_id, sum(map(len, held)))
+    out = b"".join(held) + packet if action == "passthrough" else b""
+    held.clear()
+    if action == "block":
+        metrics_store.inc("reassembly_blocked")
+    if not eom:
+        counter["_overflow"] = typ
+        counter["_overflow_action"] = action
+    elif action == "passthrough":
+        _expect_response(counter, typ)
+    return out
+
+
+# Client message types the server answers with a Tabular Result (0x04) message
+_EXPECTS_RESPONSE = {0x01, 0x03, 0x07, 0x0E, 0x10, 0x11, 0x12}
+
+
+def _expect_response(counter: dict, typ: int, payload: bytes = b"", prepare=None, scan: bool = False, stmt=None) -> None:
+    """
+    Queue a forwarded request; responses arrive in request order on a (non-MARS) connection.
+    `scan` asks for the response tokens to be walked (prepared handles, ENVCHANGE); `stmt`
+    is the (fingerprint, text) whose latency, row count and errors are recorded.
+    """
+    if typ not in _EXPECTS_RESPONSE:
+        return
+    if typ == 0x12 and payload[:1] in (b"\x14", b"\x15", b"\x16"):
+        return  # TLS handshake records inside PRELOGIN are answered with PRELOGIN packets
+    if stmt is not None and os.getenv("STMT_STATS", "true").lower() != "true":
+        stmt = None
+    entry = {"typ": typ, "prepare": prepare, "scan": scan or prepare is not None or stmt is not None, "stmt": stmt, "t0": time.perf_counter()}
+    if typ == 0x12:
+        entry["collect"] = []  # PRELOGIN response: option tokens, not a token stream
+    counter.setdefault("_inflight", deque()).append(entry)
+
+
+def _passthrough_match(info) -> Optional[str]:
+    """Allowlist match for a login: PASSTHROUGH_USERS / PASSTHROUGH_APPS (comma-separated, * wildcards)."""
+    import fnmatch
+    for env, value in (("PASSTHROUGH_USERS", info.user), ("PASSTHROUGH_APPS", info.app)):
+        if not value:
+            continue
+        for pat in os.getenv(env, "").split(","):
+            pat = pat.strip().lower()
+            if pat and fnmatch.fnmatchcase(value.lower(), pat):
+                return f"{env.split('_')[1].lower()[:-1]}:{value}"
+    return None
+
+
+def _on_login(counter: dict, info, conn_id: str) -> None:
+    """Store the session attributes of a decoded LOGIN7 and apply the pass-through allowlist."""
+    counter["_session"] = info
+    if info.packet_size:
+        counter["_packet_size"] = info.packet_size
+    metrics_store.inc("logins_parsed")
+    match = _passthrough_match(info)
+    if match:
+        counter["_passthrough"] = True
+        metrics_store.inc("sessions_passthrough")
+        logger.info(f"{conn_id} pass-through session ({match})")
+
+
+def _record_statement(head: dict, events: list) -> None:
+    """Per-fingerprint latency (forward -> end of response), rows and errors."""
+    from src.metrics import stmt_stats
+    from src.tds.tokens import DONE_ATTN, DONE_COUNT, DONE_ERROR, DONEPROC
+    rows = 0
+    error = None
+    cancelled = False
+    for ev in events:
+        if ev[0] == "done":
+            if ev[2] & DONE_COUNT and ev[1] != DONEPROC:
+                rows += ev[3]
+            if ev[2] & DONE_ERROR and error is None:
+                error = "error"
+            if ev[2] & DONE_ATTN:
+                cancelled = True
+        elif ev[0] == "error":
+            error = f"{ev[1]}: {ev[2]}"
+    fingerprint, text = head["stmt"]
+    stmt_stats.record(fingerprint, text, (time.perf_counter() - head["t0"]) * 1000.0, rows, error, cancelled)
+
+
+def _apply_response_events(counter: dict, head: dict, events: list) -> None:
+    from src.tds.tokens import ENV_DATABASE, ENV_PACKET_SIZE
+    if head["prepare"] is not None:
+        _register_handle(counter, head["prepare"], events)
+    if head["stmt"] is not None:
+        _record_statement(head, events)
+    for ev in events:
+        if ev[0] != "envchange":
+            continue
+        if ev[1] == ENV_DATABASE and counter.get("_session") is not None:
+            counter["_session"].database = ev[2]
+        elif ev[1] == ENV_PACKET_SIZE and ev[2].isdigit():
+            counter["_packet_size"] = int(ev[2])
+
+
+def _register_handle(counter: dict, prepared, events: list) -> None:
+    for ev in events:
+        if ev[0] == "returnvalue":
+            handle = _prepared_handle(ev[3])
+            if handle is None:
+                continue
+            handles = counter.setdefault("_prepared", {})
+            handles[handle] = prepared
+            while len(handles) > int(os.getenv("PREPARED_HANDLES_MAX", "1024")):
+                handles.pop(next(iter(handles)))
+            metrics_store.inc("prepared_handles")
+            return
+
+
+def _track_response(counter: dict, data: bytes) -> None:
+    """
+    Passive s2c bookkeeping: frame server packets, match each complete response to the
+    oldest in-flight request and pick up prepared handles (RETURNVALUE), database and
+    packet size changes (ENVCHANGE) and the server's PRELOGIN options.
+    Server bytes are never modified here.
+    """
+    from src.tds.parser import EOM, PacketStream, parse_prelogin
+    from src.tds.tokens import TokenScanner
+    if counter.get("_s2c_desync"):
+        return
+    stream = counter.get("_s2c_stream")
+    if stream is None:
+        stream = counter["_s2c_stream"] = PacketStream()
+    try:
+        pieces = stream.feed(data)
+    except ValueError:
+        counter["_s2c_desync"] = True
+        metrics_store.inc("s2c_desync")
+        return
+    stats = counter.get("_stats")
+    if stats is not None:
+        stats["s2c_packets"] += sum(1 for p in pieces if p[3])
+    inflight = counter.get("_inflight")
+    for typ, status, chunk, end in pieces:
+        if typ != 0x04 or not inflight:
+            continue
+        head = inflight[0]
+        if head["scan"]:
+            scanner = head.get("scanner")
+            if scanner is None:
+                scanner = head["scanner"] = TokenScanner()
+            scanner.feed(chunk)
+        elif "collect" in head:
+            head["collect"].append(chunk)
+        if end and status & EOM:
+            inflight.popleft()
+            if head["scan"]:
+                _apply_response_events(counter, head, head["scanner"].finish() if "scanner" in head else [])
+            elif "collect" in head:
+                server = parse_prelogin(b"".join(head["collect"]))
+                if server is not None:
+                    counter["_prelogin_server"] = server
+
+
 async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, direction: str, conn_id: str, counter: dict):
     try:
         engine = None
@@ -26,6 +764,10 @@ async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, dire
         if direction == "c2s" and (sniff or tds_parser_on):
             rules = load_rules()
             engine = PolicyEngine(rules, environment=os.getenv("ENVIRONMENT"))
+        timing = direction == "c2s" and stage_timing.configure()
+        stats = counter.setdefault("_stats", connections.new_stats())
+        if direction == "c2s":
+            _conn_stats.set(stats)
         time_budget_ms = int(os.getenv("TIME_BUDGET_MS", "25"))
         max_rewrite_bytes = int(os.getenv("MAX_REWRITE_BYTES", "131072"))
         while not reader.at_eof():
@@ -38,15 +780,20 @@ async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, dire
                     bytes_hist.observe(len(data))
             except Exception:
                 pass
+            if counter.get("_passthrough"):
+                # Allowlisted session: forward untouched for the rest of the connection
+                writer.write(data)
+                await writer.drain()
+                counter[direction] = counter.get(direction, 0) + len(data)
+                continue
             tds_parser_on = os.getenv("ENABLE_TDS_PARSER", "false").lower() == "true"
             if tds_parser_on and direction == "c2s":
                 try:
-                    from src.tds.parser import type_name, EOM, extract_sqlbatch_text, parse_header
-                    from src.tds.sqlparse_simple import extract_table_and_columns, extract_values, reconstruct_insert, reconstruct_update
-                    from src.tds.rpc_parse import extract_proc_and_params
-                    if "_sql_chunks" not in counter:
-                        counter["_sql_chunks"] = []
+                    from src.tds.parser import type_name, EOM, parse_header, build_packets, parse_login7, parse_prelogin
                     # Reassembly-aware: maintain a c2s buffer for full packet parsing
+                    t_chunk = time.perf_counter()
+                    inspect_s = 0.0  # framing time excludes inspection
+                    prev_left = len(counter.get("_c2s_buf", b""))
                     buf = counter.get("_c2s_buf", b"") + data
                     out_passthrough: bytes = b""
                     i = 0
@@ -60,204 +807,164 @@ async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, dire
                         if len(buf) - i < length:
                             break
                         payload = buf[i+8:i+length]
+                        stats["c2s_packets"] += 1
                         logger.debug(f"{conn_id} TDS {type_name(typ)} len={length} spid={spid} pkt={pkt}")
-                        if typ == 0x01:  # SQL Batch
-                            counter["_sql_chunks"].append(payload)
+                        if typ in (0x01, 0x03) and counter.get("_overflow") == typ:
+                            # Rest of a message that went over the reassembly budget
+                            if counter["_overflow_action"] == "passthrough":
+                                out_passthrough += buf[i:i+length]
                             if status & EOM:
-                                sql_text = extract_sqlbatch_text(counter["_sql_chunks"])
-                                counter["_sql_chunks"] = []
-                                if sql_text and engine is not None:
-                                    from src.metrics import decisions as dec_store
-                                    # Whole-statement decision (pattern/table rules)
-                                    decision = engine.decide(Event(database=None, user=None, sql_text=sql_text, table=None, column=None, value=None))
-                                    dec_store.append({"spid": spid, "action": decision.action, "reason": decision.reason, "confidence": decision.confidence, "rule_id": decision.rule_id, "sample": (sql_text[:200] or "")})
-                                    if decision.rule_id:
-                                        metrics_store.inc_rule_action(decision.rule_id, decision.action)
-                                    if decision.action == "block" and enforcement == "enforce":
-                                        # Check per-rule threshold gating
-                                        r = engine.get_rule(decision.rule_id)
-                                        if r and getattr(r, "min_hits_to_enforce", 0) > 0:
-                                            cnts = metrics_store.get_rule_counters(decision.rule_id) or {}
-                                            hits = int(cnts.get("block", 0) + cnts.get("autocorrect", 0) + cnts.get("rpc_autocorrect_inplace", 0))
-                                            if hits < r.min_hits_to_enforce:
-                                                metrics_store.inc("gated_by_threshold")
-                                            else:
-                                                metrics_store.inc("blocks")
-                                                sql_text = None
-                                        else:
-                                            metrics_store.inc("blocks")
-                                            sql_text = None
-                                    else:
-                                        # Column-level autocorrect: simple INSERT/UPDATE mapping
-                                        table, cols = extract_table_and_columns(sql_text)
-                                        from src.tds.sqlparse_simple import extract_multirow_values, reconstruct_multirow_insert
-                                        multi_rows = extract_multirow_values(sql_text)
-                                        if multi_rows and table and cols and all(len(r)==len(cols) for r in multi_rows):
-                                            changed_any = False
-                                            new_rows = []
-                                            from agents.normalizers import suggest_normalizations
-                                            for row in multi_rows:
-                                                row_new = list(row)
-                                                row_changed = False
-                                                for idx, col in enumerate(cols):
-                                                    col_selector = f"{table}.{col}"
-                                                    d = engine.decide(Event(database=None, user=None, sql_text=sql_text, table=table, column=col_selector, value=row[idx]))
-                                                    if d.action == "autocorrect":
-                                                        sug = suggest_normalizations(row[idx])
-                                                        if sug and sug.get("normalized") and sug["normalized"] != row[idx]:
-                                                            before = row[idx]
-                                                            after = sug["normalized"]
-                                                            row_new[idx] = after
-                                                            row_changed = True
-                                                            metrics_store.inc("autocorrect_suggested")
-                                                            dec_store.append({"spid": spid, "action": "autocorrect", "rule_id": d.rule_id, "reason": d.reason, "before": before, "after": after, "column": col_selector})
-                                                            if d.rule_id:
-                                                                metrics_store.inc_rule_action(d.rule_id, "autocorrect")
-                                                changed_any = changed_any or row_changed
-                                                new_rows.append(row_new)
-                                            if changed_any and enforcement == "enforce":
-                                                new_sql = reconstruct_multirow_insert(sql_text, new_rows)
-                                                if new_sql:
-                                                    sql_text = new_sql
-                                        else:
-                                            vals = extract_values(sql_text)
-                                            if table and cols and vals and len(cols) == len(vals):
-                                                changed = False
-                                                new_vals = list(vals)
-                                                for idx, col in enumerate(cols):
-                                                    col_selector = f"{table}.{col}"
-                                                    d = engine.decide(Event(database=None, user=None, sql_text=sql_text, table=table, column=col_selector, value=vals[idx]))
-                                                    if d.action == "autocorrect":
-                                                        # try normalizers
-                                                        from agents.normalizers import suggest_normalizations
-                                                        sug = suggest_normalizations(vals[idx])
-                                                        if sug and sug.get("normalized") and sug["normalized"] != vals[idx]:
-                                                            before = vals[idx]
-                                                            after = sug["normalized"]
-                                                            new_vals[idx] = after
-                                                            changed = True
-                                                            metrics_store.inc("autocorrect_suggested")
-                                                            dec_store.append({"spid": spid, "action": "autocorrect", "rule_id": d.rule_id, "reason": d.reason, "before": before, "after": after, "column": col_selector})
-                                                            if d.rule_id:
-                                                                metrics_store.inc_rule_action(d.rule_id, "autocorrect")
-                                                if changed and enforcement == "enforce":
-                                                    # Reconstruct simple INSERT/UPDATE
-                                                    new_sql = reconstruct_insert(sql_text, new_vals) or reconstruct_update(sql_text, cols, new_vals)
-                                                    if new_sql:
-                                                        sql_text = new_sql
-                                    # Forward either modified sql_text, original, or nothing if blocked
-                                    if sql_text is not None:
-                                        payload_new = sql_text.encode("utf-16le")
-                                        length_new = 8 + len(payload_new)
-                                        header = bytes([0x01, EOM, (length_new >> 8) & 0xFF, length_new & 0xFF, (spid >> 8) & 0xFF, spid & 0xFF, 1, 0])
-                                        out_passthrough += header + payload_new
+                                counter.pop("_overflow")
+                                if counter.pop("_overflow_action") == "passthrough":
+                                    _expect_response(counter, typ)
+                        elif typ == 0x01:  # SQL Batch
+                            held = counter.setdefault("_sql_raw", [])
+                            if not buffers.charge(conn_id, length):
+                                out_passthrough += _reassembly_overflow(counter, conn_id, typ, held, buf[i:i+length], status & EOM)
+                            else:
+                                held.append(buf[i:i+length])
+                                if len(held) == 1:
+                                    counter["_sql_status"] = status
+                            if held and status & EOM:
+                                counter["_sql_raw"] = []
+                                sql_raw = b"".join(held)
+                                sql_payload = b"".join([p[8:] for p in held])
+                                buffers.release(conn_id, len(sql_raw))
+                                del held
+                                stage_timing.set_kind("sql_batch")
+                                t_i = time.perf_counter()
+                                payload_new = await _inspect_guarded(conn_id, sql_payload, _inspect_sql_batch_steps(engine, sql_payload, spid, enforcement, counter))
+                                t_i = time.perf_counter() - t_i
+                                inspect_s += t_i
+                                stats["messages"] += 1
+                                stats["inspect_ms"] += t_i * 1000.0
+                                stmt = counter.pop("_stmt", None)
+                                # Forward either modified batch, original packets, or nothing if blocked
+                                if payload_new is None:
+                                    stats["blocked"] += 1
+                                elif payload_new is sql_payload:
+                                    out_passthrough += sql_raw
+                                elif len(payload_new) > max_rewrite_bytes:
+                                    metrics_store.inc("rewrite_skipped_size")
+                                    out_passthrough += sql_raw
+                                else:
+                                    stats["rewrites"] += 1
+                                    out_passthrough += build_packets(0x01, payload_new, spid, _packet_size(counter), counter.get("_sql_status", 0))
+                                if payload_new is not None:
+                                    # USE changes the session database: watch for ENVCHANGE
+                                    _expect_response(counter, 0x01, scan=b"u\x00s\x00e\x00" in sql_payload.lower(), stmt=stmt)
                             # else: wait for EOM (do not forward partial batch)
                         elif typ == 0x03:  # RPC
                             # Reassemble and decide at EOM only
-                            counter.setdefault("_rpc_chunks", []).append(payload)
-                            if status & EOM:
+                            held = counter.setdefault("_rpc_raw", [])
+                            if not buffers.charge(conn_id, length):
+                                out_passthrough += _reassembly_overflow(counter, conn_id, typ, held, buf[i:i+length], status & EOM)
+                            else:
+                                held.append(buf[i:i+length])
+                                if len(held) == 1:
+                                    counter["_rpc_status"] = status
+                            if held and status & EOM:
                                 metrics_store.inc("rpc_seen")
-                                rpc_payload = b"".join(counter.get("_rpc_chunks", []))
-                                counter["_rpc_chunks"] = []
-                                proc, params = extract_proc_and_params(rpc_payload)
-                                block_rpc = False
-                                if engine is not None and params:
-                                    from src.metrics import decisions as dec_store
-                                    for name, val in params:
-                                        ev = Event(database=None, user=None, sql_text=None, table=None, column=name, value=val)
-                                        d = engine.decide(ev)
-                                        dec_store.append({"spid": spid, "action": d.action, "rule_id": d.rule_id, "reason": d.reason, "param": name, "value": (val[:80] if isinstance(val,str) else val)})
-                                        if d.action == "block":
-                                            block_rpc = True
-                                inplace = os.getenv("RPC_AUTOCORRECT_INPLACE", "true").lower() == "true"
-                                if block_rpc and enforcement == "enforce":
-                                    metrics_store.inc("rpc_blocked")
-                                    # Drop this RPC call (do not forward)
-                                elif inplace and enforcement == "enforce" and params:
-                                    # Attempt in-place rewrite of UTF-16LE strings with same or shorter length (pad with spaces)
-                                    payload_new = rpc_payload
-                                    from agents.normalizers import suggest_normalizations
-                                    changed = False
-                                    for name, val in params:
-                                        ev = Event(database=None, user=None, sql_text=None, table=None, column=name, value=val)
-                                        d = engine.decide(ev)
-                                        if d.action == "autocorrect":
-                                            sug = suggest_normalizations(val)
-                                            if not sug or not sug.get("normalized"):
-                                                continue
-                                            new_val = str(sug["normalized"]) or ""
-                                            old_b = (val or "").encode("utf-16le", errors="ignore")
-                                            new_b = new_val.encode("utf-16le", errors="ignore")
-                                            if len(new_b) > len(old_b):
-                                                if os.getenv("RPC_TRUNCATE_ON_AUTOCORRECT", "false").lower() == "true":
-                                                    new_b = new_b[: len(old_b)]
-                                                else:
-                                                    continue
-                                            if len(new_b) < len(old_b):
-                                                pad = (len(old_b) - len(new_b)) // 2
-                                                new_b = new_b + (" " * pad).encode("utf-16le")
-                                            if old_b in payload_new:
-                                                payload_new = payload_new.replace(old_b, new_b, 1)
-                                                changed = True
-                                                from src.metrics import decisions as dec_store
-                                                dec_store.append({"spid": spid, "action": "rpc_autocorrect_inplace", "rule_id": d.rule_id, "reason": d.reason, "param": name, "before": val, "after": new_val})
-                                                metrics_store.inc("rpc_autocorrect_inplace")
-                                                if d.rule_id:
-                                                    metrics_store.inc_rule_action(d.rule_id, "rpc_autocorrect_inplace")
-                                    if changed:
-                                        if os.getenv("RPC_REPACK_BUILDER", "false").lower() == "true":
-                                            # Try to build a fresh RPC payload (best-effort) using builder
-                                            try:
-                                                from src.tds.rpc_build import build_rpc_payload
-                                                from src.tds.rpc_types import load_param_types
-                                                proc = proc or "sp_executesql"
-                                                # Load explicit type mapping if available
-                                                type_map = load_param_types()
-                                                proc_map = type_map.get(proc.lower(), {})
-                                                param_types = []
-                                                for n, v in params:
-                                                    t = proc_map.get(n.lstrip("@").lower())
-                                                    if not t:
-                                                        k = (suggest_normalizations(v) or {}).get("kind")
-                                                        t = "int" if k == "int" else "nvarchar"
-                                                    param_types.append((n, t))
-                                                mapped = []
-                                                for (n, v), (_, t) in zip(params, param_types):
-                                                    typ = t.lower() if t.lower() in ("nvarchar", "int", "bit") else "nvarchar"
-                                                    mapped.append((n, v, typ))
-                                                payload_built = build_rpc_payload(proc, mapped)
-                                                payload_new = payload_built
-                                            except Exception:
-                                                pass
-                                        length_new = 8 + len(payload_new)
-                                        header = bytes([0x03, EOM, (length_new >> 8) & 0xFF, length_new & 0xFF, (spid >> 8) & 0xFF, spid & 0xFF, 1, 0])
-                                        out_passthrough += header + payload_new
-                                    else:
-                                        out_passthrough += buf[i:i+length]
+                                counter["_rpc_raw"] = []
+                                rpc_raw = b"".join(held)
+                                rpc_payload = b"".join([p[8:] for p in held])
+                                buffers.release(conn_id, len(rpc_raw))
+                                del held
+                                stage_timing.set_kind("rpc")
+                                t_i = time.perf_counter()
+                                payload_new = await _inspect_guarded(conn_id, rpc_payload, _call_steps(_inspect_rpc, engine, rpc_payload, spid, enforcement, counter))
+                                t_i = time.perf_counter() - t_i
+                                inspect_s += t_i
+                                stats["messages"] += 1
+                                stats["inspect_ms"] += t_i * 1000.0
+                                prepare = counter.pop("_prepare_pending", None)
+                                stmt = counter.pop("_stmt", None)
+                                if payload_new is None:
+                                    stats["blocked"] += 1  # blocked: drop this RPC call (do not forward)
+                                elif payload_new is rpc_payload:
+                                    out_passthrough += rpc_raw
+                                elif len(payload_new) > max_rewrite_bytes:
+                                    metrics_store.inc("rewrite_skipped_size")
+                                    out_passthrough += rpc_raw
                                 else:
-                                    out_passthrough += buf[i:i+length]
+                                    stats["rewrites"] += 1
+                                    out_passthrough += build_packets(0x03, payload_new, spid, _packet_size(counter), counter.get("_rpc_status", 0))
+                                if payload_new is not None:
+                                    _expect_response(counter, 0x03, prepare=prepare, stmt=stmt)
+                        elif typ == 0x07:  # Bulk Load: forwarded as it streams, rows observed
+                            out_passthrough += buf[i:i+length]
+                            if "_bulk" not in counter:
+                                counter["_bulk_inspect"] = breaker.allow()
+                                counter["_bulk_ms"] = 0.0
+                            stage_timing.set_kind("bulk_load")
+                            t_bulk = time.perf_counter()
+                            try:
+                                _inspect_bulk(engine if counter["_bulk_inspect"] else None, counter, payload, spid, bool(status & EOM))
+                            except Exception as e:
+                                logger.debug(f"{conn_id} bulk load inspection failed: {e}")
+                                counter["_bulk_error"] = True
+                            t_bulk = time.perf_counter() - t_bulk
+                            inspect_s += t_bulk
+                            stats["inspect_ms"] += t_bulk * 1000.0
+                            # a load is one message but walks many packets: report its slowest packet
+                            counter["_bulk_ms"] = max(counter["_bulk_ms"], t_bulk * 1000.0)
+                            if status & EOM:
+                                stats["messages"] += 1
+                                counter.pop("_bulk", None)
+                                if counter.pop("_bulk_inspect"):
+                                    breaker.record(counter.pop("_bulk_error", False), counter["_bulk_ms"])
+                                _expect_response(counter, typ, stmt=counter.pop("_stmt", None))
+                        elif typ == 0x10:  # Login7
+                            out_passthrough += buf[i:i+length]
+                            counter.setdefault("_login_chunks", []).append(payload)
+                            if status & EOM:
+                                info = parse_login7(b"".join(counter.pop("_login_chunks")))
+                                if info is not None:
+                                    _on_login(counter, info, conn_id)
+                                _expect_response(counter, typ, scan=True)
                         else:
                             out_passthrough += buf[i:i+length]
+                            if status & EOM:
+                                if typ == 0x12:
+                                    pre = parse_prelogin(payload)
+                                    if pre is not None:
+                                        counter["_prelogin"] = pre
+                                _expect_response(counter, typ, payload)
                         i += length
-                    # Persist leftover bytes for next iteration
+                        if counter.get("_passthrough"):
+                            out_passthrough += buf[i:]
+                            i = len(buf)
+                            break
+                    # Persist leftover bytes (at most one partial packet) for next iteration
                     counter["_c2s_buf"] = buf[i:]
+                    left = len(buf) - i
+                    if left > prev_left:
+                        buffers.charge(conn_id, left - prev_left, force=True)
+                    elif left < prev_left:
+                        buffers.release(conn_id, prev_left - left)
+                    del buf
+                    if timing:
+                        stage_timing.observe("framing", time.perf_counter() - t_chunk - inspect_s, "all")
                     if out_passthrough:
-                        if len(out_passthrough) > max_rewrite_bytes:
-                            metrics_store.inc("rewrite_skipped_size")
-                            out_passthrough = b""  # skip write
-                        writer.write(out_passthrough)
-                        await writer.drain()
+                        with stage_timing.span("write", "all"):
+                            writer.write(out_passthrough)
+                            await writer.drain()
                         counter[direction] = counter.get(direction, 0) + len(out_passthrough)
                     continue  # already handled writing for this iteration
                 except Exception:
                     pass
+            if tds_parser_on and direction == "s2c":
+                try:
+                    _track_response(counter, data)
+                except Exception:
+                    counter["_s2c_desync"] = True
             # Heuristic SQL sniffing: use simple ascii window
             if engine is not None and os.getenv("ENABLE_TDS_PARSER", "false").lower() != "true":
                 try:
                     sample = data.decode("latin-1", errors="ignore")
                     # crude filter: look for keywords to avoid binary payloads
                     if any(k in sample.lower() for k in ("insert ", "update ", "delete ", "select ")):
-                        decision = engine.decide(Event(database=None, user=None, sql_text=sample, table=None, column=None, value=None))
+                        decision = _decide(engine, Event(database=None, user=None, sql_text=sample, table=None, column=None, value=None))
                         if decision.action == "block":
                             metrics_store.inc("blocks")
                             logger.warning(f"{conn_id} blocked by rule: {decision.reason}")
@@ -286,6 +993,8 @@ async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, dire
     except Exception as e:
         logger.debug(f"{conn_id} pipe error ({direction}): {e}")
     finally:
+        if direction == "c2s":
+            buffers.forget(conn_id)
         try:
             writer.close()
             await writer.wait_closed()
@@ -305,21 +1014,27 @@ async def handle_client(local_reader: asyncio.StreamReader, local_writer: asynci
         await local_writer.wait_closed()
         return
 
-    c2s = asyncio.create_task(_pipe(local_reader, remote_writer, "c2s", conn_id, counter))
-    s2c = asyncio.create_task(_pipe(remote_reader, local_writer, "s2c", conn_id, counter))
+    connections.register(conn_id, peer, counter)
+    try:
+        c2s = asyncio.create_task(_pipe(local_reader, remote_writer, "c2s", conn_id, counter))
+        s2c = asyncio.create_task(_pipe(remote_reader, local_writer, "s2c", conn_id, counter))
 
-    await asyncio.wait([c2s, s2c], return_when=asyncio.FIRST_COMPLETED)
-    for t in (c2s, s2c):
-        t.cancel()
-        with contextlib.suppress(Exception):
-            await t
+        await asyncio.wait([c2s, s2c], return_when=asyncio.FIRST_COMPLETED)
+        for t in (c2s, s2c):
+            t.cancel()
+            with contextlib.suppress(Exception):
+                await t
+    finally:
+        connections.unregister(conn_id)
+    # Prepared handles die with the server session
+    counter.pop("_prepared", None)
 
     logger.info(f"{conn_id} closed bytes c2s={counter.get('c2s',0)} s2c={counter.get('s2c',0)}")
 
 
 async def run_proxy(listen_host: str, listen_port: int, upstream_host: str, upstream_port: int, stop_event: Optional[asyncio.Event] = None):
     server = await asyncio.start_server(
-        lambda r, w: handle_client(r, w, upstream_host, upstream_port, f"conn-{id(w)}"), listen_host, listen_port
+        lambda r, w: handle_client(r, w, upstream_host, upstream_port, connections.next_id()), listen_host, listen_port
     )
     sockets = ", ".join(str(s.getsockname()) for s in server.sockets or [])
     logger.info(f"Proxy listening on {sockets} -> {upstream_host}:{upstream_port}")
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+try:
+    from src.metrics.prom_registry import loop_lag_gauge, loop_lag_hist
+except Exception:
+    loop_lag_gauge = None
+    loop_lag_hist = None
+
+# Recent samples (ms), enough for a p99 over the last minute at the default interval
+_samples: deque = deque(maxlen=600)
+_last_ms = 0.0
+_last_at = 0.0
+
+
+def _interval_s() -> float:
+    return float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")) / 1000.0
+
+
+def observe(lag_ms: float) -> None:
+    global _last_ms, _last_at
+    _last_ms = lag_ms
+    _last_at = time.monotonic()
+    _samples.append(lag_ms)
+    try:
+        if loop_lag_gauge:
+            loop_lag_gauge.set(lag_ms)
+        if loop_lag_hist:
+            loop_lag_hist.observe(lag_ms)
+    except Exception:
+        pass
+
+
+def last_ms() -> float:
+    """Most recent lag sample; 0 when no monitor has sampled in the last two seconds."""
+    if time.monotonic() - _last_at > 2.0:
+        return 0.0
+    return _last_ms
+
+
+def snapshot() -> Dict[str, Optional[float]]:
+    """Last, p50, p99 and max event loop lag (ms) over the recent samples."""
+    vals = sorted(_samples)
+    if not vals:
+        return {"last_ms": None, "p50_ms": None, "p99_ms": None, "max_ms": None, "samples": 0}
+    return {
+        "last_ms": round(_last_ms, 3),
+        "p50_ms": round(vals[len(vals) // 2], 3),
+        "p99_ms": round(vals[min(len(vals) - 1, int(len(vals) * 0.99))], 3),
+        "max_ms": round(vals[-1], 3),
+        "samples": len(vals),
+    }
+
+
+async def run_loop_lag_monitor(stop_event: asyncio.Event):
+    """Sleep for a fixed interval and record how late the loop woke us up (time other callbacks held it)."""
+    loop = asyncio.get_running_loop()
+    interval = _interval_s()
+    while not stop_event.is_set():
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        observe(max(0.0, (loop.time() - t0 - interval) * 1000.0))
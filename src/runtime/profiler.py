@@ -0,0 +1,115 @@
+"""
+On-demand sampling profiler for the running process.
+
+`profile(thread_id, seconds, hz)` samples one thread's Python stack (normally the event loop
+thread that runs the proxy and the API) from a helper thread, `hz` times per second, and
+returns collapsed stacks (`frame;frame;leaf count` lines, the input format of flamegraph.pl
+and speedscope) plus the functions with the most self and total samples. Nothing runs
+between requests; only one profile runs at a time, and duration and rate are capped by
+PROFILE_MAX_SECONDS (default 60) and PROFILE_MAX_HZ (default 250).
+
+The sampler needs the GIL to read a stack, so it lands where the sampled thread releases
+it: an idle loop shows up in `selectors:select`, while a loop busy in Python code (the case
+worth profiling) is sampled at its switch interval (5 ms) anywhere in that code.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+
+_busy = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def max_seconds() -> float:
+    return float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+
+def max_hz() -> int:
+    return int(os.getenv("PROFILE_MAX_HZ", "250"))
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or os.path.basename(code.co_filename)
+    return f"{module}:{code.co_name}"
+
+
+def _stack(frame, max_depth: int) -> tuple:
+    names: List[str] = []
+    while frame is not None and len(names) < max_depth:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()  # root first
+    return tuple(names)
+
+
+def profile(thread_id: int, seconds: float, hz: int = 100, max_depth: int = 64, top: int = 25) -> Dict[str, object]:
+    """Sample `thread_id` for `seconds` (blocking the caller); raises ProfilerBusy if one is running."""
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        seconds = max(0.0, min(float(seconds), max_seconds()))
+        hz = max(1, min(int(hz), max_hz()))
+        interval = 1.0 / hz
+        stacks: Counter = Counter()
+        missed = 0
+        cost = 0.0
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_at = start
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now < next_at:
+                time.sleep(min(next_at - now, deadline - now))
+                continue
+            next_at += interval
+            t0 = time.perf_counter()
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                missed += 1
+            else:
+                stacks[_stack(frame, max_depth)] += 1
+            del frame
+            cost += time.perf_counter() - t0
+        elapsed = time.perf_counter() - start
+    finally:
+        _busy.release()
+    return _report(stacks, hz, elapsed, missed, cost, top)
+
+
+def _report(stacks: Counter, hz: int, elapsed: float, missed: int, cost: float, top: int) -> Dict[str, object]:
+    samples = sum(stacks.values())
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    for stack, n in stacks.items():
+        if stack:
+            self_counts[stack[-1]] += n
+        for name in set(stack):
+            total_counts[name] += n
+
+    def _top(counts: Counter) -> List[Dict[str, object]]:
+        return [{"function": name, "samples": n, "percent": round(100.0 * n / samples, 2)} for name, n in counts.most_common(top)]
+
+    collapsed = "\n".join(f"{';'.join(stack)} {n}" for stack, n in stacks.most_common())
+    return {
+        "seconds": round(elapsed, 3),
+        "hz": hz,
+        "samples": samples,
+        "missed": missed,
+        "overhead_ms": round(cost * 1000.0, 3),  # time spent taking samples
+        "top_self": _top(self_counts) if samples else [],
+        "top_total": _top(total_counts) if samples else [],
+        "collapsed": collapsed,
+    }
+
+
+def running() -> bool:
+    return _busy.locked()
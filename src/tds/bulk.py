@@ -0,0 +1,228 @@
+"""
+Streaming decoder for Bulk Load (0x07) messages (INSERT BULK / BCP / SqlBulkCopy).
+
+A bulk load message is a COLMETADATA token followed by ROW/NBCROW tokens and a final DONE.
+Packets are fed as they are forwarded; only the bytes of an incomplete row are carried
+over (bounded by BULK_SCAN_MAX_CARRY). When COLMETADATA arrives the caller picks the
+columns it wants to see; only those values are decoded, other columns are skipped by
+length. If no column is wanted the decoder stops walking for the rest of the message.
+Rows are walked in Python, so the bytes walked per message are capped by
+BULK_SCAN_MAX_BYTES (default 16 MiB); past it counts cover the rows walked so far.
+"""
+import os
+import struct
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .tokens import COLMETADATA, DONE, DONEINPROC, DONEPROC, NBCROW, ROW, TEXTPTR
+from .typeinfo import TdsParseError, TdsTruncated, TypeInfo, decode_value, parse_type_info, read_b_varchar, read_value_span
+
+# Column plan kinds: fixed width, 1-byte length, 2-byte length, anything else (PLP, text, ...)
+_FIXED, _BYTE, _USHORT, _OTHER = 0, 1, 2, 3
+# 1-byte length types that use 0xFF (not 0) for NULL
+_LEGACY = {0x2F, 0x27, 0x2D, 0x25}
+
+
+def _max_carry() -> int:
+    return int(os.getenv("BULK_SCAN_MAX_CARRY", "1048576"))
+
+
+def _max_bytes() -> int:
+    return int(os.getenv("BULK_SCAN_MAX_BYTES", "16777216"))
+
+
+class BulkLoadDecoder:
+    """
+    Walk one bulk load message fed in arbitrary chunks.
+
+    `select(columns)` is called once with [(name, TypeInfo), ...] and returns the indexes
+    of the columns whose values should be decoded. Decoded values accumulate per column
+    (a column vector) until `take()` drains them.
+    """
+
+    def __init__(self, select: Optional[Callable[[List[Tuple[str, TypeInfo]]], Sequence[int]]] = None, max_carry: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.select = select
+        self.max_carry = _max_carry() if max_carry is None else max_carry
+        self.max_bytes = _max_bytes() if max_bytes is None else max_bytes
+        self.walked = 0
+        self.columns: Optional[List[Tuple[str, TypeInfo]]] = None
+        self.rows = 0
+        self.done = False
+        self.skipping = False  # no column selected: rows are no longer walked
+        self.broken = False  # stopped walking (bad token or carry over budget)
+        self.truncated = False  # stopped walking past max_bytes
+        self._plan: List[tuple] = []
+        self._nbc_bytes = 0
+        self._pending = 0  # complete rows in the vectors since the last take()
+        self._vectors: Dict[int, List[Optional[str]]] = {}
+        self._buf = b""
+
+    def feed(self, chunk: bytes) -> None:
+        if not chunk or self.done or self.skipping or self.broken or self.truncated:
+            return
+        buf = self._buf + chunk if self._buf else chunk
+        try:
+            off = self._walk(buf)
+        except TdsParseError:
+            self._stop()
+            return
+        self._buf = buf[off:]
+        self.walked += off
+        if len(self._buf) > self.max_carry:
+            self._stop()
+        elif self.walked > self.max_bytes and not self.done:
+            self.truncated = True
+            self._buf = b""
+
+    def take(self) -> Dict[int, List[Optional[str]]]:
+        """Values decoded since the last call, per selected column index."""
+        out = {}
+        for k, v in self._vectors.items():
+            if v:
+                out[k] = v.copy()
+                v.clear()  # the row plan holds these lists
+        self._pending = 0
+        return out
+
+    @property
+    def complete(self) -> bool:
+        """True when every row of the message was walked (row count is exact)."""
+        return self.done and not (self.broken or self.skipping or self.truncated)
+
+    def _stop(self) -> None:
+        self.broken = True
+        self._buf = b""
+
+    def _walk(self, buf: bytes) -> int:
+        off = 0
+        n = len(buf)
+        while off < n and not self.done:
+            tok = buf[off]
+            if tok == ROW or tok == NBCROW:
+                if self.columns is None:
+                    raise TdsParseError("ROW before COLMETADATA")
+                end = self._row(buf, off + 1, tok == NBCROW)
+                if end < 0:
+                    return off
+                off = end
+                self.rows += 1
+            elif tok in (DONE, DONEPROC, DONEINPROC):
+                if off + 13 > n:
+                    return off
+                self.done = True
+                return off + 13
+            elif tok == COLMETADATA:
+                try:
+                    off = self._colmetadata(buf, off + 1)
+                except (TdsTruncated, IndexError, struct.error):
+                    return off
+                if self.skipping:
+                    return n
+            else:
+                raise TdsParseError(f"unexpected bulk load token 0x{tok:02x}")
+        return off
+
+    def _colmetadata(self, buf: bytes, p: int) -> int:
+        if p + 2 > len(buf):
+            raise TdsTruncated("truncated TDS data")
+        count = buf[p] | (buf[p + 1] << 8)
+        p += 2
+        cols: List[Tuple[str, TypeInfo]] = []
+        if count != 0xFFFF:
+            for _ in range(count):
+                p += 6  # UserType (ULONG) + Flags (USHORT)
+                ti, p = parse_type_info(buf, p, in_colmetadata=True)
+                name, p = read_b_varchar(buf, p)
+                cols.append((name, ti))
+        self.columns = cols
+        wanted = set(self.select(cols)) if self.select else set()
+        self._vectors = {i: [] for i in sorted(wanted)}
+        plan = []
+        for i, (_, ti) in enumerate(cols):
+            if ti.len_kind == "fixed":
+                kind = _FIXED
+            elif ti.len_kind == "byte":
+                kind = _BYTE
+            elif ti.len_kind == "ushort":
+                kind = _USHORT
+                # character data is decoded inline; other 2-byte-length types go through decode_value
+                codec = "utf-16le" if ti.is_unicode else ("cp1252" if ti.is_text else "")
+                plan.append((kind, codec, ti, self._vectors.get(i)))
+                continue
+            else:
+                kind = _OTHER
+            plan.append((kind, ti.max_length, ti, self._vectors.get(i)))
+        self._plan = plan
+        self._nbc_bytes = (len(plan) + 7) // 8
+        self.skipping = not wanted
+        return p
+
+    def _row(self, buf: bytes, p: int, nbc: bool) -> int:
+        """Walk one row starting at `p`; return its end, or -1 when the row is incomplete."""
+        n = len(buf)
+        bitmap = None
+        if nbc:
+            nb = self._nbc_bytes
+            if p + nb > n:
+                return -1
+            bitmap = buf[p:p + nb]
+            p += nb
+        i = -1
+        for kind, size, ti, vec in self._plan:
+            i += 1
+            if bitmap is not None and bitmap[i >> 3] & (1 << (i & 7)):
+                if vec is not None:
+                    vec.append(None)
+                continue
+            if kind == 2:  # _USHORT
+                if p + 2 > n:
+                    return self._rollback()
+                ln = buf[p] | (buf[p + 1] << 8)
+                if ln == 0xFFFF:
+                    if vec is not None:
+                        vec.append(None)
+                    p += 2
+                    continue
+                end = p + 2 + ln
+                if end > n:
+                    return self._rollback()
+                if vec is not None:
+                    vec.append(buf[p + 2:end].decode(size) if size else decode_value(buf, read_value_span(buf, p, ti), ti))
+                p = end
+            elif kind == 0:  # _FIXED
+                if vec is not None:
+                    if p + size > n:
+                        return self._rollback()
+                    vec.append(decode_value(buf, read_value_span(buf, p, ti), ti))
+                p += size
+            elif kind == 1:  # _BYTE
+                if p >= n:
+                    return self._rollback()
+                ln = buf[p]
+                if (ln == 0xFF) if ti.type_id in _LEGACY else (ln == 0):
+                    if vec is not None:
+                        vec.append(None)
+                    p += 1
+                    continue
+                if p + 1 + ln > n:
+                    return self._rollback()
+                if vec is not None:
+                    vec.append(decode_value(buf, read_value_span(buf, p, ti), ti))
+                p += 1 + ln
+            else:
+                try:
+                    span = read_value_span(buf, p, ti, textptr=ti.type_id in TEXTPTR)
+                except TdsTruncated:
+                    return self._rollback()
+                if vec is not None:
+                    vec.append(decode_value(buf, span, ti))
+                p = span.end
+        if p > n:
+            return self._rollback()
+        self._pending += 1
+        return p
+
+    def _rollback(self) -> int:
+        """Drop the values of a partially walked row; it is walked again with the next chunk."""
+        for vec in self._vectors.values():
+            del vec[self._pending:]
+        return -1
@@ -1,4 +1,6 @@
-from typing import Optional, Tuple, List
+import struct
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, List
 
 
 TDS_TYPES = {
@@ -6,9 +8,12 @@ TDS_TYPES = {
     0x02: "Pre-TDS Login",
     0x03: "RPC",
     0x04: "Tabular Result",
-    0x12: "Login7",
-    0x07: "Attention",
+    0x06: "Attention",
+    0x07: "Bulk Load",
     0x0E: "Transaction Manager",
+    0x10: "Login7",
+    0x11: "SSPI",
+    0x12: "PreLogin",
 }
 
 
@@ -65,3 +70,169 @@ def extract_sqlbatch_text(chunks: List[bytes]) -> Optional[str]:
         except Exception:
             continue
     return None
+
+
+def split_all_headers(payload: bytes) -> Tuple[bytes, bytes]:
+    """
+    Split the ALL_HEADERS prefix (TDS 7.2+) off a SQL Batch or RPC payload.
+    Returns (headers, rest); headers is empty when the payload carries none.
+    """
+    if len(payload) < 4:
+        return b"", payload
+    total = struct.unpack_from("<I", payload, 0)[0]
+    if total < 4 or total > len(payload):
+        return b"", payload
+    off = 4
+    while off < total:
+        if off + 6 > total:
+            return b"", payload
+        hlen, htype = struct.unpack_from("<IH", payload, off)
+        if hlen < 6 or off + hlen > total or htype not in (1, 2, 3):
+            return b"", payload
+        off += hlen
+    if off != total:
+        return b"", payload
+    return payload[:total], payload[total:]
+
+
+def build_packets(typ: int, payload: bytes, spid: int = 0, packet_size: int = 4096, status: int = 0) -> bytes:
+    """
+    Frame a message payload into TDS packets of at most `packet_size` bytes.
+    `status` bits (e.g. RESETCONNECTION) are kept on the first packet; EOM is set on the last.
+    """
+    chunk = max(packet_size - 8, 1)
+    out = bytearray()
+    pkt = 1
+    off = 0
+    while True:
+        part = payload[off:off + chunk]
+        off += len(part)
+        last = off >= len(payload)
+        st = (status if pkt == 1 else 0) & ~EOM
+        if last:
+            st |= EOM
+        length = 8 + len(part)
+        out += bytes([typ, st, (length >> 8) & 0xFF, length & 0xFF, (spid >> 8) & 0xFF, spid & 0xFF, pkt & 0xFF, 0])
+        out += part
+        pkt += 1
+        if last:
+            break
+    return bytes(out)
+
+
+class PacketStream:
+    """
+    Incremental TDS packet framer for a byte stream that is forwarded as-is.
+    feed() returns (typ, status, chunk, packet_end) pieces without buffering whole packets;
+    only a partial 8-byte header is ever carried between reads.
+    """
+
+    def __init__(self):
+        self._hdr = b""
+        self._left = 0
+        self._typ = 0
+        self._status = 0
+
+    def feed(self, data: bytes) -> List[Tuple[int, int, bytes, bool]]:
+        out: List[Tuple[int, int, bytes, bool]] = []
+        off = 0
+        n = len(data)
+        while off < n:
+            if self._left == 0:
+                need = 8 - len(self._hdr)
+                self._hdr += data[off:off + need]
+                off += need
+                if len(self._hdr) < 8:
+                    break
+                typ, status, length, _, _, _ = parse_header(self._hdr)
+                self._hdr = b""
+                if length < 8:
+                    raise ValueError(f"bad TDS packet length {length}")
+                self._typ, self._status, self._left = typ, status, length - 8
+                if self._left == 0:
+                    out.append((typ, status, b"", True))
+                    continue
+            take = min(self._left, n - off)
+            self._left -= take
+            out.append((self._typ, self._status, data[off:off + take], self._left == 0))
+            off += take
+        return out
+
+
+# --- PreLogin / Login7 (MS-TDS 2.2.6.4, 2.2.6.5) ---
+
+PRELOGIN_OPTIONS = {0x00: "version", 0x01: "encryption", 0x02: "instance", 0x03: "thread_id", 0x04: "mars", 0x05: "trace_id", 0x06: "fed_auth_required"}
+ENCRYPTION = {0x00: "off", 0x01: "on", 0x02: "not_supported", 0x03: "required"}
+
+
+def parse_prelogin(payload: bytes) -> Optional[Dict[str, object]]:
+    """
+    Decode PRELOGIN option tokens (client request or server response).
+    Returns None for TLS handshake records carried in PRELOGIN packets.
+    """
+    if not payload or payload[0] in (0x14, 0x15, 0x16, 0x17):
+        return None
+    out: Dict[str, object] = {}
+    off = 0
+    try:
+        while payload[off] != 0xFF:
+            token, ofs, ln = struct.unpack_from(">BHH", payload, off)
+            off += 5
+            data = payload[ofs:ofs + ln]
+            name = PRELOGIN_OPTIONS.get(token)
+            if name == "version" and len(data) >= 6:
+                major, minor, build, sub = struct.unpack_from(">BBHH", data, 0)
+                out[name] = f"{major}.{minor}.{build}.{sub}"
+            elif name == "encryption" and data:
+                out[name] = ENCRYPTION.get(data[0], str(data[0]))
+            elif name == "mars" and data:
+                out[name] = bool(data[0])
+            elif name == "instance":
+                out[name] = data.rstrip(b"\x00").decode("latin-1")
+    except (IndexError, struct.error):
+        return None
+    return out
+
+
+@dataclass
+class LoginInfo:
+    tds_version: int
+    packet_size: int
+    user: str
+    database: str
+    app: str
+    host: str
+    server: str
+    read_only_intent: bool  # ApplicationIntent=ReadOnly
+    integrated_auth: bool  # SSPI/Kerberos: no SQL user name in the packet
+
+
+# OffsetLength table of LOGIN7: (offset of ib*, field) for the strings we keep
+_LOGIN7_FIELDS = ((36, "host"), (40, "user"), (48, "app"), (52, "server"), (68, "database"))
+
+
+def parse_login7(payload: bytes) -> Optional[LoginInfo]:
+    """
+    Decode the session attributes of a plaintext LOGIN7 message. The password is never read.
+    Returns None when the payload is not a LOGIN7 (e.g. the login is TLS-encrypted).
+    """
+    if len(payload) < 94:
+        return None
+    length, tds_version, packet_size = struct.unpack_from("<III", payload, 0)
+    if length != len(payload) or (tds_version >> 24) not in (0x70, 0x71, 0x72, 0x73, 0x74, 0x08):
+        return None
+    option_flags2 = payload[25]
+    type_flags = payload[26]
+    vals: Dict[str, str] = {}
+    for pos, name in _LOGIN7_FIELDS:
+        ib, cch = struct.unpack_from("<HH", payload, pos)
+        if ib + cch * 2 > len(payload):
+            return None
+        vals[name] = payload[ib:ib + cch * 2].decode("utf-16le", errors="replace")
+    return LoginInfo(
+        tds_version=tds_version,
+        packet_size=packet_size,
+        read_only_intent=bool(type_flags & 0x20),
+        integrated_auth=bool(option_flags2 & 0x80),
+        **vals,
+    )
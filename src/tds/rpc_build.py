@@ -1,11 +1,16 @@
 """
-Experimental TDS RPC Request payload builder for a subset of types (NVARCHAR, INT, BIT)
-and best‑effort extensions (DECIMAL/NUMERIC, DATE/TIME/DATETIME2/DATETIMEOFFSET,
-UNIQUEIDENTIFIER, VARBINARY). This is intended for controlled tests, not full TDS fidelity.
-This constructs only the RPC payload (not the outer TDS header). It is best-effort and
-intended for controlled testing, not production-grade TDS encoding.
+TDS RPC Request payload builder for a subset of types (NVARCHAR, INT, BIT) and best‑effort
+extensions (DECIMAL/NUMERIC, DATE/TIME/DATETIME2/DATETIMEOFFSET, UNIQUEIDENTIFIER, VARBINARY).
+
+This constructs only the RPC payload (not the outer TDS header); pass `headers` to prefix
+ALL_HEADERS. The output round-trips through `rpc_parse.parse_rpc_request`.
+
+The bytes that do not depend on values (procedure name, option flags, and each parameter's
+name, status and TYPE_INFO) are cached per (procedure, parameter signature). A build sizes the
+payload once, then copies the template pieces and packs values into a preallocated buffer.
 """
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+import struct
 import uuid
 from decimal import Decimal, InvalidOperation
 import datetime as dt
@@ -24,17 +29,20 @@ TDS_DATETIMEOFFSET = 0x2B
 TDS_UNIQUEIDENTIFIER = 0x24
 TDS_VARBINARY = 0xA5
 
+NVARCHAR_MAX_BYTES = 8000
+VARBINARY_MAX_BYTES = 8000
+_BASE_DATE = dt.date(1, 1, 1)
+
 
 def _us_varchar(s: str) -> bytes:
-    b = s.encode("ascii", errors="ignore")
-    if len(b) > 255:
-        b = b[:255]
-    return bytes([len(b)]) + b
+    # USHORT character count + UTF-16LE (procedure names)
+    return struct.pack("<H", len(s)) + s.encode("utf-16le")
 
 
 def _b_varchar(s: str) -> bytes:
-    # Same as US_VARCHAR in this context
-    return _us_varchar(s)
+    # BYTE character count + UTF-16LE (parameter names)
+    s = s[:255]
+    return bytes([len(s)]) + s.encode("utf-16le")
 
 
 def _collation_bytes() -> bytes:
@@ -43,164 +51,255 @@ def _collation_bytes() -> bytes:
     return b"\x09\x04\x00\x00\x00"  # LCID 0x0409 (en-US), sort id 0
 
 
-def build_rpc_payload(proc_name: str, params: List[Tuple[str, str, str]]) -> bytes:
-    out = bytearray()
-    # Procedure name as US_VARCHAR
-    out += _us_varchar(proc_name)
-    # Option flags (2 bytes)
-    out += b"\x00\x00"
-
-    for name, value, typ in params:
-        # Parameter name as B_VARCHAR including '@'
-        pname = name if name.startswith("@") else ("@" + name)
-        out += _b_varchar(pname)
-        # Status flags: 0x00 = input
-        out += b"\x00"
-        # UserType (4 bytes) and Flags (2 bytes)
-        out += b"\x00\x00\x00\x00"  # usertype
-        out += b"\x00\x00"  # flags
-
-        t = typ.lower()
-        if t == "int":
-            # INTN: type, max length, then value length + value
-            out += bytes([TDS_INTN])
-            out += b"\x04"  # max length 4
-            try:
-                iv = int(value)
-            except Exception:
-                iv = 0
-            out += b"\x04"  # actual length
-            out += int(iv).to_bytes(4, byteorder="little", signed=True)
-        elif t == "bit":
-            out += bytes([TDS_BITN])
-            out += b"\x01"  # max length 1
-            bv = 1 if str(value).strip().lower() in ("1", "true", "yes") else 0
-            out += b"\x01"  # actual length
-            out += bytes([bv])
-        elif t in ("decimal", "numeric"):
-            # Best-effort DECIMAL/NUMERIC encoding
-            out += bytes([TDS_DECIMALN if t == "decimal" else TDS_NUMERICN])
-            try:
-                d = Decimal(str(value))
-            except (InvalidOperation, ValueError):
-                d = Decimal(0)
-            sign = 1 if d >= 0 else 0
-            d = abs(d)
-            s = d.as_tuple()
-            scale = max(0, -s.exponent)
-            precision = len(s.digits)
-            # Storage length by precision (TDS rules simplified)
-            if precision <= 9:
-                stor_len = 5
-            elif precision <= 19:
-                stor_len = 9
-            elif precision <= 28:
-                stor_len = 13
-            else:
-                stor_len = 17
-            out += bytes([stor_len])  # max length
-            out += bytes([precision])
-            out += bytes([scale])
-            # Compute scaled integer
-            scaled = int(d.scaleb(scale))
-            val_bytes = scaled.to_bytes(stor_len - 1, byteorder="little", signed=False)
-            out += bytes([stor_len])  # actual length
-            out += bytes([sign]) + val_bytes
-        elif t in ("uniqueidentifier", "uuid"):
-            out += bytes([TDS_UNIQUEIDENTIFIER])
-            out += b"\x10"  # max length 16
-            try:
-                g = uuid.UUID(str(value))
-                data = g.bytes  # note: SQL Server uses mixed-endian; test harness doesn't decode
-            except Exception:
-                data = b"\x00" * 16
-            out += b"\x10"  # actual length
-            out += data
-        elif t in ("varbinary", "binary"):
-            out += bytes([TDS_VARBINARY])
-            out += (8000).to_bytes(2, byteorder="little")  # max length
-            data = bytes.fromhex(value) if all(c in "0123456789abcdefABCDEF" for c in value.replace(" ", "")) else value.encode()
-            out += len(data).to_bytes(2, byteorder="little")
-            out += data
-        elif t in ("date",):
-            out += bytes([TDS_DATE])
-            # DATE: 3-byte days since 0001-01-01
-            out += b"\x03"  # max length
-            try:
-                y, m, d = map(int, str(value).split("-")[:3])
-                days = (dt.date(y, m, d) - dt.date(1, 1, 1)).days
-            except Exception:
-                days = 0
-            out += b"\x03"  # actual length
-            out += int(days).to_bytes(3, byteorder="little", signed=False)
-        elif t in ("time",):
-            out += bytes([TDS_TIME])
-            scale = 7
-            out += bytes([scale])
-            # time storage length for scale 7 is 5 bytes
-            out += bytes([5])
-            # encode as 100ns ticks since midnight
-            try:
-                parts = str(value).split(":")
-                hh = int(parts[0])
-                mm = int(parts[1])
-                ss = int(parts[2].split(".")[0])
-                frac = parts[2].split(".")[1] if "." in parts[2] else "0"
-                frac = int((frac + "0" * 7)[:7])
-                ticks = ((hh * 3600 + mm * 60 + ss) * 10_000_000) + frac
-            except Exception:
-                ticks = 0
-            out += int(ticks).to_bytes(5, byteorder="little", signed=False)
-        elif t in ("datetime2",):
-            out += bytes([TDS_DATETIME2])
-            scale = 7
-            out += bytes([scale])
-            # time portion length + date (3) -> 5 + 3
-            out += bytes([8])
-            try:
-                dtv = dt.datetime.fromisoformat(str(value).replace("Z", "+00:00").split("+")[0])
-                base_date = dt.date(1, 1, 1)
-                days = (dtv.date() - base_date).days
-                seconds = dtv.hour * 3600 + dtv.minute * 60 + dtv.second
-                ticks = seconds * 10_000_000 + int(dtv.microsecond * 10)
-            except Exception:
-                days = 0
-                ticks = 0
-            out += int(ticks).to_bytes(5, byteorder="little", signed=False)
-            out += int(days).to_bytes(3, byteorder="little", signed=False)
-        elif t in ("datetimeoffset",):
-            out += bytes([TDS_DATETIMEOFFSET])
-            scale = 7
-            out += bytes([scale])
-            # time(5) + date(3) + offset(2) = 10
-            out += bytes([10])
-            try:
-                # Expect e.g. 2024-08-21T12:34:56+02:00
-                s = str(value)
-                if s.endswith("Z"):
-                    s = s[:-1] + "+00:00"
-                dtv = dt.datetime.fromisoformat(s)
-                base_date = dt.date(1, 1, 1)
-                days = (dtv.date() - base_date).days
-                seconds = dtv.hour * 3600 + dtv.minute * 60 + dtv.second
-                ticks = seconds * 10_000_000 + int(dtv.microsecond * 10)
-                # offset minutes
-                off = dtv.utcoffset().total_seconds() // 60 if dtv.utcoffset() else 0
-            except Exception:
-                days = 0
-                ticks = 0
-                off = 0
-            out += int(ticks).to_bytes(5, byteorder="little", signed=False)
-            out += int(days).to_bytes(3, byteorder="little", signed=False)
-            out += int(off).to_bytes(2, byteorder="little", signed=True)
+# --- value packers -------------------------------------------------------------------------
+# Fixed-size kinds: (value section size, packer(buf, off, value)); the section starts with the
+# actual-length byte and is written straight into the payload buffer with struct.pack_into.
+
+def _pack_int(buf: bytearray, off: int, value) -> None:
+    try:
+        iv = int(value)
+    except Exception:
+        iv = 0
+    struct.pack_into("<Bi", buf, off, 4, iv)
+
+
+def _pack_bit(buf: bytearray, off: int, value) -> None:
+    struct.pack_into("<BB", buf, off, 1, 1 if str(value).strip().lower() in ("1", "true", "yes") else 0)
+
+
+def _pack_uuid(buf: bytearray, off: int, value) -> None:
+    try:
+        data = uuid.UUID(str(value)).bytes_le  # SQL Server stores GUIDs mixed-endian
+    except Exception:
+        data = b"\x00" * 16
+    buf[off] = 16
+    buf[off + 1:off + 17] = data
+
+
+def _pack_date(buf: bytearray, off: int, value) -> None:
+    # DATE: 3-byte days since 0001-01-01
+    try:
+        y, m, d = map(int, str(value).split("-")[:3])
+        days = (dt.date(y, m, d) - _BASE_DATE).days
+    except Exception:
+        days = 0
+    struct.pack_into("<BHB", buf, off, 3, days & 0xFFFF, days >> 16)
+
+
+def _time_ticks(hh: int, mm: int, ss: int, ticks_frac: int) -> int:
+    # 100ns ticks since midnight (scale 7)
+    return ((hh * 3600 + mm * 60 + ss) * 10_000_000) + ticks_frac
+
+
+def _pack_ticks_days(buf: bytearray, off: int, ticks: int, days: Optional[int]) -> int:
+    struct.pack_into("<IB", buf, off, ticks & 0xFFFFFFFF, ticks >> 32)
+    off += 5
+    if days is not None:
+        struct.pack_into("<HB", buf, off, days & 0xFFFF, days >> 16)
+        off += 3
+    return off
+
+
+def _pack_time(buf: bytearray, off: int, value) -> None:
+    try:
+        parts = str(value).split(":")
+        hh = int(parts[0])
+        mm = int(parts[1])
+        ss = int(parts[2].split(".")[0])
+        frac = parts[2].split(".")[1] if "." in parts[2] else "0"
+        ticks = _time_ticks(hh, mm, ss, int((frac + "0" * 7)[:7]))
+    except Exception:
+        ticks = 0
+    buf[off] = 5
+    _pack_ticks_days(buf, off + 1, ticks, None)
+
+
+def _split_datetime(value, keep_offset: bool) -> Tuple[int, int, int]:
+    s = str(value)
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    if not keep_offset:
+        s = s.split("+")[0]
+    dtv = dt.datetime.fromisoformat(s)
+    days = (dtv.date() - _BASE_DATE).days
+    ticks = _time_ticks(dtv.hour, dtv.minute, dtv.second, dtv.microsecond * 10)
+    off = int(dtv.utcoffset().total_seconds() // 60) if dtv.utcoffset() else 0
+    return ticks, days, off
+
+
+def _pack_datetime2(buf: bytearray, off: int, value) -> None:
+    try:
+        ticks, days, _ = _split_datetime(value, keep_offset=False)
+    except Exception:
+        ticks, days = 0, 0
+    buf[off] = 8  # time(5) + date(3)
+    _pack_ticks_days(buf, off + 1, ticks, days)
+
+
+def _pack_datetimeoffset(buf: bytearray, off: int, value) -> None:
+    try:
+        ticks, days, minutes = _split_datetime(value, keep_offset=True)
+    except Exception:
+        ticks, days, minutes = 0, 0, 0
+    buf[off] = 10  # time(5) + date(3) + offset(2)
+    p = _pack_ticks_days(buf, off + 1, ticks, days)
+    struct.pack_into("<h", buf, p, minutes)
+
+
+_FIXED: Dict[str, Tuple[bytes, int, Callable]] = {
+    # kind: (TYPE_INFO, value section size, packer)
+    "int": (bytes([TDS_INTN, 4]), 5, _pack_int),
+    "bit": (bytes([TDS_BITN, 1]), 2, _pack_bit),
+    "uniqueidentifier": (bytes([TDS_UNIQUEIDENTIFIER, 16]), 17, _pack_uuid),
+    "date": (bytes([TDS_DATE]), 4, _pack_date),
+    "time": (bytes([TDS_TIME, 7]), 6, _pack_time),
+    "datetime2": (bytes([TDS_DATETIME2, 7]), 9, _pack_datetime2),
+    "datetimeoffset": (bytes([TDS_DATETIMEOFFSET, 7]), 11, _pack_datetimeoffset),
+}
+
+
+# Variable-size kinds: encoder(value) -> bytes written after the template prefix.
+
+def _encode_nvarchar(value) -> bytes:
+    data = str(value).encode("utf-16le", errors="ignore")
+    if len(data) > NVARCHAR_MAX_BYTES:
+        raise ValueError("value exceeds nvarchar(4000)")
+    return data
+
+
+def _encode_varbinary(value) -> bytes:
+    value = str(value)
+    data = bytes.fromhex(value) if all(c in "0123456789abcdefABCDEF" for c in value.replace(" ", "")) else value.encode()
+    if len(data) > VARBINARY_MAX_BYTES:
+        raise ValueError("value exceeds varbinary(8000)")
+    return data
+
+
+def _encode_decimal(value, type_id: int) -> bytes:
+    # Precision and scale come from the value, so the TYPE_INFO is emitted here, not templated
+    try:
+        d = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        d = Decimal(0)
+    sign = 1 if d >= 0 else 0
+    d = abs(d)
+    s = d.as_tuple()
+    scale = max(0, -s.exponent)
+    precision = max(len(s.digits), scale, 1)
+    # Storage length by precision (TDS rules simplified)
+    if precision <= 9:
+        stor_len = 5
+    elif precision <= 19:
+        stor_len = 9
+    elif precision <= 28:
+        stor_len = 13
+    else:
+        stor_len = 17
+    scaled = int(d.scaleb(scale))
+    return bytes([type_id, stor_len, precision, scale, stor_len, sign]) + scaled.to_bytes(stor_len - 1, byteorder="little", signed=False)
+
+
+_VARIABLE: Dict[str, Tuple[bytes, bool, Callable]] = {
+    # kind: (TYPE_INFO kept in the template, USHORT length prefix written by the builder, encoder)
+    "nvarchar": (bytes([TDS_NVARCHAR]) + struct.pack("<H", NVARCHAR_MAX_BYTES) + _collation_bytes(), True, _encode_nvarchar),
+    "varbinary": (bytes([TDS_VARBINARY]) + struct.pack("<H", VARBINARY_MAX_BYTES), True, _encode_varbinary),
+    "decimal": (b"", False, lambda v: _encode_decimal(v, TDS_DECIMALN)),
+    "numeric": (b"", False, lambda v: _encode_decimal(v, TDS_NUMERICN)),
+}
+
+_ALIASES = {"uuid": "uniqueidentifier", "binary": "varbinary"}
+
+
+def supports(typ: str) -> bool:
+    """True when `typ` is encoded as itself (anything else falls back to NVARCHAR)."""
+    t = (typ or "").lower()
+    t = _ALIASES.get(t, t)
+    return t in _FIXED or t in _VARIABLE
+
+
+def _kind(typ: str) -> str:
+    t = (typ or "").lower()
+    t = _ALIASES.get(t, t)
+    return t if t in _FIXED or t in _VARIABLE else "nvarchar"
+
+
+# --- templates -------------------------------------------------------------------------------
+
+class _Template:
+    __slots__ = ("header", "steps", "fixed_size")
+
+    def __init__(self, header: bytes, steps: List[tuple], fixed_size: int):
+        self.header = header
+        # Per parameter: (prefix, fixed value size or None, packer/encoder, USHORT length prefix);
+        # the prefix is name + status + TYPE_INFO (when value independent)
+        self.steps = steps
+        self.fixed_size = fixed_size  # header + prefixes + fixed-size value sections + length prefixes
+
+
+_TEMPLATES: Dict[tuple, _Template] = {}
+_MAX_TEMPLATES = 1024
+
+
+def _template(proc_name: str, signature: tuple) -> _Template:
+    header = _us_varchar(proc_name) + b"\x00\x00"  # option flags
+    steps: List[tuple] = []
+    size = len(header)
+    for name, typ in signature:
+        kind = _kind(typ)
+        # Parameter name as B_VARCHAR including '@' (empty for positional parameters), status 0 = input
+        pname = name if (not name or name.startswith("@")) else ("@" + name)
+        prefix = _b_varchar(pname) + b"\x00"
+        if kind in _FIXED:
+            type_info, vsize, packer = _FIXED[kind]
+            steps.append((prefix + type_info, vsize, packer, False))
+            size += len(prefix) + len(type_info) + vsize
         else:
-            # NVARCHAR
-            out += bytes([TDS_NVARCHAR])
-            # Max length in bytes (UTF-16LE): choose 4000 chars = 8000 bytes
-            out += (8000).to_bytes(2, byteorder="little")
-            out += _collation_bytes()
-            data = str(value).encode("utf-16le", errors="ignore")
-            out += len(data).to_bytes(2, byteorder="little")
-            out += data
-
-    return bytes(out)
+            type_info, ushort_len, encoder = _VARIABLE[kind]
+            steps.append((prefix + type_info, None, encoder, ushort_len))
+            size += len(prefix) + len(type_info) + (2 if ushort_len else 0)
+    tpl = _Template(header, steps, size)
+    if len(_TEMPLATES) >= _MAX_TEMPLATES:
+        _TEMPLATES.clear()
+    _TEMPLATES[(proc_name, signature)] = tpl
+    return tpl
+
+
+def template_cache_size() -> int:
+    return len(_TEMPLATES)
+
+
+def build_rpc_payload(proc_name: str, params: List[Tuple[str, str, str]], headers: bytes = b"") -> bytes:
+    """Build an RPC request payload for `params` given as (name, value, type) triples."""
+    signature = tuple([(p[0], p[2]) for p in params])
+    tpl = _TEMPLATES.get((proc_name, signature)) or _template(proc_name, signature)
+    # Encode variable-size values first so the buffer is allocated once at its final size
+    encoded = []
+    total = len(headers) + tpl.fixed_size
+    for step, p in zip(tpl.steps, params):
+        if step[1] is None:
+            data = step[2](p[1])
+            encoded.append(data)
+            total += len(data)
+    buf = bytearray(total)
+    off = len(headers)
+    buf[:off] = headers
+    n = len(tpl.header)
+    buf[off:off + n] = tpl.header
+    off += n
+    var = iter(encoded)
+    for (prefix, vsize, fn, ushort_len), p in zip(tpl.steps, params):
+        n = len(prefix)
+        buf[off:off + n] = prefix
+        off += n
+        if vsize is not None:
+            fn(buf, off, p[1])
+            off += vsize
+            continue
+        data = next(var)
+        n = len(data)
+        if ushort_len:
+            struct.pack_into("<H", buf, off, n)
+            off += 2
+        buf[off:off + n] = data
+        off += n
+    return bytes(buf)
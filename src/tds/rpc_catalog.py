@@ -0,0 +1,154 @@
+"""
+Learned RPC parameter type catalog.
+
+Every token-parsed RPC call carries the TYPE_INFO of its parameters. The proxy records them
+per procedure so later rewrites (and operators, via the API) know the real parameter types
+without a hand-maintained map. Lookups are in-memory; the catalog is written to
+RPC_CATALOG_PATH (default data/rpc_catalog.json) at most every RPC_CATALOG_FLUSH_SECONDS
+(default 30) and loaded back on first use.
+"""
+import json
+import os
+import time
+from threading import RLock
+from typing import Dict, Optional
+
+from .rpc_parse import PROC_IDS, RpcRequest
+
+_lock = RLock()
+_catalog: Dict[str, Dict[str, dict]] = {}  # proc -> param -> entry
+_seen: Dict[tuple, int] = {}  # (proc, ((name, raw TYPE_INFO), ...)) -> calls since last flush
+_loaded = False
+_dirty = False
+_flushed_at = 0.0
+_SYSTEM_PROCS = set(PROC_IDS.values())
+
+
+def _path() -> str:
+    return os.getenv("RPC_CATALOG_PATH", "data/rpc_catalog.json")
+
+
+def _key(name: str) -> str:
+    return (name or "").lstrip("@").lower()
+
+
+def _proc_name(proc: str) -> str:
+    return (proc or "").replace("[", "").replace("]", "").lower()
+
+
+def _load() -> None:
+    global _loaded
+    _loaded = True
+    try:
+        with open(_path(), "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        for proc, params in raw.items():
+            _catalog.setdefault(proc, {}).update(params)
+    except Exception:
+        pass
+
+
+def observe(req: RpcRequest) -> None:
+    """Record the parameter types of a parsed RPC call (user procedures only)."""
+    global _dirty
+    proc = _proc_name(req.proc)
+    if not proc or req.proc_id is not None or proc.split(".")[-1] in _SYSTEM_PROCS:
+        return
+    sig = (proc, tuple([(p.name, p.type_info.raw) for p in req.params]))
+    with _lock:
+        n = _seen.get(sig)
+        if n is not None:
+            # Known signature: only count the call
+            _seen[sig] = n + 1
+            _dirty = True
+        else:
+            if not _loaded:
+                _load()
+            if len(_seen) >= 4096:
+                _fold_counts()
+                _seen.clear()
+            _seen[sig] = 1
+            params = _catalog.setdefault(proc, {})
+            now = int(time.time())
+            for p in req.params:
+                if not p.name:
+                    continue
+                ti = p.type_info
+                entry = params.get(_key(p.name)) or {"count": 0, "first_seen": now}
+                entry.update({"name": p.name, "type": ti.name, "max_length": ti.max_length, "precision": ti.precision, "scale": ti.scale, "last_seen": now})
+                params[_key(p.name)] = entry
+            _dirty = True
+    maybe_flush()
+
+
+def lookup(proc: str, param: str) -> Optional[str]:
+    """Learned SQL type name for a procedure parameter, or None."""
+    with _lock:
+        if not _loaded:
+            _load()
+        entry = _catalog.get(_proc_name(proc), {}).get(_key(param))
+    return entry["type"] if entry else None
+
+
+def snapshot(proc: Optional[str] = None) -> Dict[str, Dict[str, dict]]:
+    _fold_counts()
+    with _lock:
+        if not _loaded:
+            _load()
+        if proc:
+            p = _proc_name(proc)
+            return {p: {k: dict(v) for k, v in _catalog.get(p, {}).items()}}
+        return {p: {k: dict(v) for k, v in params.items()} for p, params in _catalog.items()}
+
+
+def _fold_counts() -> None:
+    """Move per-signature call counts into the parameter entries."""
+    global _dirty
+    with _lock:
+        for (proc, sig), n in list(_seen.items()):
+            if n <= 0:
+                continue
+            params = _catalog.get(proc, {})
+            for name, _ in sig:
+                entry = params.get(_key(name))
+                if entry is not None:
+                    entry["count"] = entry.get("count", 0) + n
+            _seen[(proc, sig)] = 0
+            _dirty = True
+
+
+def maybe_flush(force: bool = False) -> bool:
+    global _flushed_at
+    now = time.monotonic()
+    if not force and (not _dirty or now - _flushed_at < float(os.getenv("RPC_CATALOG_FLUSH_SECONDS", "30"))):
+        return False
+    _flushed_at = now
+    return flush()
+
+
+def flush() -> bool:
+    """Write the catalog to disk (atomic replace)."""
+    global _dirty
+    _fold_counts()
+    with _lock:
+        data = json.dumps(_catalog, indent=2, sort_keys=True)
+        _dirty = False
+    try:
+        p = _path()
+        os.makedirs(os.path.dirname(p) or ".", exist_ok=True)
+        tmp = p + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, p)
+        return True
+    except Exception:
+        return False
+
+
+def clear() -> None:
+    global _loaded, _dirty
+    with _lock:
+        _catalog.clear()
+        _seen.clear()
+        _loaded = True
+        _dirty = False
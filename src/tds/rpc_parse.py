@@ -1,5 +1,8 @@
 import re
-from typing import List, Tuple, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Optional
+from .parser import split_all_headers
+from .typeinfo import TdsParseError, TypeInfo, ValueSpan, parse_type_info, read_value_span, read_b_varchar, decode_value
 
 
 def decode_utf16le_best_effort(data: bytes) -> str:
@@ -34,3 +37,196 @@ def extract_proc_and_params(payload: bytes) -> Tuple[Optional[str], List[Tuple[s
             params.append((name, vm.group(1)))
     return proc, params
 
+
+# --- Token-level RPC request parser (MS-TDS 2.2.6.6) ---
+
+# Well-known procedures addressed by id instead of name (NameLenProcID == 0xFFFF)
+PROC_IDS = {
+    1: "sp_cursor",
+    2: "sp_cursoropen",
+    3: "sp_cursorprepare",
+    4: "sp_cursorexecute",
+    5: "sp_cursorprepexec",
+    6: "sp_cursorunprepare",
+    7: "sp_cursorfetch",
+    8: "sp_cursoroption",
+    9: "sp_cursorclose",
+    10: "sp_executesql",
+    11: "sp_prepare",
+    12: "sp_execute",
+    13: "sp_prepexec",
+    14: "sp_prepexecrpc",
+    15: "sp_unprepare",
+}
+
+STATUS_BYREF = 0x01
+STATUS_DEFAULT = 0x02
+
+
+class RpcParseError(TdsParseError):
+    pass
+
+
+@dataclass
+class RpcParam:
+    name: str  # as sent, including '@'; empty for positional parameters
+    status: int
+    type_info: TypeInfo
+    value: Optional[str]  # best-effort decoded value; None for NULL
+    offset: int  # start of the parameter (ParamName) in the payload
+    span: ValueSpan  # exact location of the value bytes in the payload
+
+    @property
+    def value_offset(self) -> int:
+        return self.span.data_offset
+
+    @property
+    def value_length(self) -> int:
+        return self.span.data_length
+
+
+@dataclass
+class RpcRequest:
+    proc_name: Optional[str]
+    proc_id: Optional[int]
+    option_flags: int
+    headers: bytes
+    params: List[RpcParam] = field(default_factory=list)
+    end: int = 0  # offset after the last parsed parameter (batch separator or end of payload)
+
+    @property
+    def proc(self) -> Optional[str]:
+        if self.proc_name:
+            return self.proc_name
+        return PROC_IDS.get(self.proc_id or -1)
+
+
+def batch_separators(tds_version: Optional[int] = None) -> Tuple[int, ...]:
+    """
+    Bytes that end one RPC of a batched request and start the next. Before TDS 7.2 that is
+    BatchFlag 0x80; from 7.2 on it is 0xFF, or 0xFE (NoExecFlag), and 0x80 is a legal
+    parameter name length (128 characters). An unknown version is taken as 7.2 or later.
+    """
+    if tds_version is not None and (tds_version >> 24) in (0x70, 0x71):
+        return (0x80,)
+    return (0xFF, 0xFE)
+
+
+def parse_rpc_request(payload: bytes, tds_version: Optional[int] = None, start: Optional[int] = None) -> RpcRequest:
+    """
+    Parse the first RPC of an RPC Request message payload (optionally prefixed with ALL_HEADERS),
+    or the RPC at `start` (no ALL_HEADERS: only the first RPC of a message carries them).
+    `tds_version` (LOGIN7) selects the batch separator, see `batch_separators`.
+    Raises RpcParseError when the payload is not a well-formed RPC request.
+    Offsets in the result are relative to `payload`.
+    """
+    if start is None:
+        headers, _ = split_all_headers(payload)
+        off = len(headers)
+    else:
+        headers, off = b"", start
+    buf = bytes(payload)
+    seps = batch_separators(tds_version)
+    try:
+        if off + 2 > len(buf):
+            raise RpcParseError("missing procedure name")
+        nlen = buf[off] | (buf[off + 1] << 8)
+        off += 2
+        proc_name = None
+        proc_id = None
+        if nlen == 0xFFFF:
+            if off + 2 > len(buf):
+                raise RpcParseError("missing procedure id")
+            proc_id = buf[off] | (buf[off + 1] << 8)
+            off += 2
+        else:
+            if nlen == 0 or off + nlen * 2 > len(buf):
+                raise RpcParseError("bad procedure name length")
+            proc_name = buf[off:off + nlen * 2].decode("utf-16le", errors="replace")
+            off += nlen * 2
+        if off + 2 > len(buf):
+            raise RpcParseError("missing option flags")
+        flags = buf[off] | (buf[off + 1] << 8)
+        off += 2
+        req = RpcRequest(proc_name, proc_id, flags, headers)
+        while off < len(buf) and buf[off] not in seps:
+            start = off
+            name, off = read_b_varchar(buf, off)
+            if off >= len(buf):
+                raise RpcParseError("truncated parameter")
+            status = buf[off]
+            off += 1
+            ti, off = parse_type_info(buf, off)
+            span = read_value_span(buf, off, ti)
+            req.params.append(RpcParam(name, status, ti, decode_value(buf, span, ti), start, span))
+            off = span.end
+        req.end = off
+        return req
+    except RpcParseError:
+        raise
+    except (TdsParseError, IndexError) as e:
+        raise RpcParseError(str(e)) from e
+
+
+def split_rpc_batch(payload: bytes, tds_version: Optional[int] = None) -> Tuple[List[Tuple[bytes, bytes, RpcRequest]], bytes]:
+    """
+    Every RPC of an RPC Request message as (separator, payload, request); the separator is
+    empty for the first RPC, which keeps the ALL_HEADERS. Each request's offsets are relative
+    to its own payload. Also returns the bytes after the last RPC that parsed (empty when all
+    did). Raises RpcParseError when the first RPC is malformed.
+    """
+    seps = batch_separators(tds_version)
+    req = parse_rpc_request(payload, tds_version)
+    parts = [(b"", payload if req.end == len(payload) else payload[:req.end], req)]
+    pos = req.end
+    while pos + 1 < len(payload) and payload[pos] in seps:
+        chunk = payload[pos + 1:]
+        try:
+            req = parse_rpc_request(chunk, tds_version, start=0)
+        except RpcParseError:
+            break
+        parts.append((payload[pos:pos + 1], chunk[:req.end], req))
+        pos += 1 + req.end
+    return parts, payload[pos:]
+
+
+def rewrite_param_values(payload: bytes, req: RpcRequest, replacements: Dict[int, bytes]) -> bytes:
+    """
+    Return a copy of `payload` where parameter i's value bytes are replaced by replacements[i].
+    Length prefixes are patched to match, so values may grow up to the declared max length.
+    Raises ValueError when a replacement does not fit its parameter's TYPE_INFO.
+    """
+    out = bytearray()
+    pos = 0
+    for idx in sorted(replacements):
+        p = req.params[idx]
+        data = replacements[idx]
+        ti = p.type_info
+        sp = p.span
+        if ti.len_kind == "ushort":
+            if len(data) > ti.max_length:
+                raise ValueError(f"value for {p.name} exceeds max length {ti.max_length}")
+            prefix = len(data).to_bytes(2, "little")
+        elif ti.len_kind == "long":
+            prefix = len(data).to_bytes(4, "little")
+        elif ti.len_kind == "plp":
+            # Re-emit as a single chunk: total length, chunk length, data, terminator.
+            # An empty value is the total length and the terminator alone (a zero-length
+            # chunk is the terminator).
+            if data:
+                prefix = len(data).to_bytes(8, "little") + len(data).to_bytes(4, "little")
+                data = data + b"\x00\x00\x00\x00"
+            else:
+                prefix = len(data).to_bytes(8, "little") + b"\x00\x00\x00\x00"
+        elif ti.len_kind == "byte" and ti.type_id in (0x2F, 0x27, 0x2D, 0x25):
+            if len(data) > ti.max_length:
+                raise ValueError(f"value for {p.name} exceeds max length {ti.max_length}")
+            prefix = bytes([len(data)])
+        else:
+            raise ValueError(f"cannot rewrite {ti.name} parameter {p.name}")
+        out += payload[pos:sp.len_offset]
+        out += prefix
+        out += data
+        pos = sp.end
+    out += payload[pos:]
+    return bytes(out)
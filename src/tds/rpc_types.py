@@ -1,5 +1,6 @@
 import json
 import os
+import time
 from typing import Dict
 
 
@@ -21,3 +22,30 @@ def load_param_types(path: str | None = None) -> Dict[str, Dict[str, str]]:
     except Exception:
         return {}
 
+
+
+_cached: Dict[str, Dict[str, str]] = {}
+_cached_key: tuple = ()
+_checked_at = 0.0
+
+
+def get_param_types() -> Dict[str, Dict[str, str]]:
+    """
+    Cached `load_param_types()` for hot paths. The file is parsed once and re-read only when
+    its path or mtime changes; the mtime is checked at most every RPC_PARAM_TYPES_CHECK_SECONDS
+    (default 5).
+    """
+    global _cached, _cached_key, _checked_at
+    now = time.monotonic()
+    if _cached_key and now - _checked_at < float(os.getenv("RPC_PARAM_TYPES_CHECK_SECONDS", "5")):
+        return _cached
+    _checked_at = now
+    p = os.getenv("RPC_PARAM_TYPES_PATH", "config/rpc_param_types.json")
+    try:
+        mtime = os.stat(p).st_mtime_ns
+    except OSError:
+        mtime = None
+    if (p, mtime) != _cached_key:
+        _cached = load_param_types(p) if mtime is not None else {}
+        _cached_key = (p, mtime)
+    return _cached
@@ -1,5 +1,5 @@
 import re
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 
 def extract_table_and_columns(sql_text: str) -> Tuple[Optional[str], List[str]]:
@@ -172,6 +172,18 @@ def detect_bulk_insert(sql_text: str) -> Tuple[Optional[str], Optional[str]]:
     return table, path
 
 
+def detect_insert_bulk(sql_text: str) -> Optional[str]:
+    """
+    Detects the INSERT BULK statement that precedes a Bulk Load (0x07) message
+    (sent by BCP/SqlBulkCopy). Returns the target table or None.
+      INSERT BULK dbo.Customers ([Email] NVarChar(100) COLLATE ..., [Age] Int)
+    """
+    m = re.match(r"\s*insert\s+bulk\s+((?:\[[^\]]+\]|[\w#@$]+)(?:\.(?:\[[^\]]+\]|[\w#@$]+))*)", sql_text, re.IGNORECASE)
+    if not m:
+        return None
+    return m.group(1).replace("[", "").replace("]", "")
+
+
 def detect_merge(sql_text: str) -> Tuple[Optional[str], List[str], List[str]]:
     """
     Detect a basic MERGE and extract target table, update column names and
@@ -246,3 +258,65 @@ def extract_select_info(sql_text: str) -> Tuple[List[str], List[str], bool]:
         tables.append(tbl)
 
     return tables, cols, select_star
+
+
+# --- Parameterized statements (sp_executesql / sp_prepare) ---
+
+def parse_param_declarations(decl: str) -> List[Tuple[str, str]]:
+    """
+    Split an sp_executesql @params string into (name, type) pairs.
+    Example: "@p0 nvarchar(4000),@p1 decimal(10,2) OUTPUT" -> [("@p0", "nvarchar(4000)"), ("@p1", "decimal(10,2)")]
+    """
+    out: List[Tuple[str, str]] = []
+    depth = 0
+    buf = []
+    parts = []
+    for ch in decl or "":
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append("".join(buf))
+            buf = []
+        else:
+            buf.append(ch)
+    if buf:
+        parts.append("".join(buf))
+    for part in parts:
+        m = re.match(r"\s*(@[\w@#$]+)\s+(?:as\s+)?([\w]+(?:\s*\([^\)]*\))?)", part, re.IGNORECASE)
+        if m:
+            out.append((m.group(1), m.group(2).replace(" ", "").lower()))
+    return out
+
+
+def map_params_to_columns(sql_text: str) -> Tuple[Optional[str], Dict[str, str]]:
+    """
+    Map parameter markers to the columns they are written to in simple INSERT/UPDATE statements.
+    Returns (table, {"@p0": "dbo.Users.Email", ...}); parameter names are lower-cased.
+      INSERT INTO dbo.Users (Email, Phone) VALUES (@p0, @p1)
+      UPDATE dbo.Users SET Email = @p0 WHERE Id = @p1
+    """
+    table, cols = extract_table_and_columns(sql_text)
+    if not table or not cols:
+        return None, {}
+    mapping: Dict[str, str] = {}
+    if re.match(r"\s*insert\s", sql_text, re.IGNORECASE):
+        rows = extract_multirow_values(sql_text) or []
+        for row in rows:
+            if len(row) != len(cols):
+                continue
+            for col, v in zip(cols, row):
+                if re.fullmatch(r"@[\w@#$]+", v.strip()):
+                    mapping.setdefault(v.strip().lower(), f"{table}.{col}")
+    else:
+        m = re.search(r"update\s+[\w\.\[\]]+\s+set\s+(.+?)\s+where\s", sql_text, re.IGNORECASE | re.DOTALL)
+        if m:
+            for part in _split_csv_respecting_quotes(m.group(1)):
+                if "=" not in part:
+                    continue
+                left, right = part.split("=", 1)
+                right = right.strip()
+                if re.fullmatch(r"@[\w@#$]+", right):
+                    mapping.setdefault(right.lower(), f"{table}.{left.strip(' []')}")
+    return table, mapping
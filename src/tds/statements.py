@@ -0,0 +1,75 @@
+"""
+Statement analysis cache for parameterized SQL (sp_executesql, sp_prepare, ...).
+
+Drivers send the same statement text on every execution, so the analysis (target table,
+parameter -> column mapping, declared parameter types) is computed once per statement
+fingerprint and reused. Repeat executions of identical text cost a single cache lookup.
+"""
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from .sqlparse_simple import map_params_to_columns, parse_param_declarations
+
+_MAX = int(os.getenv("STMT_CACHE_SIZE", "4096"))
+
+
+@dataclass
+class StatementInfo:
+    fingerprint: str
+    table: Optional[str]
+    param_columns: Dict[str, str] = field(default_factory=dict)  # lower-cased "@p0" -> "dbo.T.Col"
+    param_types: List[Tuple[str, str]] = field(default_factory=list)  # declared (name, type)
+
+    def column_for(self, param_name: str) -> Optional[str]:
+        return self.param_columns.get(param_name.lower())
+
+
+_STRING_LIT = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBER_LIT = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=_MAX)
+def statement_fingerprint(sql_text: str) -> str:
+    """Stable id for a statement shape: literals replaced, whitespace collapsed, case folded."""
+    s = _STRING_LIT.sub("?", sql_text or "")
+    s = _NUMBER_LIT.sub("?", s)
+    s = _SPACE.sub(" ", s).strip().lower()
+    return hashlib.blake2b(s.encode("utf-8"), digest_size=8).hexdigest()
+
+
+_cache: "OrderedDict[Tuple[str, str], StatementInfo]" = OrderedDict()
+_lock = Lock()
+
+
+def analyze_statement(sql_text: str, declarations: str = "") -> StatementInfo:
+    """Return the (cached) analysis for a parameterized statement."""
+    key = (statement_fingerprint(sql_text), declarations or "")
+    with _lock:
+        info = _cache.get(key)
+        if info is not None:
+            _cache.move_to_end(key)
+            return info
+    table, mapping = map_params_to_columns(sql_text)
+    info = StatementInfo(key[0], table, mapping, parse_param_declarations(declarations))
+    with _lock:
+        _cache[key] = info
+        while len(_cache) > _MAX:
+            _cache.popitem(last=False)
+    return info
+
+
+def cache_size() -> int:
+    return len(_cache)
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
+    statement_fingerprint.cache_clear()
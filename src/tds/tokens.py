@@ -0,0 +1,256 @@
+"""
+Incremental token scanner for server responses (MS-TDS 2.2.7, TDS 7.2+).
+
+The proxy forwards server bytes untouched; this scanner only watches them. Tokens may
+span packets, so unconsumed bytes are carried until the next chunk arrives. The carry
+and the number of bytes walked per message are bounded: past either limit the scanner
+stops walking and only the tail of the message is searched for trailing tokens
+(RETURNVALUE, DONE/DONEPROC), which is where the interesting facts live anyway.
+"""
+import os
+import struct
+from typing import List, Optional, Tuple
+
+from .typeinfo import TdsParseError, TdsTruncated, TypeInfo, decode_value, parse_type_info, read_b_varchar, read_us_varchar, read_value_span
+
+COLMETADATA = 0x81
+ROW = 0xD1
+NBCROW = 0xD2
+RETURNSTATUS = 0x79
+RETURNVALUE = 0xAC
+DONE = 0xFD
+DONEPROC = 0xFE
+DONEINPROC = 0xFF
+ERROR = 0xAA
+INFO = 0xAB
+ORDER = 0xA9
+OFFSET = 0x78
+ENVCHANGE = 0xE3
+FEATUREEXTACK = 0xAE
+
+ENV_DATABASE = 1
+ENV_PACKET_SIZE = 4
+
+# Row values of text, ntext and image carry a text pointer; sql_variant does not
+TEXTPTR = (0x22, 0x23, 0x63)
+
+DONE_ERROR = 0x0002
+DONE_COUNT = 0x0010
+DONE_ATTN = 0x0020
+
+# Tokens with a USHORT length prefix that we skip (LOGINACK, TABNAME, COLINFO, SSPI, ...)
+_USHORT_SKIP = {0xAD, 0xA4, 0xA5, 0xED, ORDER}
+# Tokens with a ULONG length prefix (SESSIONSTATE, FEDAUTHINFO)
+_ULONG_SKIP = {0xE4, 0xEE}
+
+
+def _max_carry() -> int:
+    return int(os.getenv("S2C_SCAN_MAX_CARRY", "1048576"))
+
+
+def _max_bytes() -> int:
+    return int(os.getenv("S2C_SCAN_MAX_BYTES", "262144"))
+
+
+class TokenScanner:
+    """
+    Walk the tokens of one response message fed in arbitrary chunks.
+
+    Collected events (in wire order):
+      ("returnvalue", ordinal, name, value)
+      ("done", token, status, rowcount)
+      ("error", number, message)
+      ("returnstatus", value)
+      ("envchange", type, new_value)  # database and packet size changes only
+    """
+
+    def __init__(self, max_carry: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_carry = _max_carry() if max_carry is None else max_carry
+        self.max_bytes = _max_bytes() if max_bytes is None else max_bytes
+        self.events: List[tuple] = []
+        self.columns: Optional[List[TypeInfo]] = None
+        self.walked = 0
+        self.broken = False  # stopped walking; only the tail is searched at finish()
+        self._buf = b""
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self._tail = (self._tail + chunk)[-4096:]
+        if self.broken:
+            return
+        buf = self._buf + chunk if self._buf else chunk
+        try:
+            off = self._walk(buf)
+        except TdsParseError:
+            self._stop()
+            return
+        self._buf = buf[off:]
+        self.walked += off
+        if len(self._buf) > self.max_carry or self.walked > self.max_bytes:
+            self._stop()
+
+    def finish(self) -> List[tuple]:
+        """End of message: return the events, searching the tail if the walk was abandoned."""
+        if self.broken:
+            self.events.extend(scan_tail(self._tail))
+        return self.events
+
+    def _stop(self) -> None:
+        self.broken = True
+        self._buf = b""
+
+    def _walk(self, buf: bytes) -> int:
+        """Consume complete tokens; return the offset of the first incomplete one."""
+        off = 0
+        n = len(buf)
+        while off < n:
+            try:
+                end = self._token(buf, off)
+            except (TdsTruncated, IndexError, struct.error):
+                return off
+            off = end
+        return off
+
+    def _token(self, buf: bytes, off: int) -> int:
+        tok = buf[off]
+        p = off + 1
+        if tok == ROW:
+            if self.columns is None:
+                raise TdsParseError("ROW without COLMETADATA")
+            for ti in self.columns:
+                p = read_value_span(buf, p, ti, textptr=ti.type_id in TEXTPTR).end
+            return p
+        if tok == NBCROW:
+            if self.columns is None:
+                raise TdsParseError("NBCROW without COLMETADATA")
+            cols = self.columns
+            nb = (len(cols) + 7) // 8
+            if p + nb > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            bitmap = buf[p:p + nb]
+            p += nb
+            for i, ti in enumerate(cols):
+                if not bitmap[i >> 3] & (1 << (i & 7)):
+                    p = read_value_span(buf, p, ti, textptr=ti.type_id in TEXTPTR).end
+            return p
+        if tok in (DONE, DONEPROC, DONEINPROC):
+            if p + 12 > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            status, _cur, rows = struct.unpack_from("<HHQ", buf, p)
+            self.events.append(("done", tok, status, rows))
+            return p + 12
+        if tok == COLMETADATA:
+            return self._colmetadata(buf, p)
+        if tok == RETURNVALUE:
+            ev, p = parse_returnvalue(buf, p)
+            self.events.append(ev)
+            return p
+        if tok == RETURNSTATUS:
+            if p + 4 > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            self.events.append(("returnstatus", struct.unpack_from("<i", buf, p)[0]))
+            return p + 4
+        if tok in (ERROR, INFO):
+            if p + 2 > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            ln = buf[p] | (buf[p + 1] << 8)
+            if p + 2 + ln > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            if tok == ERROR:
+                number = struct.unpack_from("<i", buf, p + 2)[0]
+                msg, _ = read_us_varchar(buf, p + 2 + 6)
+                self.events.append(("error", number, msg))
+            return p + 2 + ln
+        if tok == ENVCHANGE:
+            if p + 2 > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            end = p + 2 + (buf[p] | (buf[p + 1] << 8))
+            if end > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            env = buf[p + 2]
+            if env in (ENV_DATABASE, ENV_PACKET_SIZE):
+                value, _ = read_b_varchar(buf, p + 3)
+                self.events.append(("envchange", env, value))
+            return end
+        if tok in _USHORT_SKIP:
+            if p + 2 > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            end = p + 2 + (buf[p] | (buf[p + 1] << 8))
+            if end > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            return end
+        if tok in _ULONG_SKIP:
+            if p + 4 > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            end = p + 4 + struct.unpack_from("<I", buf, p)[0]
+            if end > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            return end
+        if tok == FEATUREEXTACK:
+            # (FeatureId BYTE, FeatureAckDataLen DWORD, data)* terminated by 0xFF
+            while True:
+                if p >= len(buf):
+                    raise TdsTruncated("truncated TDS data")
+                if buf[p] == 0xFF:
+                    return p + 1
+                if p + 5 > len(buf):
+                    raise TdsTruncated("truncated TDS data")
+                p += 5 + struct.unpack_from("<I", buf, p + 1)[0]
+        if tok == OFFSET:
+            if p + 4 > len(buf):
+                raise TdsTruncated("truncated TDS data")
+            return p + 4
+        raise TdsParseError(f"unsupported token 0x{tok:02x}")
+
+    def _colmetadata(self, buf: bytes, p: int) -> int:
+        if p + 2 > len(buf):
+            raise TdsTruncated("truncated TDS data")
+        count = buf[p] | (buf[p + 1] << 8)
+        p += 2
+        cols: List[TypeInfo] = []
+        if count != 0xFFFF:
+            for _ in range(count):
+                p += 6  # UserType (ULONG) + Flags (USHORT)
+                ti, p = parse_type_info(buf, p, in_colmetadata=True)
+                _, p = read_b_varchar(buf, p)
+                cols.append(ti)
+        self.columns = cols
+        return p
+
+
+def parse_returnvalue(buf: bytes, p: int) -> Tuple[tuple, int]:
+    """Parse a RETURNVALUE token body at `p` (just past the 0xAC byte)."""
+    if p + 2 > len(buf):
+        raise TdsTruncated("truncated TDS data")
+    ordinal = buf[p] | (buf[p + 1] << 8)
+    name, p = read_b_varchar(buf, p + 2)
+    p += 1 + 6  # Status (BYTE) + UserType (ULONG) + Flags (USHORT)
+    ti, p = parse_type_info(buf, p)
+    span = read_value_span(buf, p, ti)
+    return ("returnvalue", ordinal, name, decode_value(buf, span, ti)), span.end
+
+
+def scan_tail(tail: bytes) -> List[tuple]:
+    """
+    Best-effort search of the last bytes of a message for trailing tokens.
+    Finds RETURNVALUE tokens that parse cleanly up to a following RETURNVALUE/DONE*
+    token, plus the final DONE/DONEPROC when the message ends with one.
+    """
+    events: List[tuple] = []
+    i = tail.find(b"\xac")
+    while i >= 0:
+        try:
+            ev, end = parse_returnvalue(tail, i + 1)
+            if end < len(tail) and tail[end] in (RETURNVALUE, DONE, DONEPROC, DONEINPROC):
+                events.append(ev)
+                i = tail.find(b"\xac", end)
+                continue
+        except (TdsParseError, IndexError, struct.error):
+            pass
+        i = tail.find(b"\xac", i + 1)
+    if len(tail) >= 13 and tail[-13] in (DONE, DONEPROC, DONEINPROC):
+        status, _cur, rows = struct.unpack_from("<HHQ", tail, len(tail) - 12)
+        events.append(("done", tail[-13], status, rows))
+    return events
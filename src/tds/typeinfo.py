@@ -0,0 +1,389 @@
+"""
+TYPE_INFO parsing for TDS 7.2+ (MS-TDS 2.2.5.6), shared by the RPC request parser.
+
+Only the metadata needed to locate a value on the wire is decoded (length class,
+max length, precision/scale, collation). Values are decoded best-effort into strings
+so the policy engine and normalizers can work with them.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import List, Optional, Tuple
+import datetime as dt
+import struct
+import uuid
+
+
+class TdsParseError(ValueError):
+    """Raised when a buffer does not contain the TDS structure we expected."""
+
+
+class TdsTruncated(TdsParseError):
+    """Raised when the structure continues past the end of the buffer (more data needed)."""
+
+
+# Fixed-length types: no length on the wire, value size given here
+FIXED_LEN = {
+    0x1F: 0,  # NULLTYPE
+    0x30: 1,  # INT1
+    0x32: 1,  # BIT
+    0x34: 2,  # INT2
+    0x38: 4,  # INT4
+    0x3A: 4,  # DATETIM4
+    0x3B: 4,  # FLT4
+    0x3C: 8,  # MONEY
+    0x3D: 8,  # DATETIME
+    0x3E: 8,  # FLT8
+    0x7A: 4,  # MONEY4
+    0x7F: 8,  # INT8
+}
+# Variable types with a 1-byte max length in TYPE_INFO and a 1-byte value length
+BYTELEN = {0x24, 0x26, 0x37, 0x3F, 0x68, 0x6A, 0x6C, 0x6D, 0x6E, 0x6F, 0x2F, 0x27, 0x2D, 0x25}
+# Date/time types: TYPE_INFO carries only a scale (or nothing for DATE); 1-byte value length
+SCALED = {0x29, 0x2A, 0x2B}
+DATE = 0x28
+# 2-byte max length (0xFFFF means PLP / MAX)
+USHORTLEN = {0xA5, 0xA7, 0xAD, 0xAF, 0xE7, 0xEF}
+# 4-byte max length
+LONGLEN = {0x22, 0x23, 0x62, 0x63}
+XML = 0xF1
+UDT = 0xF0
+
+COLLATED = {0xA7, 0xAF, 0xE7, 0xEF, 0x23, 0x63}
+# Character types; legacy CHAR/VARCHAR (0x2F/0x27) carry no collation
+CHARS = COLLATED | {0x2F, 0x27}
+UNICODE = {0xE7, 0xEF, 0x63}
+
+TYPE_NAMES = {
+    0x1F: "null", 0x30: "tinyint", 0x32: "bit", 0x34: "smallint", 0x38: "int",
+    0x3A: "smalldatetime", 0x3B: "real", 0x3C: "money", 0x3D: "datetime", 0x3E: "float",
+    0x7A: "smallmoney", 0x7F: "bigint", 0x24: "uniqueidentifier", 0x26: "int",
+    0x37: "decimal", 0x3F: "numeric", 0x68: "bit", 0x6A: "decimal", 0x6C: "numeric",
+    0x6D: "float", 0x6E: "money", 0x6F: "datetime", 0x2F: "char", 0x27: "varchar",
+    0x2D: "binary", 0x25: "varbinary", 0x28: "date", 0x29: "time", 0x2A: "datetime2",
+    0x2B: "datetimeoffset", 0xA5: "varbinary", 0xA7: "varchar", 0xAD: "binary",
+    0xAF: "char", 0xE7: "nvarchar", 0xEF: "nchar", 0x22: "image", 0x23: "text",
+    0x62: "sql_variant", 0x63: "ntext", 0xF1: "xml", 0xF0: "udt",
+}
+
+PLP_NULL = 0xFFFFFFFFFFFFFFFF
+PLP_UNKNOWN = 0xFFFFFFFFFFFFFFFE
+
+
+@dataclass
+class TypeInfo:
+    type_id: int
+    len_kind: str  # fixed|byte|ushort|long|plp
+    max_length: int = 0
+    precision: int = 0
+    scale: int = 0
+    collation: Optional[bytes] = None
+    raw: bytes = b""  # TYPE_INFO bytes exactly as seen on the wire
+
+    @property
+    def name(self) -> str:
+        n = TYPE_NAMES.get(self.type_id, f"0x{self.type_id:02x}")
+        if self.type_id in (0x26, 0x6D, 0x6E, 0x6F) and self.max_length:
+            # INTN/FLTN/MONEYN/DATETIMN resolve to a concrete SQL type by width
+            n = {
+                0x26: {1: "tinyint", 2: "smallint", 4: "int", 8: "bigint"},
+                0x6D: {4: "real", 8: "float"},
+                0x6E: {4: "smallmoney", 8: "money"},
+                0x6F: {4: "smalldatetime", 8: "datetime"},
+            }[self.type_id].get(self.max_length, n)
+        return n
+
+    @property
+    def is_text(self) -> bool:
+        return self.type_id in CHARS
+
+    @property
+    def is_unicode(self) -> bool:
+        return self.type_id in UNICODE
+
+
+@dataclass
+class ValueSpan:
+    len_offset: int  # where the length prefix starts (== data_offset for fixed types)
+    len_size: int  # bytes of length prefix (0 for fixed, 8 for PLP total length)
+    data_offset: int
+    data_length: int  # -1 for NULL
+    end: int  # offset right after the value
+    chunks: List[Tuple[int, int]] = field(default_factory=list)  # PLP (offset, length) pairs
+
+    @property
+    def is_null(self) -> bool:
+        return self.data_length < 0
+
+
+def _need(buf, off: int, n: int) -> None:
+    if off + n > len(buf):
+        raise TdsTruncated("truncated TDS data")
+
+
+def read_b_varchar(buf, off: int) -> Tuple[str, int]:
+    end = off + 1 + buf[off] * 2
+    if end > len(buf):
+        raise TdsTruncated("truncated TDS data")
+    return buf[off + 1:end].decode("utf-16le", errors="replace"), end
+
+
+def read_us_varchar(buf, off: int) -> Tuple[str, int]:
+    _need(buf, off, 2)
+    end = off + 2 + (buf[off] | (buf[off + 1] << 8)) * 2
+    if end > len(buf):
+        raise TdsTruncated("truncated TDS data")
+    return buf[off + 2:end].decode("utf-16le", errors="replace"), end
+
+
+def _type_info_size(buf, off: int, in_colmetadata: bool) -> int:
+    """Size of the TYPE_INFO at `off` for the simple (cacheable) types, or 0 otherwise."""
+    t = buf[off]
+    if t in FIXED_LEN or t == DATE:
+        return 1
+    if t in BYTELEN:
+        if t in (0x37, 0x3F, 0x6A, 0x6C):
+            return 4
+        return 2
+    if t in SCALED:
+        return 2
+    if t in USHORTLEN:
+        return 8 if t in COLLATED else 3
+    if t in LONGLEN and (not in_colmetadata or t == 0x62):
+        return 10 if t in COLLATED else 5
+    return 0
+
+
+# TYPE_INFO objects are immutable once parsed; identical wire bytes share one instance
+_TI_CACHE: dict = {}
+
+
+def parse_type_info(buf, off: int, in_colmetadata: bool = False) -> Tuple[TypeInfo, int]:
+    """Parse a TYPE_INFO at `off`. Returns (TypeInfo, offset after TYPE_INFO)."""
+    _need(buf, off, 1)
+    n = _type_info_size(buf, off, in_colmetadata)
+    if n:
+        _need(buf, off, n)
+        raw = bytes(buf[off:off + n])
+        ti = _TI_CACHE.get(raw)
+        if ti is None:
+            ti, _ = _parse_type_info(buf, off, in_colmetadata)
+            if len(_TI_CACHE) < 4096:
+                _TI_CACHE[raw] = ti
+        return ti, off + n
+    return _parse_type_info(buf, off, in_colmetadata)
+
+
+def _parse_type_info(buf, off: int, in_colmetadata: bool) -> Tuple[TypeInfo, int]:
+    start = off
+    _need(buf, off, 1)
+    t = buf[off]
+    off += 1
+    if t in FIXED_LEN:
+        ti = TypeInfo(t, "fixed", FIXED_LEN[t])
+    elif t in BYTELEN:
+        _need(buf, off, 1)
+        ti = TypeInfo(t, "byte", buf[off])
+        off += 1
+        if t in (0x37, 0x3F, 0x6A, 0x6C):
+            _need(buf, off, 2)
+            ti.precision, ti.scale = buf[off], buf[off + 1]
+            off += 2
+    elif t in SCALED:
+        _need(buf, off, 1)
+        ti = TypeInfo(t, "byte", 0, scale=buf[off])
+        off += 1
+    elif t == DATE:
+        ti = TypeInfo(t, "byte", 3)
+    elif t in USHORTLEN:
+        _need(buf, off, 2)
+        mx = buf[off] | (buf[off + 1] << 8)
+        off += 2
+        ti = TypeInfo(t, "plp" if mx == 0xFFFF else "ushort", mx)
+        if t in COLLATED:
+            _need(buf, off, 5)
+            ti.collation = bytes(buf[off:off + 5])
+            off += 5
+    elif t in LONGLEN:
+        _need(buf, off, 4)
+        ti = TypeInfo(t, "long", struct.unpack_from("<I", buf, off)[0])
+        off += 4
+        if t in COLLATED:
+            _need(buf, off, 5)
+            ti.collation = bytes(buf[off:off + 5])
+            off += 5
+        if in_colmetadata and t != 0x62:
+            # text/ntext/image columns carry a multi-part table name
+            _need(buf, off, 1)
+            parts = buf[off]
+            off += 1
+            for _ in range(parts):
+                _, off = read_us_varchar(buf, off)
+    elif t == XML:
+        _need(buf, off, 1)
+        schema_present = buf[off]
+        off += 1
+        if schema_present:
+            _, off = read_b_varchar(buf, off)
+            _, off = read_b_varchar(buf, off)
+            _, off = read_us_varchar(buf, off)
+        ti = TypeInfo(t, "plp", 0xFFFF)
+    else:
+        raise TdsParseError(f"unsupported TYPE_INFO 0x{t:02x}")
+    ti.raw = bytes(buf[start:off])
+    return ti, off
+
+
+def read_value_span(buf, off: int, ti: TypeInfo, textptr: bool = False) -> ValueSpan:
+    """
+    Locate the value for `ti` at `off` without copying it.
+    `textptr` is set for ROW tokens, where text/ntext/image values carry a text pointer.
+    """
+    k = ti.len_kind
+    n_buf = len(buf)
+    if k == "ushort":
+        if off + 2 > n_buf:
+            raise TdsTruncated("truncated TDS data")
+        n = buf[off] | (buf[off + 1] << 8)
+        if n == 0xFFFF:
+            return ValueSpan(off, 2, off + 2, -1, off + 2)
+        if off + 2 + n > n_buf:
+            raise TdsTruncated("truncated TDS data")
+        return ValueSpan(off, 2, off + 2, n, off + 2 + n)
+    if k == "byte":
+        if off >= n_buf:
+            raise TdsTruncated("truncated TDS data")
+        n = buf[off]
+        legacy = ti.type_id in (0x2F, 0x27, 0x2D, 0x25)
+        # Legacy CHAR/VARCHAR/BINARY use 0xFF as NULL; BYTELEN numerics use 0
+        if (n == 0 and not legacy) or (n == 0xFF and legacy):
+            return ValueSpan(off, 1, off + 1, -1, off + 1)
+        if off + 1 + n > n_buf:
+            raise TdsTruncated("truncated TDS data")
+        return ValueSpan(off, 1, off + 1, n, off + 1 + n)
+    if k == "fixed":
+        _need(buf, off, ti.max_length)
+        return ValueSpan(off, 0, off, ti.max_length if ti.type_id != 0x1F else -1, off + ti.max_length)
+    if k == "long":
+        start = off
+        if textptr:
+            _need(buf, off, 1)
+            tp = buf[off]
+            off += 1
+            if tp == 0:
+                return ValueSpan(start, 1, off, -1, off)
+            _need(buf, off, tp + 8)
+            off += tp + 8  # text pointer + timestamp
+        _need(buf, off, 4)
+        n = struct.unpack_from("<I", buf, off)[0]
+        if n == 0xFFFFFFFF and not textptr:
+            return ValueSpan(off, 4, off + 4, -1, off + 4)
+        _need(buf, off + 4, n)
+        return ValueSpan(off, 4, off + 4, n, off + 4 + n)
+    if k == "plp":
+        _need(buf, off, 8)
+        total = struct.unpack_from("<Q", buf, off)[0]
+        if total == PLP_NULL:
+            return ValueSpan(off, 8, off + 8, -1, off + 8)
+        p = off + 8
+        chunks: List[Tuple[int, int]] = []
+        size = 0
+        while True:
+            _need(buf, p, 4)
+            cl = struct.unpack_from("<I", buf, p)[0]
+            p += 4
+            if cl == 0:
+                break
+            _need(buf, p, cl)
+            chunks.append((p, cl))
+            size += cl
+            p += cl
+        first = chunks[0][0] if chunks else p
+        return ValueSpan(off, 8, first, size, p, chunks)
+    raise TdsParseError(f"unknown length class {k}")
+
+
+def value_bytes(buf, span: ValueSpan) -> Optional[bytes]:
+    if span.is_null:
+        return None
+    if span.chunks:
+        return b"".join(bytes(buf[o:o + n]) for o, n in span.chunks)
+    return bytes(buf[span.data_offset:span.data_offset + span.data_length])
+
+
+_BASE_DATE = dt.date(1, 1, 1)
+_BASE_1900 = dt.datetime(1900, 1, 1)
+
+
+def _time_from_ticks(raw: bytes, scale: int) -> dt.time:
+    ticks = int.from_bytes(raw, "little")
+    us = ticks * 1_000_000 // (10 ** scale)
+    secs, us = divmod(us, 1_000_000)
+    hh, rem = divmod(secs, 3600)
+    mm, ss = divmod(rem, 60)
+    return dt.time(hh % 24, mm, ss, us)
+
+
+def decode_value(buf, span: ValueSpan, ti: TypeInfo) -> Optional[str]:
+    """Best-effort decode of a value into its textual form. Returns None for NULL."""
+    if span.data_length < 0:
+        return None
+    t = ti.type_id
+    if t in UNICODE and not span.chunks:
+        return bytes(buf[span.data_offset:span.data_offset + span.data_length]).decode("utf-16le", errors="replace")
+    raw = value_bytes(buf, span)
+    try:
+        if t in UNICODE or t == XML:
+            return raw.decode("utf-16le", errors="replace")
+        if t in CHARS:
+            return raw.decode("cp1252", errors="replace")
+        if t in (0x30, 0x34, 0x38, 0x7F, 0x26):
+            return str(int.from_bytes(raw, "little", signed=len(raw) > 1))
+        if t in (0x32, 0x68):
+            return "1" if raw and raw[0] else "0"
+        if t in (0x3B, 0x3E, 0x6D):
+            return repr(struct.unpack("<f" if len(raw) == 4 else "<d", raw)[0])
+        if t in (0x3C, 0x7A, 0x6E):
+            if len(raw) == 8:
+                v = (struct.unpack_from("<i", raw, 0)[0] << 32) | struct.unpack_from("<I", raw, 4)[0]
+            else:
+                v = struct.unpack("<i", raw)[0]
+            return str(Decimal(v).scaleb(-4))
+        if t in (0x37, 0x3F, 0x6A, 0x6C):
+            v = int.from_bytes(raw[1:], "little")
+            d = Decimal(v).scaleb(-ti.scale)
+            return str(d if raw[0] == 1 else -d)
+        if t == 0x24:
+            return str(uuid.UUID(bytes_le=raw))
+        if t == DATE:
+            return (_BASE_DATE + dt.timedelta(days=int.from_bytes(raw, "little"))).isoformat()
+        if t == 0x29:
+            return _time_from_ticks(raw, ti.scale).isoformat()
+        if t in (0x2A, 0x2B):
+            tl = len(raw) - 3 - (2 if t == 0x2B else 0)
+            tm = _time_from_ticks(raw[:tl], ti.scale)
+            d = _BASE_DATE + dt.timedelta(days=int.from_bytes(raw[tl:tl + 3], "little"))
+            v = dt.datetime.combine(d, tm)
+            if t == 0x2B:
+                off = struct.unpack_from("<h", raw, tl + 3)[0]
+                v = (v + dt.timedelta(minutes=off)).replace(tzinfo=dt.timezone(dt.timedelta(minutes=off)))
+            return v.isoformat()
+        if t in (0x3D, 0x3A, 0x6F):
+            if len(raw) == 8:
+                days, ticks = struct.unpack("<iI", raw)
+                v = _BASE_1900 + dt.timedelta(days=days, milliseconds=ticks * 10 / 3)
+            else:
+                days, mins = struct.unpack("<HH", raw)
+                v = _BASE_1900 + dt.timedelta(days=days, minutes=mins)
+            return v.isoformat()
+        return raw.hex()
+    except Exception:
+        return None
+
+
+def encode_text_value(ti: TypeInfo, value: str) -> Optional[bytes]:
+    """Encode a replacement value for character types; None for types we do not rewrite."""
+    if ti.type_id in UNICODE:
+        return value.encode("utf-16le", errors="ignore")
+    if ti.type_id in CHARS:
+        return value.encode("cp1252", errors="replace")
+    return None
@@ -1,8 +1,64 @@
+import asyncio
+import importlib
 import sys
 from pathlib import Path
 
+import pytest
+
 # Ensure project root is on sys.path for `import src` in tests
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+
+
+class _Writer:
+    """StreamWriter stand-in that keeps what the proxy forwards."""
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, b):
+        self.data += b
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+@pytest.fixture
+def pipe_c2s():
+    """`await pipe_c2s(stream)`: run client bytes through the proxy's c2s pipe, return what it forwards."""
+
+    async def run(stream: bytes, counter=None, conn_id: str = "conn-test") -> bytes:
+        from src.proxy.tds_proxy import _pipe
+        reader = asyncio.StreamReader()
+        reader.feed_data(stream)
+        reader.feed_eof()
+        writer = _Writer()
+        await _pipe(reader, writer, "c2s", conn_id, {} if counter is None else counter)
+        return writer.data
+
+    return run
+
+
+@pytest.fixture
+def load_decisions(tmp_path, monkeypatch):
+    """`load_decisions(**env)`: chdir to tmp_path, set env and reload src.metrics.decisions (it reads DECISIONS_PATH at import)."""
+
+    def load(**env):
+        from src.metrics import rollups
+        monkeypatch.chdir(tmp_path)
+        for k, v in env.items():
+            monkeypatch.setenv(k, v)
+        dec = importlib.import_module("src.metrics.decisions")
+        importlib.reload(dec)
+        rollups.reset()
+        return dec
+
+    return load
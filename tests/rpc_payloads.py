@@ -0,0 +1,32 @@
+"""RPC request payload builders shared by the RPC tests."""
+import struct
+
+COLLATION = b"\x09\x04\xd0\x00\x34"
+
+
+def b_varchar(s: str) -> bytes:
+    return bytes([len(s)]) + s.encode("utf-16le")
+
+
+def nvarchar_param(name: str, value, max_len: int = 8000) -> bytes:
+    out = b_varchar(name) + b"\x00" + b"\xe7" + struct.pack("<H", max_len) + COLLATION
+    if value is None:
+        return out + b"\xff\xff"
+    data = value.encode("utf-16le")
+    return out + struct.pack("<H", len(data)) + data
+
+
+def int_param(name: str, value, status: int = 0) -> bytes:
+    out = b_varchar(name) + bytes([status]) + b"\x26\x04"
+    if value is None:
+        return out + b"\x00"
+    return out + b"\x04" + struct.pack("<i", value)
+
+
+def rpc(proc_id: int, *params: bytes) -> bytes:
+    """An RPC addressed by procedure id (sp_executesql = 10, sp_execute = 12, ...)."""
+    return b"\xff\xff" + struct.pack("<H", proc_id) + b"\x00\x00" + b"".join(params)
+
+
+def executesql(stmt: str, decl: str, *params) -> bytes:
+    return rpc(10, nvarchar_param("", stmt), nvarchar_param("", decl), *(nvarchar_param(name, value, max_len=200) for name, value in params))
@@ -11,4 +11,4 @@ def test_metrics_prom_fallback(monkeypatch):
     importlib.reload(api)
     resp = api.metrics_prom()
     body = resp.body.decode('utf-8') if hasattr(resp, 'body') else str(resp)
-    assert '# TYPE sqlumai_metric counter' in body
+    assert '# TYPE sqlumai_events_total counter' in body
@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+from src.proxy import breaker as breaker_mod
+from src.proxy.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def test_trips_on_error_rate_and_recovers_after_probes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("BREAKER_MIN_SAMPLES", "20")
+    monkeypatch.setenv("BREAKER_PROBES", "3")
+    monkeypatch.setenv("BREAKER_COOLDOWN_SECONDS", "0")
+    b = CircuitBreaker()
+    for i in range(40):
+        b.record(i % 2 == 0, 1.0)
+    assert b.state == OPEN and "error rate" in b.reason
+    assert b.allow() and b.state == HALF_OPEN  # cool-down elapsed: probe
+    monkeypatch.setenv("BREAKER_COOLDOWN_SECONDS", "60")
+    assert b.allow() and b.allow() and not b.allow()  # three probes in flight
+    for _ in range(3):
+        b.record(False, 1.0)
+    assert b.state == CLOSED and b.transitions == 3
+
+
+def test_trips_on_latency_and_probe_failure_reopens(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("BREAKER_MIN_SAMPLES", "20")
+    monkeypatch.setenv("BREAKER_LATENCY_P99_MS", "50")
+    monkeypatch.setenv("BREAKER_COOLDOWN_SECONDS", "60")
+    b = CircuitBreaker()
+    for i in range(30):
+        b.record(False, 500.0 if i % 10 == 0 else 1.0)
+    assert b.state == OPEN and "p99" in b.reason
+    assert not b.allow() and b.snapshot()["skipped"] == 1
+    monkeypatch.setenv("BREAKER_COOLDOWN_SECONDS", "0")
+    assert b.allow()
+    b.record(True, 1.0)
+    assert b.state == OPEN and "probing" in b.reason
+
+
+def test_open_breaker_forwards_without_inspection(tmp_path, monkeypatch):
+    from src.proxy.tds_proxy import _pipe
+    from src.tds.parser import build_packets
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "rules.json").write_text('[{"id": "nodrop", "target": "pattern", "selector": "DROP TABLE", "action": "block"}]', encoding="utf-8")
+    monkeypatch.setenv("RULES_PATH", str(tmp_path / "rules.json"))
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.setenv("ENFORCEMENT_MODE", "enforce")
+    monkeypatch.setenv("BREAKER_COOLDOWN_SECONDS", "60")
+    stream = build_packets(0x01, "DROP TABLE dbo.T".encode("utf-16le"))
+
+    class W:
+        data = b""
+
+        def write(self, b):
+            self.data += b
+
+        async def drain(self):
+            pass
+
+        def close(self):
+            pass
+
+        async def wait_closed(self):
+            pass
+
+    def run():
+        async def go():
+            reader = asyncio.StreamReader()
+            reader.feed_data(stream)
+            reader.feed_eof()
+            w = W()
+            await _pipe(reader, w, "c2s", "conn-brk", {})
+            return w.data
+        return asyncio.run(go())
+
+    try:
+        assert run() == b""  # inspected and blocked
+        breaker_mod.breaker._trip("test")
+        assert run() == stream  # degraded: forwarded as is
+        from src import api
+        assert api.healthz()["inspection"]["state"] == OPEN
+    finally:
+        breaker_mod.breaker.reset()
+
+
+def test_latency_excludes_time_spent_in_other_connections(tmp_path, monkeypatch):
+    from src.proxy.tds_proxy import _inspect_guarded
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("BREAKER_MIN_SAMPLES", "5")
+    monkeypatch.setenv("BREAKER_LATENCY_P99_MS", "20")
+    monkeypatch.setenv("BREAKER_LOOP_LAG_MS", "100000")
+
+    def steps():
+        for _ in range(3):
+            yield
+        return b"out"
+
+    held = [0.0]
+    real_clock = time.perf_counter
+    monkeypatch.setattr(time, "perf_counter", lambda: real_clock() + held[0])
+
+    async def slow_neighbour():
+        for _ in range(10):
+            held[0] += 0.03  # the clock moves on as if it held the loop while the inspections are suspended
+            await asyncio.sleep(0)
+
+    async def go():
+        return await asyncio.gather(*(_inspect_guarded("conn-y", b"in", steps()) for _ in range(10)), slow_neighbour())
+
+    breaker_mod.breaker.reset()
+    try:
+        assert asyncio.run(go())[:10] == [b"out"] * 10
+        assert breaker_mod.breaker.state == CLOSED
+    finally:
+        breaker_mod.breaker.reset()
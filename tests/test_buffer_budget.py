@@ -0,0 +1,123 @@
+import asyncio
+import os
+
+import pytest
+
+from src.proxy import buffers
+from src.tds.parser import build_packets
+
+SMALL = build_packets(0x01, "SELECT 2".encode("utf-16le"))
+
+
+class _Source:
+    """Reader that generates a long client stream on the fly (nothing is pre-buffered)."""
+
+    def __init__(self, parts, sample_rss: bool = False):
+        self._parts = iter(parts)
+        self._eof = False
+        self.sample_rss = sample_rss
+        self.peak_rss = 0
+
+    def at_eof(self):
+        return self._eof
+
+    async def read(self, n):
+        await asyncio.sleep(0)
+        if self.sample_rss:
+            self.peak_rss = max(self.peak_rss, _rss())
+        try:
+            return next(self._parts)
+        except StopIteration:
+            self._eof = True
+            return b""
+
+
+class _Sink:
+    def __init__(self):
+        self.count = 0
+        self.head = b""
+        self.peak_held = 0
+
+    def write(self, b):
+        if len(self.head) < 64:
+            self.head += b[:64]
+        self.count += len(b)
+        self.peak_held = max(self.peak_held, buffers.held("conn-soak"))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def _huge_batch(total: int, packet_size: int = 32768):
+    """Packets of one SQL Batch of about `total` payload bytes, then a small batch."""
+    body = ("SELECT 1 " * (packet_size // 18 + 1)).encode("utf-16le")[: packet_size - 8]
+    sent = 0
+    while True:
+        sent += len(body)
+        last = sent >= total
+        yield bytes([0x01, 0x01 if last else 0x00]) + packet_size.to_bytes(2, "big") + b"\x00\x00\x01\x00" + body
+        if last:
+            break
+    yield SMALL
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _run(parts, counter, sample_rss: bool = False):
+    from src.proxy.tds_proxy import _pipe
+    sink = _Sink()
+    source = _Source(parts, sample_rss)
+    asyncio.run(_pipe(source, sink, "c2s", "conn-soak", counter))
+    sink.peak_rss = source.peak_rss
+    return sink
+
+
+def test_small_batches_are_held_and_released(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    batch = build_packets(0x01, ("SELECT 1 " * 2000).encode("utf-16le"), packet_size=4096)
+    sink = _run([batch], {})
+    assert sink.count == len(batch) and sink.peak_held == 0
+    assert buffers.held("conn-soak") == 0 and "conn-soak" not in buffers.snapshot()["connections"]
+    from src import api
+    assert api.proxy_buffers()["connection_limit"] == 8 << 20
+
+
+def test_overflow_policy_passthrough_and_block(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.setenv("REASSEMBLY_MAX_BYTES", "65536")
+    counter: dict = {}
+    sink = _run(_huge_batch(1 << 20), counter)
+    # Whole stream forwarded unchanged, both batches expect a response
+    assert sink.count == sum(map(len, _huge_batch(1 << 20)))
+    assert [e["typ"] for e in counter["_inflight"]] == [0x01, 0x01]
+    assert counter["_inflight"][0]["stmt"] is None and counter["_inflight"][1]["stmt"] is not None
+    monkeypatch.setenv("REASSEMBLY_OVERFLOW", "block")
+    counter = {}
+    sink = _run(_huge_batch(1 << 20), counter)
+    assert sink.count == len(SMALL)
+    assert len(counter["_inflight"]) == 1
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc for RSS")
+def test_soak_huge_batches_keep_rss_flat(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.setenv("REASSEMBLY_MAX_BYTES", str(1 << 20))
+    total = int(os.getenv("SOAK_BATCH_MB", "128")) << 20
+    _run(_huge_batch(8 << 20), {})  # warm up allocator and imports
+    before = _rss()
+    sink = _run(_huge_batch(total), {}, sample_rss=True)
+    growth = sink.peak_rss - before
+    assert sink.count >= total and sink.peak_held <= 1 << 20
+    assert growth < 32 << 20, f"RSS grew by {growth >> 20} MiB while streaming {total >> 20} MiB"
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import struct
+
+from src.tds.bulk import BulkLoadDecoder
+from src.tds.parser import build_packets
+
+COLLATION = b"\x09\x04\xd0\x00\x34"
+
+
+def colmetadata() -> bytes:
+    def col(name: str, type_info: bytes) -> bytes:
+        return b"\x00" * 6 + type_info + bytes([len(name)]) + name.encode("utf-16le")
+    return b"\x81" + struct.pack("<H", 3) + col("Id", b"\x38") + col("Email", b"\xe7\xc8\x00" + COLLATION) + col("Age", b"\x26\x04")
+
+
+def row(id_: int, email, age) -> bytes:
+    if email is None or age is None:
+        bitmap = (2 if email is None else 0) | (4 if age is None else 0)
+        out = b"\xd2" + bytes([bitmap]) + struct.pack("<i", id_)
+    else:
+        out = b"\xd1" + struct.pack("<i", id_)
+    if email is not None:
+        data = email.encode("utf-16le")
+        out += struct.pack("<H", len(data)) + data
+    if age is not None:
+        out += b"\x04" + struct.pack("<i", age)
+    return out
+
+
+def bulk_message(rows) -> bytes:
+    return colmetadata() + b"".join(row(*r) for r in rows) + b"\xfd" + b"\x00" * 12
+
+
+ROWS = [(1, " Someone@Example.COM ", 30), (2, None, 41), (3, "x@example.com", None)]
+
+
+def test_decoder_streams_selected_column_vectors():
+    msg = bulk_message(ROWS)
+    seen = {}
+    dec = BulkLoadDecoder(lambda cols: [i for i, (name, _) in enumerate(cols) if name == "Email"])
+    for b in range(len(msg)):  # byte-at-a-time: rows always span chunks
+        dec.feed(msg[b:b + 1])
+        for idx, values in dec.take().items():
+            seen.setdefault(idx, []).extend(values)
+    assert [c[0] for c in dec.columns] == ["Id", "Email", "Age"]
+    assert dec.complete and dec.rows == 3
+    assert seen == {1: [" Someone@Example.COM ", None, "x@example.com"]}
+
+
+def test_decoder_reads_sql_variant_columns():
+    meta = b"\x81" + struct.pack("<H", 2) + b"\x00" * 6 + b"\x62" + struct.pack("<I", 8016) + b"\x01" + "V".encode("utf-16le")
+    meta += b"\x00" * 6 + b"\xe7\xc8\x00" + COLLATION + b"\x05" + "Email".encode("utf-16le")
+    data = "a@b.se".encode("utf-16le")
+    variant = struct.pack("<I", 6) + b"\x38\x00" + struct.pack("<i", 7)  # no text pointer
+    msg = meta + (b"\xd1" + variant + struct.pack("<H", len(data)) + data) * 2 + b"\xfd" + b"\x00" * 12
+    dec = BulkLoadDecoder(lambda cols: [1])
+    dec.feed(msg)
+    assert dec.complete and dec.rows == 2 and dec.take() == {1: ["a@b.se", "a@b.se"]}
+
+
+def test_decoder_stops_walking_without_selected_columns():
+    dec = BulkLoadDecoder(lambda cols: [])
+    msg = bulk_message(ROWS)
+    dec.feed(msg[:40])
+    dec.feed(msg[40:])
+    assert dec.skipping and not dec.complete and dec.take() == {}
+    bad = BulkLoadDecoder(lambda cols: [1])
+    bad.feed(b"\x42" + msg)
+    assert bad.broken
+
+
+def test_proxy_reports_bulk_column_counts(tmp_path, monkeypatch, pipe_c2s):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "rules.json").write_text('[{"id": "email-norm", "target": "column", "selector": "dbo.Users.Email", "action": "autocorrect"}]', encoding="utf-8")
+    monkeypatch.setenv("RULES_PATH", str(tmp_path / "rules.json"))
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.setenv("ENFORCEMENT_MODE", "enforce")
+    stream = build_packets(0x01, "insert bulk dbo.Users ([Id] Int, [Email] NVarChar(100), [Age] Int)".encode("utf-16le"))
+    stream += build_packets(0x07, bulk_message(ROWS * 50), packet_size=512)
+    counter: dict = {}
+    assert asyncio.run(pipe_c2s(stream, counter)) == stream  # bulk rows are observed, never rewritten
+    lines = (tmp_path / "data/metrics/decisions.jsonl").read_text(encoding="utf-8").splitlines()
+    rec = [json.loads(x) for x in lines if '"bulk"' in x][-1]
+    assert rec["column"] == "dbo.Users.Email" and rec["rule_id"] == "email-norm"
+    assert (rec["rows"], rec["values"], rec["nulls"], rec["autocorrect_suggested"]) == (150, 100, 50, 50)
+    metrics = json.loads((tmp_path / "data/metrics/metrics.json").read_text(encoding="utf-8"))
+    assert metrics["bulk_loads"] == 1 and metrics["bulk_rows"] == 150
+    assert [e["typ"] for e in counter["_inflight"]] == [0x01, 0x07]
+    assert counter["_inflight"][1]["stmt"][1] == "BULK LOAD dbo.Users"
+
+
+def test_decoder_stops_past_byte_budget():
+    msg = bulk_message(ROWS * 100)
+    dec = BulkLoadDecoder(lambda cols: [1], max_bytes=1000)
+    for off in range(0, len(msg), 512):
+        dec.feed(msg[off:off + 512])
+    assert dec.truncated and not dec.complete
+    assert 0 < dec.rows < 300 and len(dec.take()[1]) == dec.rows
@@ -0,0 +1,78 @@
+import asyncio
+import importlib
+import struct
+
+from src.proxy import connections
+from src.tds.parser import build_packets
+
+
+def _done() -> bytes:
+    return build_packets(0x04, b"\xfd" + struct.pack("<HHQ", 0x10, 0xC1, 1))
+
+
+def test_registry_tracks_live_connection(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "rules.json").write_text('[{"id": "email", "target": "column", "selector": "dbo.Users.Email", "action": "autocorrect"}]', encoding="utf-8")
+    monkeypatch.setenv("RULES_PATH", str(tmp_path / "rules.json"))
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.setenv("ENFORCEMENT_MODE", "enforce")
+    from src.proxy.tds_proxy import handle_client
+    batches = [
+        "INSERT INTO dbo.Users (Email) VALUES (' Someone@Example.COM ')",
+        "SELECT 1",
+    ]
+
+    async def upstream(reader, writer):
+        for _ in batches:
+            hdr = await reader.readexactly(8)
+            await reader.readexactly(struct.unpack(">H", hdr[2:4])[0] - 8)
+            writer.write(_done())
+            await writer.drain()
+        await reader.read()
+        writer.close()
+
+    async def go():
+        up = await asyncio.start_server(upstream, "127.0.0.1", 0)
+        up_port = up.sockets[0].getsockname()[1]
+        proxy = await asyncio.start_server(lambda r, w: handle_client(r, w, "127.0.0.1", up_port, connections.next_id()), "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", proxy.sockets[0].getsockname()[1])
+        for sql in batches:
+            writer.write(build_packets(0x01, sql.encode("utf-16le")))
+            await writer.drain()
+            await reader.readexactly(len(_done()))
+        live = connections.snapshot()
+        writer.close()
+        await writer.wait_closed()
+        for _ in range(100):
+            if not connections.count():
+                break
+            await asyncio.sleep(0.01)
+        proxy.close()
+        up.close()
+        return live
+
+    live = asyncio.run(go())
+    assert live["count"] == 1 and "loop_lag" in live
+    row = live["connections"][0]
+    assert row["id"].startswith("conn-") and row["peer"].startswith("127.0.0.1:")
+    assert (row["c2s_packets"], row["s2c_packets"], row["messages"], row["rewrites"]) == (2, 2, 2, 1)
+    assert row["decisions"] >= 3 and row["inspect_ms"] > 0 and row["buffered_bytes"] == 0
+    assert row["s2c_bytes"] == 2 * len(_done())
+    assert connections.count() == 0
+
+
+def test_ids_are_sequential_and_api_sorts(monkeypatch):
+    a, b = connections.next_id(), connections.next_id()
+    assert int(b.split("-")[1]) == int(a.split("-")[1]) + 1
+    cheap, costly = {"c2s": 10}, {"c2s": 5}
+    connections.register(a, ("10.0.0.1", 5000), cheap)
+    connections.register(b, ("10.0.0.2", 5001), costly)
+    costly["_stats"]["inspect_ms"] = 12.5
+    try:
+        api = importlib.import_module("src.api")
+        out = api.list_connections()
+        assert [r["id"] for r in out["connections"]] == [b, a]
+        assert [r["id"] for r in api.list_connections(sort="c2s_bytes", limit=1)["connections"]] == [a]
+    finally:
+        connections.unregister(a)
+        connections.unregister(b)
@@ -0,0 +1,67 @@
+import asyncio
+
+from src.tds.parser import build_packets
+
+
+def _multirow_insert(rows: int) -> bytes:
+    values = ", ".join(f"('user{i}@Example.COM ', {i})" for i in range(rows))
+    return build_packets(0x01, f"INSERT INTO dbo.Users (Email, Age) VALUES {values}".encode("utf-16le"))
+
+
+def _ticks_during_inspection(pipe_c2s, stream: bytes) -> tuple:
+    """Run one c2s pipe next to a ticker task; count how often the ticker got the loop."""
+
+    async def go():
+        done = False
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while not done:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        t = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        start = ticks
+        out = await pipe_c2s(stream, conn_id="conn-coop")
+        done = True
+        await t
+        return ticks - start, out
+
+    return asyncio.run(go())
+
+
+def test_multirow_insert_inspection_yields_to_other_tasks(tmp_path, monkeypatch, pipe_c2s):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "rules.json").write_text('[{"id": "email", "target": "column", "selector": "dbo.Users.Email", "action": "autocorrect"}]', encoding="utf-8")
+    monkeypatch.setenv("RULES_PATH", str(tmp_path / "rules.json"))
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.setenv("ENFORCEMENT_MODE", "enforce")
+    stream = _multirow_insert(300)
+    monkeypatch.setenv("INSPECT_SLICE_MS", "100000")
+    ticks_one_stretch, out_one = _ticks_during_inspection(pipe_c2s, stream)
+    monkeypatch.setenv("INSPECT_SLICE_MS", "0")
+    ticks_sliced, out_sliced = _ticks_during_inspection(pipe_c2s, stream)
+    assert out_sliced == out_one and "user1@example.com".encode("utf-16le") in out_one
+    assert ticks_sliced >= ticks_one_stretch + 100
+
+
+def test_loop_lag_monitor_records_blocked_loop(monkeypatch):
+    from src.runtime import loop_lag
+    monkeypatch.setenv("LOOP_LAG_INTERVAL_MS", "5")
+
+    async def go():
+        loop = asyncio.get_running_loop()
+        real_time = loop.time
+        stop = asyncio.Event()
+        mon = asyncio.create_task(loop_lag.run_loop_lag_monitor(stop))
+        await asyncio.sleep(0.02)
+        loop.time = lambda: real_time() + 0.06  # the loop clock moves on as if a callback held it 60 ms
+        await asyncio.sleep(0.02)
+        stop.set()
+        await mon
+
+    asyncio.run(go())
+    snap = loop_lag.snapshot()
+    assert snap["samples"] >= 2 and snap["max_ms"] >= 40
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+
+from src.metrics import aggregate, rollups
+
+
+def _fix(spid, after="0701234567", **extra):
+    return {"spid": spid, "action": "autocorrect", "rule_id": "phone", "reason": "normalize", "column": "dbo.Users.Phone", "before": "070-123 45 67", "after": after, **extra}
+
+
+def test_repeated_autocorrects_collapse_with_exact_counts(load_decisions):
+    dec = load_decisions(DECISIONS_SEGMENTS="false", DECISIONS_AGGREGATE_WINDOW_SECONDS="60")
+    try:
+        for spid in range(5):
+            dec.append(_fix(spid))
+        dec.append(_fix(9, after="+46701234567"))
+        dec.append({"spid": 1, "action": "block", "rule_id": "no_delete", "sample": "DELETE FROM t"})
+        dec.append(_fix(7, weight=4))
+        dec.append(_fix(8, weight=4))
+        # only the block is written; the rest waits for its window
+        assert [d["action"] for d in dec.tail(10)] == ["block"] and aggregate.pending() == 3
+        assert aggregate.flush_expired(datetime.now(timezone.utc)) == 0
+        assert aggregate.flush_expired(datetime.now(timezone.utc) + timedelta(seconds=61)) == 3
+    finally:
+        aggregate.flush()
+    rows = dec.tail(10)
+    assert len(rows) == 4
+    group = rows[1]
+    assert group["count"] == 5 and group["spid"] == 0 and group["after"] == "0701234567" and group["last_ts"] >= group["ts"]
+    assert [e["spid"] for e in group["exemplars"]] == [0, 1, 2] and set(group["exemplars"][0]) == {"ts", "spid"}
+    assert "count" not in rows[2] and rows[2]["after"] == "+46701234567"
+    assert rows[3]["count"] == 2 and rows[3]["weight"] == 4
+    day = group["ts"][:10]
+    assert rollups.query(day)["rules"] == {"phone": {"autocorrect": 5 + 1 + 2 * 4}, "no_delete": {"block": 1}}
+    assert dec._scan("data/metrics/decisions.jsonl")["counts"]["phone"] == {"autocorrect": 8}
+
+
+def test_window_starts_at_the_first_decision(monkeypatch):
+    monkeypatch.setenv("DECISIONS_AGGREGATE_WINDOW_SECONDS", "10")
+    monkeypatch.setenv("DECISIONS_AGGREGATE_MAX_KEYS", "1")
+    written = []
+    t0 = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+
+    def write(rec, first):
+        written.append((rec, first))
+
+    try:
+        assert aggregate.hold(_fix(1), t0, write) and aggregate.hold(_fix(2), t0 + timedelta(seconds=9), write)
+        assert not aggregate.hold(_fix(3, after="x"), t0, write)  # no room for another group
+        assert aggregate.hold(_fix(4), t0 + timedelta(seconds=10), write)  # closes the first window
+        assert [(r["count"], f) for r, f in written] == [(2, t0)]
+    finally:
+        aggregate.flush()
+    assert written[1][0] == _fix(4) and aggregate.pending() == 0
+
+
+def test_sqlite_rollup_counts_aggregated_records(load_decisions):
+    from src.metrics import sqlite_store
+    dec = load_decisions(DECISIONS_SEGMENTS="false", DECISIONS_AGGREGATE_WINDOW_SECONDS="60", DECISIONS_BACKEND="sqlite")
+    try:
+        for spid in range(4):
+            dec.append(_fix(spid))
+        dec.flush()
+        [row] = sqlite_store.tail(5)
+        assert row["count"] == 4
+        assert rollups.query(row["ts"][:10])["rules"] == {"phone": {"autocorrect": 4}}
+    finally:
+        sqlite_store.reset()
@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from src.metrics import binlog, rollups
+
+
+def test_binary_records_round_trip_next_to_jsonl(tmp_path, monkeypatch, load_decisions):
+    dec = load_decisions(DECISIONS_SEGMENTS="false")
+    dec.append({"spid": 51, "action": "block", "rule_id": "r1", "sample": "DELETE x"})
+    monkeypatch.setenv("DECISIONS_FORMAT", "binary")
+    dec.append({"spid": 52, "action": "autocorrect", "rule_id": "r2", "column": "dbo.T.C", "before": "x" * 500, "after": "y", "confidence": 0.5})
+    dec.append({"spid": None, "action": "allow", "rule_id": None, "weight": 4})
+    bin_path = tmp_path / "data/metrics/decisions.bin"
+    assert bin_path.exists() and (tmp_path / "data/metrics/decisions.dict").read_text(encoding="utf-8").splitlines() == ['"r2"', '"autocorrect"', '"dbo.T.C"', '"allow"']
+    rows = dec.tail(10)
+    assert [r["action"] for r in rows] == ["block", "autocorrect", "allow"]
+    assert rows[1]["spid"] == 52 and rows[1]["column"] == "dbo.T.C" and rows[1]["before"] == "x" * 200 and rows[1]["confidence"] == 0.5
+    assert rows[2]["spid"] is None and rows[2]["rule_id"] is None and rows[2]["weight"] == 4
+    assert datetime.fromisoformat(rows[1]["ts"]).tzinfo == timezone.utc
+    day = rows[1]["ts"][:10]
+    assert [r["action"] for r in dec.iter_day(day)] == ["block", "autocorrect", "allow"]
+    assert rollups.query(day)["rules"] == {"r1": {"block": 1}, "r2": {"autocorrect": 1}, "(no_rule)": {"allow": 4}}
+    # a record still being written is neither returned nor counted
+    with open(bin_path, "ab") as f:
+        f.write(binlog.encode({"action": "block", "rule_id": "r3"}, binlog.dictionary(str(bin_path.parent)))[:-3])
+    assert [r["action"] for r in dec.tail(2)] == ["autocorrect", "allow"]
+    rollups.reset()
+    assert "r3" not in rollups.query(day)["rules"]
+
+
+def test_binary_segments_are_indexed_and_compacted(tmp_path, load_decisions):
+    dec = load_decisions(DECISIONS_SEGMENTS="true", DECISIONS_FORMAT="binary", DECISIONS_COMPACT_AFTER_HOURS="1")
+    d = tmp_path / "data/metrics/decisions"
+    d.mkdir(parents=True)
+    dictionary = binlog.dictionary(str(d))
+    for name, rule in (("decisions-20260110T05-000.bin", "a"), ("decisions-20260110T06-000.bin", "b")):
+        (d / name).write_bytes(b"".join(binlog.encode({"ts": f"2026-01-10T0{i}:00:00+00:00", "rule_id": rule, "action": "block"}, dictionary) for i in range(3)))
+    assert dec.maintain(datetime(2026, 1, 11, 3, tzinfo=timezone.utc))["compacted"] == 2
+    idx = dec.index(str(d / "decisions-20260110.bin"))
+    assert idx["lines"] == 6 and idx["counts"] == {"a": {"block": 3}, "b": {"block": 3}} and idx["first_ts"] == "2026-01-10T00:00:00+00:00"
+    assert [x["rule_id"] for x in dec.tail(4)] == ["a", "b", "b", "b"]
+    assert rollups.query("2026-01-10")["rules"] == {"a": {"block": 3}, "b": {"block": 3}}
+
+
+def test_converter_replaces_a_file_without_double_counting(tmp_path, load_decisions):
+    dec = load_decisions(DECISIONS_SEGMENTS="false")
+    from scripts import convert_decisions
+    log = tmp_path / "data/metrics/decisions.jsonl"
+    log.parent.mkdir(parents=True)
+    rows = [{"ts": f"2026-02-0{1 + i % 2}T10:00:00+00:00", "spid": i, "rule_id": f"r{i % 3}", "action": "block", "sample": "UPDATE t"} for i in range(30)]
+    log.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+    before = rollups.query("2026-02-01", "2026-02-02")
+    assert convert_decisions.main([str(log)]) == 0
+    assert not log.exists() and os.path.getsize(tmp_path / "data/metrics/decisions.bin") < 0.6 * len("".join(json.dumps(r) + "\n" for r in rows))
+    assert rollups.query("2026-02-01", "2026-02-02") == before
+    assert dec.tail(30) == rows
+    # and back to JSONL into a separate file
+    out = tmp_path / "copy.jsonl"
+    assert convert_decisions.main([str(tmp_path / "data/metrics/decisions.bin"), str(out)]) == 0
+    assert [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()] == rows
+
+
+def test_timestamps_decode_right_while_threads_cross_hours():
+    base = datetime(2026, 3, 1, 12, 59, 59, 500000, tzinfo=timezone.utc)
+    stamps = [base + timedelta(seconds=i % 2, hours=i % 3) for i in range(6)]
+    bad = []
+
+    def decode_all():
+        for _ in range(2000):
+            for ts in stamps:
+                if binlog._iso(binlog.ts_micros(ts)) != ts.isoformat():
+                    bad.append(ts)
+
+    threads = [threading.Thread(target=decode_all) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert bad == []
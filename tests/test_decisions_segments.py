@@ -0,0 +1,54 @@
+import json
+import os
+from datetime import datetime, timezone
+
+
+def test_tail_reads_newest_segments_then_legacy_file(tmp_path, load_decisions):
+    dec = load_decisions(DECISIONS_SEGMENTS="true", DECISIONS_SEGMENT_MAX_BYTES="300")
+    legacy = tmp_path / "data/metrics/decisions.jsonl"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_text("".join(json.dumps({"ts": "2020-01-01T00:00:00Z", "n": -i}) + "\n" for i in range(3, 0, -1)), encoding="utf-8")
+    for i in range(10):
+        dec.append({"action": "allow", "rule_id": "r1", "n": i})
+    segs = dec.segments()
+    assert len(segs) > 1 and not legacy.read_text(encoding="utf-8").count('"allow"')
+    assert [d["n"] for d in dec.tail(4)] == [6, 7, 8, 9]
+    assert [d["n"] for d in dec.tail(12)] == [-2, -1] + list(range(10))
+    # older parts of the hour are sealed and indexed; the open one is not
+    dec.maintain()
+    idx = dec.index(segs[0]["path"])
+    assert os.path.exists(segs[0]["path"] + ".idx") and not os.path.exists(dec.segments()[-1]["path"] + ".idx")
+    assert idx["offsets"][0] == 0 and idx["counts"] == {"r1": {"allow": idx["lines"]}}
+
+
+def test_compaction_and_retention(tmp_path, load_decisions):
+    dec = load_decisions(DECISIONS_SEGMENTS="true", DECISIONS_COMPACT_AFTER_HOURS="1", DECISIONS_RETENTION_HOURS="48")
+    d = tmp_path / "data/metrics/decisions"
+    d.mkdir(parents=True)
+    for name, rule in (("decisions-20260101T05-000.jsonl", "old"), ("decisions-20260110T05-000.jsonl", "a"), ("decisions-20260110T06-000.jsonl", "b")):
+        (d / name).write_text(json.dumps({"ts": "2026-01-10T05:00:00+00:00", "rule_id": rule, "action": "block"}) + "\n", encoding="utf-8")
+    stats = dec.maintain(datetime(2026, 1, 11, 3, tzinfo=timezone.utc))
+    assert stats == {"removed": 1, "compacted": 2, "indexed": 0}
+    assert sorted(os.listdir(d)) == [".maintain.lock", "decisions-20260110.jsonl", "decisions-20260110.jsonl.idx"]
+    idx = json.loads((d / "decisions-20260110.jsonl.idx").read_text(encoding="utf-8"))
+    assert idx["lines"] == 2 and idx["counts"] == {"a": {"block": 1}, "b": {"block": 1}}
+    assert [x["rule_id"] for x in dec.tail(5)] == ["a", "b"]
+
+
+def test_new_hour_maintenance_runs_off_the_append_path(load_decisions, monkeypatch):
+    import threading
+    dec = load_decisions(DECISIONS_SEGMENTS="true")
+    release = threading.Event()
+    calls = []
+
+    def slow_maintain(now=None):
+        release.wait(5)
+        calls.append(now)
+
+    monkeypatch.setattr(dec, "maintain", slow_maintain)
+    dec.append({"action": "allow", "rule_id": "r1"})  # first append: opens a segment
+    dec.append({"action": "allow", "rule_id": "r1"})
+    assert calls == [] and len(dec.tail(5)) == 2  # the appends did not wait for maintenance
+    release.set()
+    dec.wait_maintenance(5)
+    assert len(calls) == 1
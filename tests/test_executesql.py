@@ -0,0 +1,65 @@
+import struct
+
+from src.tds.sqlparse_simple import parse_param_declarations, map_params_to_columns
+from src.tds.statements import analyze_statement, statement_fingerprint, clear_cache, cache_size
+from src.tds.rpc_parse import parse_rpc_request
+from src.policy.engine import PolicyEngine, Rule
+
+from rpc_payloads import executesql
+
+
+def test_parse_param_declarations():
+    decl = "@p0 nvarchar(4000),@p1 decimal(10, 2) OUTPUT, @p2 int"
+    assert parse_param_declarations(decl) == [("@p0", "nvarchar(4000)"), ("@p1", "decimal(10,2)"), ("@p2", "int")]
+    assert parse_param_declarations("") == []
+
+
+def test_map_params_to_columns_insert_and_update():
+    table, m = map_params_to_columns("INSERT INTO dbo.Users (Email, [Phone]) VALUES (@p0, @P1)")
+    assert table == "dbo.Users"
+    assert m == {"@p0": "dbo.Users.Email", "@p1": "dbo.Users.Phone"}
+    table, m = map_params_to_columns("UPDATE dbo.Users SET Email = @e, Name = 'x' WHERE Id = @id")
+    assert table == "dbo.Users" and m == {"@e": "dbo.Users.Email"}
+    assert map_params_to_columns("SELECT * FROM dbo.Users WHERE Id = @id") == (None, {})
+
+
+def test_analyze_statement_is_cached_by_fingerprint():
+    clear_cache()
+    a = analyze_statement("INSERT INTO dbo.T (A) VALUES (@p0)", "@p0 int")
+    b = analyze_statement("insert  into dbo.T (A)\nVALUES (@p0)", "@p0 int")
+    assert a is b and cache_size() == 1
+    assert statement_fingerprint("SELECT 1 WHERE x = 'a'") == statement_fingerprint("select 2 where x = 'bb'")
+    assert a.column_for("@P0") == "dbo.T.A" and a.param_types == [("@p0", "int")]
+
+
+def test_inspect_executesql_applies_column_rules(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from src.proxy.tds_proxy import _inspect_rpc
+    payload = executesql(
+        "INSERT INTO dbo.Users (Email, Phone) VALUES (@p0, @p1)",
+        "@p0 nvarchar(200),@p1 nvarchar(200)",
+        ("@p0", "a@example.com"),
+        ("@p1", "0701234567"),
+    )
+    engine = PolicyEngine([Rule(id="phone", target="column", selector="dbo.Users.Phone", action="autocorrect")])
+    out = _inspect_rpc(engine, payload, 1, "enforce")
+    req = parse_rpc_request(out)
+    assert req.proc == "sp_executesql"
+    assert [p.value for p in req.params][2:] == ["a@example.com", "+46701234567"]
+
+    blocker = PolicyEngine([Rule(id="users", target="table", selector="dbo.Users", action="block")])
+    assert _inspect_rpc(blocker, payload, 1, "enforce") is None
+    assert _inspect_rpc(blocker, payload, 1, "log") is payload
+
+
+def test_inspect_sql_batch_keeps_all_headers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from src.proxy.tds_proxy import _inspect_sql_batch
+    hdr = struct.pack("<IH", 18, 2) + b"\x00" * 8 + struct.pack("<I", 1)
+    headers = struct.pack("<I", 4 + len(hdr)) + hdr
+    sql = "INSERT INTO dbo.Customers (Phone) VALUES ('0701234567')"
+    payload = headers + sql.encode("utf-16le")
+    engine = PolicyEngine([Rule(id="phone", target="column", selector="dbo.Customers.Phone", action="autocorrect")])
+    out = _inspect_sql_batch(engine, payload, 1, "enforce")
+    assert out.startswith(headers)
+    assert out[len(headers):].decode("utf-16le") == "INSERT INTO dbo.Customers (Phone) VALUES ('+46701234567')"
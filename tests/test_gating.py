@@ -0,0 +1,64 @@
+import json
+
+from src.policy import gating
+from src.policy.engine import PolicyEngine, Rule
+from src.policy.loader import load_rules
+
+
+def test_gate_opens_after_min_hits_without_reading_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GATING_CHECKPOINT_SECONDS", "3600")
+    gating.reset()
+    from src.metrics import store as metrics_store
+    from src.proxy.tds_proxy import _inspect_sql_batch
+
+    def no_scan(rule_id):
+        raise AssertionError("gate check must not scan metrics.json")
+    monkeypatch.setattr(metrics_store, "get_rule_counters", no_scan)
+    engine = PolicyEngine([Rule(id="no-drop", target="pattern", selector="DROP TABLE", action="block", min_hits_to_enforce=3)])
+    payload = "DROP TABLE dbo.Users".encode("utf-16le")
+    out = [_inspect_sql_batch(engine, payload, 1, "enforce") for _ in range(4)]
+    assert out == [payload, payload, None, None]
+    assert gating.snapshot()["promoted"] == ["no-drop"]
+    state = json.loads((tmp_path / "data/metrics/gating.json").read_text(encoding="utf-8"))
+    assert state == {"hits": {"no-drop": 3}, "promoted": ["no-drop"]}  # promotion is checkpointed at once
+    gating.reset()
+
+
+def test_checkpoint_merges_hits_from_other_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GATING_CHECKPOINT_SECONDS", "3600")
+    gating.reset()
+    for _ in range(3):
+        gating.record("r1", "autocorrect")
+    gating.record("r1", "allow")  # not a hit
+    gating.checkpoint()
+    path = tmp_path / "data/metrics/gating.json"
+    # another worker adds its own hits to the shared file meanwhile
+    path.write_text(json.dumps({"hits": {"r1": 5, "r2": 1}, "promoted": []}), encoding="utf-8")
+    gating.record("r1", "block")
+    assert gating.hits("r1") == 4  # no file I/O until the next checkpoint
+    gating.checkpoint()
+    assert gating.hits("r1") == 6 and gating.hits("r2") == 1
+    assert json.loads(path.read_text(encoding="utf-8"))["hits"] == {"r1": 6, "r2": 1}
+    gating.reset()
+
+
+def test_seeded_from_metrics_without_state_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data/metrics").mkdir(parents=True)
+    (tmp_path / "data/metrics/metrics.json").write_text(json.dumps({
+        "rule:r1:block": 2, "rule:r1:allow": 7, "rule:r1:rpc_autocorrect_inplace": 1, "blocks": 2,
+    }), encoding="utf-8")
+    gating.reset()
+    assert gating.hits("r1") == 3
+    assert gating.gated(Rule(id="r1", target="pattern", selector="x", action="block", min_hits_to_enforce=5))
+    assert not gating.gated(Rule(id="r1", target="pattern", selector="x", action="block", min_hits_to_enforce=3))
+    gating.reset()
+
+
+def test_loader_keeps_gating_fields(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps([{"id": "a", "target": "pattern", "selector": "x", "action": "block", "min_hits_to_enforce": 3, "apply_in_envs": ["prod"]}]), encoding="utf-8")
+    rules = load_rules(str(path))
+    assert [(r.id, r.min_hits_to_enforce, r.apply_in_envs) for r in rules] == [("a", 3, ["prod"])]
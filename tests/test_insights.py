@@ -17,3 +17,13 @@ def test_llm_insights_fallback(tmp_path, monkeypatch):
     scripts.main()
     reports = list((tmp_path / 'reports').glob('insights-*.md'))
     assert reports, 'insights report not generated'
+
+
+def test_llm_insights_runs_as_a_script(tmp_path):
+    import os
+    import subprocess
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {k: v for k, v in os.environ.items() if k not in ("PYTHONPATH", "LLM_PROVIDER")}
+    subprocess.run([sys.executable, os.path.join(root, "scripts/llm_insights.py")], cwd=tmp_path, env=env, check=True, capture_output=True)
+    assert list((tmp_path / "reports").glob("insights-*.md"))
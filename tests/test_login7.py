@@ -0,0 +1,69 @@
+import asyncio
+import struct
+
+from src.tds.parser import build_packets, parse_login7, parse_prelogin, type_name
+
+
+def login7(user: str = "etl_loader", app: str = "nightly-etl", database: str = "Sales", read_only: bool = False, packet_size: int = 8192) -> bytes:
+    strings = [("host", "build01"), ("user", user), ("password", ""), ("app", app), ("server", "sql01"), ("ext", ""), ("lib", "pytds"), ("lang", ""), ("db", database)]
+    off = 94
+    table = b""
+    data = b""
+    for _, value in strings:
+        table += struct.pack("<HH", off, len(value))
+        data += value.encode("utf-16le")
+        off += len(value) * 2
+    table += b"\x00" * 6 + struct.pack("<HH", off, 0) * 3 + struct.pack("<I", 0)
+    fixed = struct.pack("<IIIIII", 94 + len(data), 0x74000004, packet_size, 7, 100, 0)
+    fixed += bytes([0xE0, 0x03, 0x20 if read_only else 0x00, 0x00]) + struct.pack("<iI", 0, 0x0409)
+    return struct.pack("<I", 94 + len(data)) + fixed[4:] + table + data
+
+
+def test_parse_login7_fields():
+    info = parse_login7(login7(read_only=True))
+    assert (info.user, info.app, info.database, info.host, info.server) == ("etl_loader", "nightly-etl", "Sales", "build01", "sql01")
+    assert info.packet_size == 8192 and info.read_only_intent and not info.integrated_auth
+    # TLS-wrapped or truncated logins are not decoded
+    assert parse_login7(b"\x17\x03\x03" + b"\x00" * 100) is None
+    assert type_name(0x10) == "Login7" and type_name(0x12) == "PreLogin"
+
+
+def test_parse_prelogin_options():
+    payload = b"\x00\x00\x10\x00\x06" + b"\x01\x00\x16\x00\x01" + b"\x04\x00\x17\x00\x01" + b"\xff" + b"\x0f\x00\x07\xd0\x00\x00" + b"\x02" + b"\x00"
+    assert parse_prelogin(payload) == {"version": "15.0.2000.0", "encryption": "not_supported", "mars": False}
+    assert parse_prelogin(b"\x16\x03\x01\x00") is None
+
+
+def test_allowlisted_session_is_passed_through(tmp_path, monkeypatch, pipe_c2s):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "rules.json").write_text('[{"id": "nodrop", "target": "pattern", "selector": "DROP TABLE", "action": "block"}]', encoding="utf-8")
+    monkeypatch.setenv("RULES_PATH", str(tmp_path / "rules.json"))
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.setenv("ENFORCEMENT_MODE", "enforce")
+    batch = build_packets(0x01, "DROP TABLE dbo.T".encode("utf-16le"))
+    stream = build_packets(0x10, login7()) + batch
+    assert asyncio.run(pipe_c2s(stream)) == build_packets(0x10, login7())  # blocked batch is dropped
+    monkeypatch.setenv("PASSTHROUGH_USERS", "sa, etl_*")
+    assert asyncio.run(pipe_c2s(stream)) == stream
+
+
+def test_events_carry_session_user_and_database():
+    from src.proxy.tds_proxy import _event
+    ev = _event(parse_login7(login7(user="app_user", database="Crm")), "SELECT 1")
+    assert (ev.user, ev.database, ev.sql_text) == ("app_user", "Crm", "SELECT 1")
+    assert _event(None, "x").user is None
+
+
+def test_login_response_updates_database_and_packet_size():
+    from src.proxy.tds_proxy import _expect_response, _on_login, _track_response
+
+    def envchange(typ: int, new: str, old: str) -> bytes:
+        body = bytes([typ, len(new)]) + new.encode("utf-16le") + bytes([len(old)]) + old.encode("utf-16le")
+        return b"\xe3" + struct.pack("<H", len(body)) + body
+
+    conn: dict = {}
+    _on_login(conn, parse_login7(login7()), "conn-test")
+    _expect_response(conn, 0x10, scan=True)
+    response = envchange(1, "Reporting", "Sales") + envchange(4, "4096", "8192") + b"\xfd" + b"\x00" * 12
+    _track_response(conn, build_packets(0x04, response))
+    assert conn["_session"].database == "Reporting" and conn["_packet_size"] == 4096
@@ -85,5 +85,5 @@ def test_metrics_prom_fallback_lines(tmp_path, monkeypatch):
     resp = api.metrics_prom()
     payload = getattr(resp, "body", None) or getattr(resp, "content", None) or resp
     text = payload.decode("utf-8") if hasattr(payload, "decode") else str(payload)
-    assert "sqlumai_metric{key=\"allowed\"} 5" in text
-    assert "sqlumai_metric{key=\"rule\",rule=\"rX\",action=\"block\"} 2" in text
+    assert "sqlumai_events_total{key=\"allowed\"} 5" in text
+    assert "sqlumai_rule_actions_total{rule=\"rX\",action=\"block\"} 2" in text
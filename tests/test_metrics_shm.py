@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+
+from src.metrics import shm
+from src.metrics import store as metrics_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _shm_env(tmp_path, monkeypatch, slots="4096"):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("METRICS_BACKEND", "shm")
+    monkeypatch.setenv("METRICS_SHM_DIR", str(tmp_path / "shm"))
+    monkeypatch.setenv("METRICS_SHM_SLOTS", slots)
+    shm.reset()
+
+
+def test_store_api_unchanged_on_shared_memory(tmp_path, monkeypatch):
+    _shm_env(tmp_path, monkeypatch)
+    metrics_store.inc("allowed")
+    metrics_store.inc_many({"allowed": 2, "blocks": 1})
+    metrics_store.inc_rule_action("r1", "block", 3)
+    assert not os.path.exists("data/metrics/metrics.json")  # nothing went to the JSON file
+    data = metrics_store.get_all()
+    assert data["allowed"] == 3 and data["blocks"] == 1 and data["rule:r1:block"] == 3
+    assert metrics_store.get_rule_counters("r1") == {"block": 3}
+    shm.reset()  # a restarted process with the same pid continues its segment
+    metrics_store.inc("allowed")
+    assert metrics_store.get_all()["allowed"] == 4
+    shm.reset()
+
+
+def test_keys_without_a_slot_fall_back_to_the_file(tmp_path, monkeypatch):
+    _shm_env(tmp_path, monkeypatch, slots="1")
+    metrics_store.inc("allowed")
+    metrics_store.inc("blocks", 2)
+    assert json.loads((tmp_path / "data/metrics/metrics.json").read_text(encoding="utf-8")) == {"blocks": 2}
+    assert metrics_store.get_all() == {"allowed": 1, "blocks": 2}
+    shm.reset()
+
+
+def test_workers_add_up(tmp_path, monkeypatch):
+    _shm_env(tmp_path, monkeypatch)
+    code = "from src.metrics import store\nfor _ in range(500): store.inc_many({'allowed': 1, 'bytes': 10})\n"
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    procs = [subprocess.Popen([sys.executable, "-c", code], env=env) for _ in range(3)]
+    seen = []
+    while any(p.poll() is None for p in procs):
+        snap = shm.snapshot()
+        seen.append(snap)
+    assert all(p.returncode == 0 for p in procs)
+    assert all(s.get("bytes", 0) == 10 * s.get("allowed", 0) for s in seen)  # no torn inc_many
+    assert metrics_store.get_all() == {"allowed": 1500, "bytes": 15000}
+
+
+def test_exited_segments_fold_into_the_base(tmp_path, monkeypatch):
+    _shm_env(tmp_path, monkeypatch)
+    code = "from src.metrics import store\nstore.inc_many({'allowed': 5, 'blocks': 1})\n"
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+    assert len(list((tmp_path / "shm").glob("counters-*.shm"))) == 2
+    metrics_store.inc("allowed")
+    assert metrics_store.get_all() == {"allowed": 11, "blocks": 2}
+    # only the live process keeps a segment; the exited ones are in base.json
+    assert [p.name for p in (tmp_path / "shm").glob("counters-*.shm")] == [f"counters-{os.getpid()}.shm"]
+    assert json.loads((tmp_path / "shm" / "base.json").read_text(encoding="utf-8")) == {"allowed": 10, "blocks": 2}
+    assert shm.fold_exited() == 0 and metrics_store.get_all() == {"allowed": 11, "blocks": 2}
+    shm.reset()
@@ -0,0 +1,86 @@
+import struct
+
+from src.tds.parser import PacketStream, build_packets
+from src.tds.rpc_parse import parse_rpc_request
+from src.tds.tokens import TokenScanner
+from src.policy.engine import PolicyEngine, Rule
+
+from rpc_payloads import COLLATION, int_param, nvarchar_param, rpc
+
+
+def done(token: int, status: int = 0, rows: int = 0) -> bytes:
+    return bytes([token]) + struct.pack("<HHQ", status, 0, rows)
+
+
+def prepexec_response(handle: int, rows: int = 1) -> bytes:
+    colmeta = b"\x81" + struct.pack("<H", 1) + b"\x00" * 6 + b"\xe7" + struct.pack("<H", 100) + COLLATION + b"\x01" + "x".encode("utf-16le")
+    row = b"\xd1" + struct.pack("<H", 4) + "ab".encode("utf-16le")
+    retval = b"\xac" + struct.pack("<H", 0) + b"\x07" + "@handle".encode("utf-16le") + b"\x01" + b"\x00" * 6 + b"\x26\x04\x04" + struct.pack("<i", handle)
+    return colmeta + row * rows + done(0xFF, 0x10, rows) + b"\x79" + struct.pack("<i", 0) + retval + done(0xFE)
+
+
+STMT = "INSERT INTO dbo.Users (Email, Phone) VALUES (@p0, @p1)"
+DECL = "@p0 nvarchar(200),@p1 nvarchar(200)"
+
+
+def test_token_scanner_handles_byte_at_a_time_feeding():
+    scanner = TokenScanner()
+    for b in prepexec_response(42):
+        scanner.feed(bytes([b]))
+    events = scanner.finish()
+    assert ("returnvalue", 0, "@handle", "42") in events
+    assert events[-1] == ("done", 0xFE, 0, 0)
+    assert not scanner.broken
+
+
+def test_token_scanner_reads_sql_variant_rows():
+    colmeta = b"\x81" + struct.pack("<H", 2) + b"\x00" * 6 + b"\x62" + struct.pack("<I", 8016) + b"\x01" + "v".encode("utf-16le")
+    colmeta += b"\x00" * 6 + b"\x26\x04" + b"\x01" + "n".encode("utf-16le")
+    # sql_variant int: 4-byte length, base type, no properties, value; no text pointer
+    row = b"\xd1" + struct.pack("<I", 6) + b"\x38\x00" + struct.pack("<i", 300) + b"\x04" + struct.pack("<i", 1)
+    null_row = b"\xd1" + struct.pack("<I", 0) + b"\x00"
+    scanner = TokenScanner()
+    scanner.feed(colmeta + row + null_row + done(0xFD, 0x10, 2))
+    assert scanner.finish() == [("done", 0xFD, 0x10, 2)]
+    assert not scanner.broken
+
+
+def test_token_scanner_falls_back_to_tail_past_budget():
+    scanner = TokenScanner(max_bytes=64)
+    scanner.feed(prepexec_response(7, rows=200))
+    assert scanner.broken
+    assert ("returnvalue", 0, "@handle", "7") in scanner.finish()
+
+
+def test_packet_stream_splits_headers_across_reads():
+    framed = build_packets(0x04, b"x" * 100, packet_size=48)
+    stream = PacketStream()
+    pieces = stream.feed(framed[:5]) + stream.feed(framed[5:50]) + stream.feed(framed[50:])
+    assert b"".join(p[2] for p in pieces) == b"x" * 100
+    assert [p[3] for p in pieces].count(True) == 3
+    assert pieces[-1][1] & 0x01
+
+
+def test_prepare_execute_unprepare_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from src.proxy.tds_proxy import _expect_response, _inspect_rpc, _track_response
+    engine = PolicyEngine([Rule(id="phone", target="column", selector="dbo.Users.Phone", action="autocorrect")])
+    conn: dict = {}
+    prepexec = rpc(13, int_param("@handle", None, status=1), nvarchar_param("", DECL), nvarchar_param("", STMT), nvarchar_param("", "a@b.se", 200), nvarchar_param("", "0701234567", 200))
+    out = _inspect_rpc(engine, prepexec, 1, "enforce", conn)
+    # Positional values are mapped through the declared parameter names
+    assert parse_rpc_request(out).params[4].value == "+46701234567"
+    _expect_response(conn, 0x03, prepare=conn.pop("_prepare_pending"))
+    framed = build_packets(0x04, prepexec_response(5), packet_size=32)
+    _track_response(conn, framed[:20])
+    _track_response(conn, framed[20:])
+    assert 5 in conn["_prepared"] and not conn["_inflight"]
+
+    execute = rpc(12, int_param("", 5), nvarchar_param("", "c@d.se", 200), nvarchar_param("", "0707654321", 200))
+    out = _inspect_rpc(engine, execute, 1, "enforce", conn)
+    assert [p.value for p in parse_rpc_request(out).params][1:] == ["c@d.se", "+46707654321"]
+
+    _inspect_rpc(engine, rpc(15, int_param("", 5)), 1, "enforce", conn)
+    assert conn["_prepared"] == {}
+    # Unknown handle: parameters are still evaluated by name only
+    assert _inspect_rpc(engine, execute, 1, "enforce", conn) is execute
@@ -0,0 +1,72 @@
+import asyncio
+import importlib
+import threading
+import time
+
+import pytest
+
+from src.runtime import profiler
+
+
+def _burn(stop: threading.Event):
+    x = 0
+    while not stop.is_set():
+        x += sum(range(200))
+    return x
+
+
+def test_profile_finds_the_busy_function():
+    stop = threading.Event()
+    worker = threading.Thread(target=_burn, args=(stop,))
+    worker.start()
+    try:
+        out = profiler.profile(worker.ident, seconds=0.3, hz=200)
+    finally:
+        stop.set()
+        worker.join()
+    assert out["samples"] > 10 and out["hz"] == 200
+    assert out["top_self"][0]["function"].endswith(":_burn")
+    assert any(t["function"].endswith(":_burn") and t["percent"] == 100.0 for t in out["top_total"])
+    line = out["collapsed"].splitlines()[0]
+    stack, count = line.rsplit(" ", 1)
+    assert stack.split(";")[-1].endswith(":_burn") and int(count) > 0
+
+
+def test_profile_is_bounded_and_exclusive(monkeypatch):
+    monkeypatch.setenv("PROFILE_MAX_SECONDS", "0.2")
+    monkeypatch.setenv("PROFILE_MAX_HZ", "50")
+    t0 = time.perf_counter()
+    out = profiler.profile(threading.get_ident(), seconds=30, hz=10000)
+    assert time.perf_counter() - t0 < 1.0 and out["hz"] == 50
+    with profiler._busy:
+        with pytest.raises(profiler.ProfilerBusy):
+            profiler.profile(threading.get_ident(), seconds=0.1)
+    assert not profiler.running()
+
+
+def test_api_profiles_event_loop_thread(monkeypatch):
+    monkeypatch.setenv("DEBUG_PROFILE", "true")
+    try:
+        from fastapi import HTTPException
+    except Exception:  # pragma: no cover
+        pytest.skip("fastapi not installed")
+    api = importlib.import_module("src.api")
+
+    async def go():
+        async def spike():
+            await asyncio.sleep(0.02)
+            busy = time.perf_counter() + 0.2
+            while time.perf_counter() < busy:  # holds the loop, like a runaway inspection
+                sum(range(1000))
+
+        task = asyncio.create_task(spike())
+        out = await api.debug_profile(seconds=0.4, hz=100)
+        await task
+        return out
+
+    out = asyncio.run(go())
+    assert out["samples"] > 0 and ":spike" in out["collapsed"]
+    monkeypatch.delenv("DEBUG_PROFILE")  # opt-in: off by default
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(api.debug_profile(seconds=0.1))
+    assert e.value.status_code == 404
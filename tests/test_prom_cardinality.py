@@ -0,0 +1,32 @@
+from src.metrics import labels
+
+
+def test_rule_labels_fold_into_other_past_the_cap():
+    b = labels.BoundedLabels(2)
+    assert [b.get("r1"), b.get("r2"), b.get("r3"), b.get("r1")] == ["r1", "r2", "other", "r1"]
+    assert len(b) == 2 and b.folded == 1
+
+
+def test_split_key():
+    assert labels.split_key("allowed") == ("allowed", None, None)
+    assert labels.split_key("rule:ns:r1:block") == ("rule", "ns:r1", "block")
+    assert labels.split_key("shadow:r2:allow") == ("shadow", "r2", "allow")
+    assert labels.split_key("breaker_open") == ("breaker_open", None, None)
+
+
+def test_typed_counters_with_cached_children(monkeypatch):
+    try:
+        from src.metrics import prom_registry as pr
+    except Exception:
+        return  # prometheus_client not installed
+    monkeypatch.setattr(labels, "rules", labels.BoundedLabels(1))
+    pr._children.clear()
+    before = pr.rule_actions_counter.labels(rule="other", action="block")._value.get()
+    pr.inc_counter("rule:card-a:block")
+    pr.inc_counter("rule", "card-b", "block", 2)  # past the cap
+    pr.inc_counter("rule", "card-b", "block")
+    pr.inc_counter("allowed")
+    assert ("rule", "card-b", "block") in pr._children
+    assert pr.rule_actions_counter.labels(rule="card-a", action="block")._value.get() == 1
+    assert pr.rule_actions_counter.labels(rule="other", action="block")._value.get() - before == 3
+    assert pr.events_counter.labels(key="allowed")._value.get() >= 1
@@ -18,5 +18,5 @@ def test_prom_histograms_exposed(monkeypatch):
     except Exception:
         text = str(resp)
     # Ensure histogram metric names appear when prometheus_client is installed
-    assert 'sqlumai_bytes' in text or 'sqlumai_metric' in text
-    assert 'sqlumai_latency_ms' in text or 'sqlumai_metric' in text
+    assert 'sqlumai_bytes' in text or 'sqlumai_events_total' in text
+    assert 'sqlumai_latency_ms' in text or 'sqlumai_events_total' in text
@@ -0,0 +1,37 @@
+import importlib
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code, env):
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60)
+    assert out.returncode == 0, out.stderr
+    return out.stdout
+
+
+def test_workers_are_aggregated_through_the_multiprocess_dir(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path / "prom"), PROM_CACHE_SECONDS="0")
+    for n in (2, 3):
+        _run(
+            "from src.metrics import prom_registry as pr\n"
+            f"pr.inc_counter('allowed', by={n}); pr.inc_counter('rule', 'r1', 'block'); pr.connections_gauge.set({n})\n",
+            env,
+        )
+    text = _run("from src import api\nprint(api.metrics_prom().body.decode())", env)
+    assert 'sqlumai_events_total{key="allowed"} 5.0' in text
+    assert 'sqlumai_rule_actions_total{action="block",rule="r1"} 2.0' in text
+
+
+def test_exposition_is_cached_for_the_ttl(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    api = importlib.import_module("src.api")
+    importlib.reload(api)
+    monkeypatch.setenv("PROM_CACHE_SECONDS", "60")
+    calls = []
+    monkeypatch.setattr(api, "_prom_render", lambda: (calls.append(1) or f"n {len(calls)}\n", "text/plain"))
+    assert api.metrics_prom().body == api.metrics_prom().body == b"n 1\n"
+    monkeypatch.setenv("PROM_CACHE_SECONDS", "0")
+    assert api.metrics_prom().body == b"n 2\n"
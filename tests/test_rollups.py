@@ -0,0 +1,93 @@
+import importlib
+import json
+import os
+from datetime import datetime, timezone
+
+from src.metrics import rollups
+
+
+def _setup(tmp_path, monkeypatch, segments=False):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DECISIONS_SEGMENTS", "true" if segments else "false")
+    dec = importlib.import_module("src.metrics.decisions")
+    importlib.reload(dec)
+    rollups.reset()
+    return dec
+
+
+def _write(path, rows, mode="w"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, mode, encoding="utf-8") as f:
+        f.write("".join(json.dumps(r) + "\n" for r in rows))
+
+
+def test_busy_day_is_counted_exactly_and_incrementally(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    log = tmp_path / "data/metrics/decisions.jsonl"
+    _write(log, [{"ts": f"2026-03-01T{h:02d}:00:00Z", "rule_id": "r1", "action": "Block", "sample": "DELETE x"} for h in range(24) for _ in range(500)])
+    _write(log, [{"ts": "2026-03-02T00:00:01Z", "rule_id": "r1", "action": "block", "weight": 10}, {"ts": "2026-03-02T05:00:00Z", "action": "allow"}], "a")
+    assert rollups.query("2026-03-01") == {"rules": {"r1": {"block": 12000}}, "sampled": False}
+    assert rollups.query("2026-03-02") == {"rules": {"r1": {"block": 10}, "(no_rule)": {"allow": 1}}, "sampled": True}
+    assert rollups.query("2026-03-01", "2026-03-02", action="block")["rules"] == {"r1": {"block": 12010}}
+    assert rollups.samples("2026-03-01") == {"r1": ["DELETE x"] * 3}
+    state = json.loads((tmp_path / "data/metrics/rollups.json").read_text(encoding="utf-8"))
+    assert state["sources"]["data/metrics/decisions.jsonl"]["offset"] == os.path.getsize(log)
+    # only the appended line is read next time; a rewritten file is recounted
+    _write(log, [{"ts": "2026-03-02T06:00:00Z", "action": "allow"}], "a")
+    assert rollups.query("2026-03-02")["rules"]["(no_rule)"] == {"allow": 2}
+    _write(log, [{"ts": "2026-03-02T06:00:00Z", "rule_id": "r2", "action": "allow"}])
+    assert rollups.query("2026-03-01", "2026-03-02")["rules"] == {"r2": {"allow": 1}}
+
+
+def test_counts_survive_compaction_and_retention(tmp_path, monkeypatch):
+    dec = _setup(tmp_path, monkeypatch, segments=True)
+    d = tmp_path / "data/metrics/decisions"
+    _write(d / "decisions-20260101T05-000.jsonl", [{"ts": "2026-01-01T05:00:00+00:00", "rule_id": "old", "action": "block"}])
+    _write(d / "decisions-20260110T05-000.jsonl", [{"ts": "2026-01-10T05:00:00+00:00", "rule_id": "a", "action": "block"}] * 2)
+    _write(d / "decisions-20260110T06-000.jsonl", [{"ts": "2026-01-10T06:00:00+00:00", "rule_id": "a", "action": "block"}])
+    assert rollups.query("2026-01-10")["rules"] == {"a": {"block": 3}}
+    monkeypatch.setenv("DECISIONS_COMPACT_AFTER_HOURS", "1")
+    monkeypatch.setenv("DECISIONS_RETENTION_HOURS", "48")
+    assert dec.maintain(datetime(2026, 1, 11, 3, tzinfo=timezone.utc))["compacted"] == 2
+    assert rollups.query("2026-01-01", "2026-01-10")["rules"] == {"old": {"block": 1}, "a": {"block": 3}}
+    _write(d / "decisions-20260110.jsonl", [{"ts": "2026-01-10T07:00:00+00:00", "rule_id": "a", "action": "block"}], "a")
+    assert rollups.query("2026-01-10")["rules"] == {"a": {"block": 4}}
+
+
+def test_dryrun_report_reads_rollups(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    today = datetime.now(timezone.utc).date().isoformat()
+    _write(tmp_path / "data/metrics/decisions.jsonl", [{"ts": today + "T01:00:00Z", "rule_id": "r1", "action": "autocorrect", "sample": "INSERT a"}] * 4)
+    import scripts.generate_dryrun_report as dry
+    importlib.reload(dry)
+    dry.main()
+    text = (tmp_path / f"reports/dryrun-{today}.md").read_text(encoding="utf-8")
+    assert "- autocorrect: 4" in text and "- r1: autocorrect:4" in text and "sample: INSERT a" in text
+
+
+def test_refresher_catches_up_in_a_worker_thread(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+    _setup(tmp_path, monkeypatch)
+    monkeypatch.setenv("ROLLUPS_REFRESH_SECONDS", "0")  # the start-up catch-up only
+    _write(tmp_path / "data/metrics/decisions.jsonl", [{"ts": "2026-03-01T10:00:00Z", "rule_id": "r1", "action": "block"}] * 50)
+    refresh, threads = rollups.refresh, []
+
+    def tracked():
+        threads.append(threading.current_thread())
+        return refresh()
+
+    monkeypatch.setattr(rollups, "refresh", tracked)
+    asyncio.run(rollups.run_rollup_refresher(asyncio.Event()))
+    assert threads and threads[0] is not threading.main_thread()
+    state = json.loads((tmp_path / "data/metrics/rollups.json").read_text(encoding="utf-8"))
+    assert state["sources"]["data/metrics/decisions.jsonl"]["hours"] == {"2026-03-01T10": {"r1": {"block": 50}}}
+
+
+def test_dryrun_report_runs_as_a_script(tmp_path):
+    import subprocess
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONPATH"}
+    subprocess.run([sys.executable, os.path.join(root, "scripts/generate_dryrun_report.py")], cwd=tmp_path, env=env, check=True, capture_output=True)
+    assert list((tmp_path / "reports").glob("dryrun-*.md"))
@@ -30,3 +30,26 @@ def test_build_datetime_and_uuid_and_varbinary():
         assert bytes([marker]) in p
 
 
+
+
+def test_build_round_trips_through_token_parser():
+    from src.tds.rpc_parse import parse_rpc_request
+    from src.tds.rpc_build import template_cache_size
+    params = [
+        ("@Id", "42", "int"),
+        ("Phone", "+46701234567", "nvarchar"),
+        ("@Active", "true", "bit"),
+        ("@Amount", "-12.50", "decimal"),
+        ("@Day", "2024-08-21", "date"),
+        ("@At", "2024-08-21T12:34:56.5", "datetime2"),
+        ("@Key", "550e8400-e29b-41d4-a716-446655440000", "uuid"),
+    ]
+    hdr = b"\x16\x00\x00\x00\x12\x00\x00\x00\x02\x00" + b"\x00" * 8 + b"\x01\x00\x00\x00"
+    req = parse_rpc_request(build_rpc_payload("dbo.SaveCustomer", params, headers=hdr))
+    assert req.proc == "dbo.SaveCustomer" and req.headers == hdr
+    assert [p.name for p in req.params] == ["@Id", "@Phone", "@Active", "@Amount", "@Day", "@At", "@Key"]
+    assert [p.value for p in req.params] == ["42", "+46701234567", "1", "-12.50", "2024-08-21", "2024-08-21T12:34:56.500000", "550e8400-e29b-41d4-a716-446655440000"]
+    # Same signature, different values: the cached template is reused
+    n = template_cache_size()
+    req = parse_rpc_request(build_rpc_payload("dbo.SaveCustomer", [(a, "7" if t == "int" else v, t) for a, v, t in params]))
+    assert template_cache_size() == n and req.params[0].value == "7"
@@ -0,0 +1,87 @@
+import importlib
+import json
+import struct
+
+from src.tds.rpc_parse import parse_rpc_request
+
+
+COLLATION = b"\x09\x04\xd0\x00\x34"
+
+
+def proc_call(proc: str, phone: str) -> bytes:
+    data = phone.encode("utf-16le")
+    return (
+        struct.pack("<H", len(proc)) + proc.encode("utf-16le") + b"\x00\x00"
+        + bytes([3]) + "@Id".encode("utf-16le") + b"\x00\x26\x08\x08" + struct.pack("<q", 7)
+        + bytes([6]) + "@Phone".encode("utf-16le") + b"\x00\xe7" + struct.pack("<H", 64) + COLLATION + struct.pack("<H", len(data)) + data
+    )
+
+
+def load_catalog(tmp_path, monkeypatch):
+    monkeypatch.setenv("RPC_CATALOG_PATH", str(tmp_path / "catalog.json"))
+    from src.tds import rpc_catalog
+    importlib.reload(rpc_catalog)
+    return rpc_catalog
+
+
+def test_catalog_learns_and_persists(tmp_path, monkeypatch):
+    catalog = load_catalog(tmp_path, monkeypatch)
+    req = parse_rpc_request(proc_call("[dbo].[UpdateCustomer]", "0701234567"))
+    for _ in range(3):
+        catalog.observe(req)
+    # System procedures (sp_executesql & co.) carry statement-specific parameters and are skipped
+    catalog.observe(parse_rpc_request(struct.pack("<H", 13) + "sp_executesql".encode("utf-16le") + b"\x00\x00"))
+    assert catalog.lookup("dbo.UpdateCustomer", "id") == "bigint"
+    snap = catalog.snapshot()
+    assert list(snap) == ["dbo.updatecustomer"]
+    assert snap["dbo.updatecustomer"]["phone"]["type"] == "nvarchar" and snap["dbo.updatecustomer"]["phone"]["count"] == 3
+    assert catalog.flush()
+    stored = json.loads((tmp_path / "catalog.json").read_text(encoding="utf-8"))
+    assert stored["dbo.updatecustomer"]["id"]["max_length"] == 8
+    # A fresh process loads the persisted catalog
+    catalog = load_catalog(tmp_path, monkeypatch)
+    assert catalog.lookup("dbo.UpdateCustomer", "@Phone") == "nvarchar"
+
+
+def test_repack_uses_wire_types(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    load_catalog(tmp_path, monkeypatch)
+    monkeypatch.setenv("RPC_REPACK_BUILDER", "true")
+    from src.policy.engine import PolicyEngine, Rule
+    from src.proxy.tds_proxy import _inspect_rpc
+    engine = PolicyEngine([Rule(id="phone", target="column", selector="Phone", action="autocorrect")])
+    payload = proc_call("dbo.UpdateCustomer", "0701234567")
+    # a token-parsed request keeps the exact in-place patch: bigint stays bigint
+    out = parse_rpc_request(_inspect_rpc(engine, payload, 1, "enforce"))
+    assert [p.value for p in out.params] == ["7", "+46701234567"]
+    assert out.params[0].type_info.name == "bigint"
+
+
+def test_repack_keeps_output_params_and_batched_rpcs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    load_catalog(tmp_path, monkeypatch)
+    monkeypatch.setenv("RPC_REPACK_BUILDER", "true")
+    from src.policy.engine import PolicyEngine, Rule
+    from src.proxy.tds_proxy import _inspect_rpc
+    engine = PolicyEngine([Rule(id="phone", target="column", selector="Phone", action="autocorrect")])
+    data = "0701234567".encode("utf-16le")
+    first = (
+        struct.pack("<H", 5) + "dbo.P".encode("utf-16le") + b"\x02\x00"
+        + bytes([6]) + "@Phone".encode("utf-16le") + b"\x00\xe7" + struct.pack("<H", 64) + COLLATION + struct.pack("<H", len(data)) + data
+        + bytes([4]) + "@Out".encode("utf-16le") + b"\x01\x26\x04\x04" + struct.pack("<i", 0)
+    )
+    second = proc_call("dbo.Q", "x")
+    payload = first + b"\xff" + second
+    out = _inspect_rpc(engine, payload, 1, "enforce")
+    req = parse_rpc_request(out)
+    assert req.option_flags == 2 and [p.value for p in req.params] == ["+46701234567", "0"]
+    assert req.params[0].type_info.collation == COLLATION and req.params[0].type_info.max_length == 64
+    assert req.params[1].status == 1 and req.params[1].type_info.name == "int"
+    assert out[req.end:] == b"\xff" + second
+
+
+def test_api_serves_catalog(tmp_path, monkeypatch):
+    catalog = load_catalog(tmp_path, monkeypatch)
+    catalog.observe(parse_rpc_request(proc_call("dbo.P", "1")))
+    api = importlib.import_module("src.api")
+    assert api.rpc_catalog("dbo.p") == {"dbo.p": catalog.snapshot()["dbo.p"]}
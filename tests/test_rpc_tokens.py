@@ -0,0 +1,155 @@
+import struct
+
+from src.tds.parser import build_packets, iter_packets, split_all_headers
+from src.tds.rpc_parse import parse_rpc_request, rewrite_param_values, split_rpc_batch, RpcParseError
+from src.policy.engine import PolicyEngine, Rule
+
+from rpc_payloads import COLLATION, b_varchar, executesql, int_param, nvarchar_param, rpc
+
+
+def all_headers() -> bytes:
+    # Transaction descriptor header (type 2): descriptor + outstanding request count
+    hdr = struct.pack("<IH", 18, 2) + b"\x00" * 8 + struct.pack("<I", 1)
+    return struct.pack("<I", 4 + len(hdr)) + hdr
+
+
+def test_parse_named_proc_with_typed_params():
+    payload = (
+        all_headers()
+        + struct.pack("<H", 18) + "dbo.UpdateCustomer".encode("utf-16le") + b"\x00\x00"
+        + int_param("@CustomerId", 42)
+        + nvarchar_param("@Phone", "070-123 45 67")
+        + nvarchar_param("@Email", None)
+    )
+    req = parse_rpc_request(payload)
+    assert req.proc == "dbo.UpdateCustomer" and req.proc_id is None
+    assert req.headers == all_headers()
+    names = [p.name for p in req.params]
+    assert names == ["@CustomerId", "@Phone", "@Email"]
+    cid, phone, email = req.params
+    assert cid.value == "42" and cid.type_info.name == "int"
+    assert phone.value == "070-123 45 67" and phone.type_info.name == "nvarchar"
+    assert payload[phone.value_offset:phone.value_offset + phone.value_length] == "070-123 45 67".encode("utf-16le")
+    assert email.value is None and email.value_length == -1
+
+
+def test_parse_proc_id_and_rewrite_exact_range():
+    # sp_executesql by id; the same literal appears in @stmt and in @p0
+    stmt = "INSERT INTO dbo.Users (Email) VALUES (@p0) -- x@y"
+    payload = rpc(10, nvarchar_param("", stmt), nvarchar_param("", "@p0 nvarchar(4000)"), nvarchar_param("@p0", "x@y"))
+    req = parse_rpc_request(payload)
+    assert req.proc == "sp_executesql" and req.proc_id == 10
+    assert [p.value for p in req.params] == [stmt, "@p0 nvarchar(4000)", "x@y"]
+
+    new = rewrite_param_values(payload, req, {2: "someone@example.com".encode("utf-16le")})
+    req2 = parse_rpc_request(new)
+    # Only the targeted parameter changed, even though the old value also appears earlier
+    assert req2.params[0].value == stmt
+    assert req2.params[2].value == "someone@example.com"
+
+
+def test_rewrite_rejects_values_over_max_length():
+    payload = struct.pack("<H", 5) + "dbo.p".encode("utf-16le") + b"\x00\x00" + nvarchar_param("@a", "ab", max_len=4)
+    req = parse_rpc_request(payload)
+    try:
+        rewrite_param_values(payload, req, {0: "abc".encode("utf-16le")})
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_parse_legacy_varchar_has_no_collation():
+    legacy = b_varchar("@code") + b"\x00\x27\x10" + b"\x03abc"
+    payload = struct.pack("<H", 5) + "dbo.p".encode("utf-16le") + b"\x00\x00" + legacy + int_param("@n", 9)
+    req = parse_rpc_request(payload)
+    code, n = req.params
+    assert code.type_info.name == "varchar" and code.type_info.collation is None and code.value == "abc"
+    assert n.value == "9" and req.end == len(payload)
+    new = rewrite_param_values(payload, req, {0: b"abcd"})
+    assert [p.value for p in parse_rpc_request(new).params] == ["abcd", "9"]
+
+
+def test_rewrite_plp_value_to_empty():
+    data = "abc".encode("utf-16le")
+    plp = b_varchar("@a") + b"\x00\xe7\xff\xff" + COLLATION + struct.pack("<QI", len(data), len(data)) + data + b"\x00" * 4
+    payload = struct.pack("<H", 5) + "dbo.p".encode("utf-16le") + b"\x00\x00" + plp + int_param("@b", 5)
+    req = parse_rpc_request(payload)
+    new = rewrite_param_values(payload, req, {0: b""})
+    req2 = parse_rpc_request(new)
+    assert new[req2.params[0].span.len_offset:req2.params[1].offset] == struct.pack("<QI", 0, 0)
+    assert [p.value for p in req2.params] == ["", "5"] and req2.end == len(new)
+    grown = rewrite_param_values(new, req2, {0: data})
+    assert [p.value for p in parse_rpc_request(grown).params] == ["abc", "5"]
+
+
+def test_batch_separator_depends_on_tds_version():
+    long_name = "@" + "x" * 127  # 128 characters: its length byte is 0x80
+    payload = struct.pack("<H", 5) + "dbo.p".encode("utf-16le") + b"\x00\x00" + int_param("@a", 1) + nvarchar_param(long_name, "v")
+    req = parse_rpc_request(payload, 0x74000004)
+    assert [p.name for p in req.params] == ["@a", long_name] and req.end == len(payload)
+    assert len(parse_rpc_request(payload).params) == 2  # version unknown: 7.2+
+    legacy = parse_rpc_request(payload, 0x71000001)  # TDS 7.1: 0x80 is BatchFlag
+    assert len(legacy.params) == 1 and payload[legacy.end] == 0x80
+
+
+def test_split_batch_returns_every_rpc():
+    first = all_headers() + struct.pack("<H", 5) + "dbo.p".encode("utf-16le") + b"\x00\x00" + int_param("@a", 1)
+    second = rpc(10, nvarchar_param("", "SELECT 1"))
+    third = struct.pack("<H", 5) + "dbo.q".encode("utf-16le") + b"\x00\x00"
+    parts, rest = split_rpc_batch(first + b"\xff" + second + b"\xfe" + third + b"\xff\x01")
+    assert [(sep, part) for sep, part, _ in parts] == [(b"", first), (b"\xff", second), (b"\xfe", third)]
+    assert [req.proc for _, _, req in parts] == ["dbo.p", "sp_executesql", "dbo.q"]
+    assert parts[0][2].headers == all_headers() and parts[1][2].headers == b""
+    assert parts[1][2].params[0].offset == 6 and rest == b"\xff\x01"
+
+
+def test_parse_rejects_heuristic_text():
+    try:
+        parse_rpc_request("dbo.proc @name='John'".encode("utf-16le"))
+        assert False, "expected RpcParseError"
+    except RpcParseError:
+        pass
+
+
+def test_split_headers_and_build_packets():
+    body = b"\x01\x02" * 5000
+    headers, rest = split_all_headers(all_headers() + body)
+    assert headers == all_headers() and rest == body
+    assert split_all_headers(body) == (b"", body)
+    framed = build_packets(0x03, body, spid=7, packet_size=4096, status=0x08)
+    packets = iter_packets(framed)
+    assert len(packets) == 3
+    assert packets[0][1] == 0x08 and packets[-1][1] & 0x01
+    assert b"".join(p[5] for p in packets) == body
+
+
+def test_proxy_inspect_rpc_autocorrects_typed_param(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("RPC_AUTOCORRECT_INPLACE", "true")
+    from src.proxy.tds_proxy import _inspect_rpc
+    payload = (
+        struct.pack("<H", 18) + "dbo.UpdateCustomer".encode("utf-16le") + b"\x00\x00"
+        + int_param("@CustomerId", 7)
+        + nvarchar_param("@Phone", "0701234567", max_len=64)
+    )
+    engine = PolicyEngine([Rule(id="phone", target="column", selector="Phone", action="autocorrect")])
+    assert _inspect_rpc(engine, payload, 1, "log") is payload
+    out = _inspect_rpc(engine, payload, 1, "enforce")
+    req = parse_rpc_request(out)
+    assert req.params[0].value == "7" and req.params[1].value == "+46701234567"
+
+
+def test_proxy_decides_every_rpc_of_a_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from src.proxy.tds_proxy import _inspect_rpc
+    engine = PolicyEngine([
+        Rule(id="phone", target="column", selector="Phone", action="autocorrect"),
+        Rule(id="no-users", target="pattern", selector="dbo.Users", action="block"),
+    ])
+    first = struct.pack("<H", 5) + "dbo.P".encode("utf-16le") + b"\x00\x00" + int_param("@Id", 7)
+    second = struct.pack("<H", 5) + "dbo.Q".encode("utf-16le") + b"\x00\x00" + nvarchar_param("@Phone", "0701234567", max_len=64)
+    out = _inspect_rpc(engine, first + b"\xff" + second, 1, "enforce")
+    parts, rest = split_rpc_batch(out)
+    assert parts[0][1] == first and [p.value for p in parts[1][2].params] == ["+46701234567"] and rest == b""
+    blocked = executesql("DELETE FROM dbo.Users WHERE Id = @p0", "@p0 int")
+    assert _inspect_rpc(engine, first + b"\xff" + blocked, 1, "enforce") is None
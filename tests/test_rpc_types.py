@@ -10,3 +10,18 @@ def test_load_param_types_ok_and_missing(tmp_path, monkeypatch):
     # missing
     assert load_param_types(str(tmp_path / "no.json")) == {}
 
+
+
+def test_get_param_types_reloads_on_change(tmp_path, monkeypatch):
+    import os
+    from src.tds.rpc_types import get_param_types
+    p = tmp_path / "types.json"
+    p.write_text(json.dumps({"dbo.p": {"@a": "int"}}), encoding="utf-8")
+    monkeypatch.setenv("RPC_PARAM_TYPES_PATH", str(p))
+    monkeypatch.setenv("RPC_PARAM_TYPES_CHECK_SECONDS", "0")
+    first = get_param_types()
+    assert first["dbo.p"]["a"] == "int"
+    assert get_param_types() is first  # unchanged file: no re-parse
+    p.write_text(json.dumps({"dbo.p": {"@a": "bit"}}), encoding="utf-8")
+    os.utime(p, ns=(1, 10**18))
+    assert get_param_types()["dbo.p"]["a"] == "bit"
@@ -0,0 +1,105 @@
+import asyncio
+import importlib
+import json
+import threading
+
+from src.policy.engine import Event, PolicyEngine
+from src.proxy import shadow
+
+
+def _setup(tmp_path, monkeypatch, queue_max="100"):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "config").mkdir()
+    (tmp_path / "config/rules_proposed.json").write_text(json.dumps([
+        {"id": "no-users", "target": "pattern", "selector": "dbo.Users", "action": "block"},
+    ]), encoding="utf-8")
+    monkeypatch.setenv("SHADOW_RULES", "true")
+    monkeypatch.setenv("SHADOW_QUEUE_MAX", queue_max)
+    shadow.reset()
+
+
+def test_proxy_decisions_are_mirrored_to_proposed_rules(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    from src.proxy.tds_proxy import _inspect_sql_batch
+    engine = PolicyEngine([])  # nothing active yet
+    for i in range(3):
+        sql = f"INSERT INTO dbo.Users (Email) VALUES ('u{i}@example.com')"
+        assert _inspect_sql_batch(engine, sql.encode("utf-16le"), 1, "log") is not None
+    assert shadow.snapshot()["queue"] > 0
+    shadow.drain()
+    assert shadow.counters() == {"no-users": {"block": 3}}
+    shadow.flush()
+    metrics = json.loads((tmp_path / "data/metrics/metrics.json").read_text(encoding="utf-8"))
+    assert metrics["shadow:no-users:block"] == 3
+    snap = shadow.snapshot()
+    assert snap["differs"] == 6 and snap["dropped"] == 0  # statement + Email column event per INSERT
+    shadow.reset()
+
+
+def test_full_queue_drops_instead_of_waiting(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch, queue_max="2")
+    ev = Event(database=None, user=None, sql_text="SELECT 1 FROM dbo.Users", table=None, column=None, value=None)
+    assert [shadow.submit(ev) for _ in range(3)] == [True, True, False]
+    assert shadow.snapshot()["dropped"] == 1
+    monkeypatch.setenv("SHADOW_RULES", "false")
+    assert shadow.submit(ev) is False
+    shadow.reset()
+
+
+def test_worker_drains_and_api_reports_side_by_side(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    monkeypatch.setenv("SHADOW_FLUSH_SECONDS", "0")
+    from src.metrics import store as metrics_store
+    metrics_store.inc_rule_action("no-users", "allow", 4)
+    ev = Event(database=None, user=None, sql_text="DELETE FROM dbo.Users", table=None, column=None, value=None)
+    shadow.submit(ev, weight=5)
+
+    async def go():
+        stop = asyncio.Event()
+        task = asyncio.create_task(shadow.run_shadow_worker(stop))
+        await asyncio.sleep(0.1)
+        stop.set()
+        await task
+
+    asyncio.run(go())
+    assert shadow.snapshot()["queue"] == 0
+    api = importlib.import_module("src.api")
+    importlib.reload(api)
+    out = api.rules_shadow()
+    assert out["rules"]["no-users"] == {"active": {"allow": 4}, "proposed": {"block": 5}}
+    shadow.reset()
+
+
+def test_worker_drains_in_capped_ticks_and_flushes_off_the_loop(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    monkeypatch.setenv("SHADOW_FLUSH_SECONDS", "0")
+    monkeypatch.setenv("SHADOW_DRAIN_MAX", "3")
+    from src.metrics import store as metrics_store
+    ev = Event(database=None, user=None, sql_text="DELETE FROM dbo.Users", table=None, column=None, value=None)
+    for _ in range(10):
+        shadow.submit(ev)
+    ticks, writers = [], []
+    real_drain, real_inc_many = shadow.drain, metrics_store.inc_many
+
+    def drain(limit=None):
+        ticks.append(real_drain(limit))
+        return ticks[-1]
+
+    def inc_many(counts):
+        writers.append(threading.current_thread() is threading.main_thread())
+        real_inc_many(counts)
+
+    monkeypatch.setattr(shadow, "drain", drain)
+    monkeypatch.setattr(metrics_store, "inc_many", inc_many)
+
+    async def go():
+        stop = asyncio.Event()
+        task = asyncio.create_task(shadow.run_shadow_worker(stop))
+        await asyncio.sleep(0.1)
+        stop.set()
+        await task
+
+    asyncio.run(go())
+    assert ticks[:4] == [3, 3, 3, 1] and writers and not any(writers)
+    assert metrics_store.get_all()["shadow:no-users:block"] == 10
+    shadow.reset()
@@ -0,0 +1,102 @@
+import importlib
+import os
+import sqlite3
+
+import pytest
+
+from src.metrics import rollups, sqlite_store
+
+
+@pytest.fixture
+def sqlite_env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DECISIONS_BACKEND", "sqlite")
+    monkeypatch.setenv("METRICS_BACKEND", "sqlite")
+    sqlite_store.reset()
+    rollups.reset()
+    dec = importlib.import_module("src.metrics.decisions")
+    importlib.reload(dec)
+    yield dec
+    sqlite_store.reset()
+
+
+def test_decisions_and_counters_go_to_sqlite(sqlite_env):
+    from src.metrics import store as metrics_store
+    dec = sqlite_env
+    for i in range(5):
+        dec.append({"spid": 50 + i % 2, "action": "autocorrect", "rule_id": "email", "column": "dbo.Users.Email", "before": f"A{i}@X", "after": f"a{i}@x"})
+    dec.append({"spid": 51, "action": "block", "rule_id": "no-drop", "sample": "DROP TABLE t", "weight": 4})
+    metrics_store.inc("allowed", 2)
+    metrics_store.inc_rule_action("email", "autocorrect")
+    assert metrics_store.get_all() == {"allowed": 2, "rule:email:autocorrect": 1}
+    assert [d["action"] for d in dec.tail(2)] == ["autocorrect", "block"]
+    assert not os.path.exists("data/metrics/decisions.jsonl") and not os.path.exists("data/metrics/metrics.json")
+    today = dec.tail(1)[0]["ts"][:10]
+    out = rollups.query(today)
+    assert out == {"rules": {"email": {"autocorrect": 5}, "no-drop": {"block": 4}}, "sampled": True}
+    assert rollups.samples(today) == {"email": ["A0@X", "A1@X", "A2@X"], "no-drop": ["DROP TABLE t"]}
+
+
+def test_json_counters_ignore_the_database(sqlite_env, monkeypatch):
+    from src.metrics import store as metrics_store
+    metrics_store.inc_rule_action("r1", "block", 3)
+    assert metrics_store.get_all() == {"rule:r1:block": 3}
+    # decisions stay in SQLite, counters move back to metrics.json: old totals are not added
+    monkeypatch.setenv("METRICS_BACKEND", "json")
+    metrics_store.inc_rule_action("r1", "block")
+    assert sqlite_store.available() and metrics_store.get_all() == {"rule:r1:block": 1}
+
+
+def test_query_endpoint_pages_with_cursor(sqlite_env):
+    dec = sqlite_env
+    for i in range(7):
+        dec.append({"spid": 60, "action": "autocorrect" if i % 2 else "allow", "rule_id": "r1", "column": "dbo.T.C" if i < 5 else None})
+    api = importlib.import_module("src.api")
+    importlib.reload(api)
+    page = api.decisions_query(rule="r1", column="dbo.T.C", limit=2)
+    seen = [d["id"] for d in page["items"]]
+    while page["next_cursor"]:
+        page = api.decisions_query(rule="r1", column="dbo.T.C", limit=2, cursor=page["next_cursor"])
+        seen += [d["id"] for d in page["items"]]
+    assert seen == [5, 4, 3, 2, 1]
+    assert [d["id"] for d in api.decisions_query(action="autocorrect", since="2000-01-01")["items"]] == [6, 4, 2]
+    assert api.decisions_query(until="2000-01-01")["items"] == []
+
+
+def test_query_endpoint_needs_sqlite(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    api = importlib.import_module("src.api")
+    importlib.reload(api)
+    with pytest.raises(api.HTTPException) as e:
+        api.decisions_query()
+    assert e.value.status_code == 404
+
+
+def test_failed_batch_is_retried_once(sqlite_env, monkeypatch, caplog):
+    dec = sqlite_env
+    real, calls = sqlite_store._write_batch, []
+
+    def flaky(conn, items, kept):
+        calls.append(len(items))
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        real(conn, items, kept)
+
+    monkeypatch.setattr(sqlite_store, "_write_batch", flaky)
+    dec.append({"spid": 70, "action": "block", "rule_id": "r1", "sample": "DELETE FROM t"})
+    assert [d["spid"] for d in dec.tail(5)] == [70] and len(calls) == 2
+    assert sqlite_store._writer.errors == 0 and "retrying once" in caplog.text
+    assert sqlite_store.samples(dec.tail(1)[0]["ts"][:10]) == {"r1": ["DELETE FROM t"]}
+
+
+def test_sample_counts_only_keep_the_newest_day(tmp_path):
+    conn = sqlite_store._connect(str(tmp_path / "s.db"))
+    kept = {}
+    for day in ("2026-03-01", "2026-03-01", "2026-03-02"):
+        sqlite_store._write_batch(conn, [("d", {"ts": f"{day}T10:00:00+00:00", "rule_id": "r1", "action": "block", "sample": "x"})], kept)
+    assert kept == {("2026-03-02", "r1"): 1}
+    # a late record for an earlier day reads its count from the table again
+    sqlite_store._write_batch(conn, [("d", {"ts": "2026-03-01T11:00:00+00:00", "rule_id": "r1", "action": "block", "sample": "y"})], kept)
+    seqs = [seq for (seq,) in conn.execute("SELECT seq FROM rollup_samples WHERE day = '2026-03-01' ORDER BY seq")]
+    assert seqs == [0, 1, 2]
+    conn.close()
@@ -0,0 +1,47 @@
+import asyncio
+import random
+
+from src.metrics import stage_timing
+from src.metrics.stage_timing import HdrHistogram
+from src.tds.parser import build_packets
+
+
+def test_hdr_histogram_quantiles_within_two_percent():
+    rnd = random.Random(7)
+    vals = sorted(rnd.randint(1, 50_000_000) for _ in range(20000))
+    h = HdrHistogram()
+    for v in vals:
+        h.record(v)
+    for q in (0.5, 0.9, 0.99, 0.999):
+        exact = vals[int(q * len(vals)) - 1]
+        assert abs(h.quantile(q) - exact) / exact < 0.02
+    assert h.quantile(1.0) == vals[-1] and HdrHistogram().quantile(0.5) is None
+
+
+def test_proxy_records_stages_per_statement_kind(tmp_path, monkeypatch, pipe_c2s):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "rules.json").write_text('[{"id": "email", "target": "column", "selector": "dbo.Users.Email", "action": "autocorrect"}]', encoding="utf-8")
+    monkeypatch.setenv("RULES_PATH", str(tmp_path / "rules.json"))
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.setenv("ENFORCEMENT_MODE", "enforce")
+    monkeypatch.setenv("STAGE_TIMING", "true")
+    stage_timing.reset()
+    asyncio.run(pipe_c2s(build_packets(0x01, "INSERT INTO dbo.Users (Email) VALUES (' Someone@Example.COM ')".encode("utf-16le"))))
+    stages = stage_timing.snapshot()["stages"]
+    for stage in ("decode", "parse", "match", "normalize", "rewrite"):
+        assert stages[stage]["sql_batch"]["count"] >= 1, stage
+    assert set(stages["framing"]) == {"all"} and stages["write"]["all"]["count"] == 1
+    row = stages["match"]["sql_batch"]
+    assert row["p50_us"] <= row["p90_us"] <= row["p99_us"] <= row["p999_us"] <= row["max_us"]
+    stage_timing.configure(False)
+    stage_timing.reset()
+
+
+def test_disabled_timing_records_nothing(tmp_path, monkeypatch, pipe_c2s):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ENABLE_TDS_PARSER", "true")
+    monkeypatch.delenv("STAGE_TIMING", raising=False)
+    stage_timing.reset()
+    asyncio.run(pipe_c2s(build_packets(0x01, "SELECT 1".encode("utf-16le"))))
+    assert stage_timing.snapshot() == {"enabled": False, "stages": {}}
+    assert stage_timing.span("match") is stage_timing.span("decode")  # shared no-op
@@ -0,0 +1,67 @@
+import struct
+
+import pytest
+
+from src.metrics import stmt_stats
+from src.tds.parser import build_packets
+
+
+def done(token: int, status: int, rows: int) -> bytes:
+    return bytes([token]) + struct.pack("<HHQ", status, 0, rows)
+
+
+def error_token(number: int, msg: str) -> bytes:
+    body = struct.pack("<iBB", number, 1, 16) + struct.pack("<H", len(msg)) + msg.encode("utf-16le")
+    body += b"\x00" + b"\x00" + struct.pack("<i", 1)  # server name, proc name, line number
+    return b"\xaa" + struct.pack("<H", len(body)) + body
+
+
+def test_record_and_summaries(monkeypatch):
+    stmt_stats.clear()
+    monkeypatch.setenv("STMT_STATS_MAX", "2")
+    for ms in (1, 3, 4, 900):
+        stmt_stats.record("a", "SELECT 1", ms, rows=10)
+    stmt_stats.record("b", "SELECT 2", 20, error="208: Invalid object name")
+    top = stmt_stats.top(sort="count")
+    assert [r["fingerprint"] for r in top] == ["a", "b"]
+    a = top[0]
+    assert a["count"] == 4 and a["rows"] == 40 and a["max_ms"] == 900 and a["p50_ms"] == 5 and a["p99_ms"] == 900
+    assert stmt_stats.get("b")["errors"] == 1
+    stmt_stats.record("c", "SELECT 3", 1)  # bounded: least recently seen is evicted
+    assert stmt_stats.get("a") is None and stmt_stats.get("c") is not None
+
+
+def test_proxy_matches_responses_to_statements(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from src.policy.engine import PolicyEngine
+    from src.proxy.tds_proxy import _expect_response, _inspect_sql_batch, _track_response
+    from src.tds.statements import statement_fingerprint
+    stmt_stats.clear()
+    engine = PolicyEngine([])
+    conn: dict = {}
+    for sql in ("SELECT * FROM dbo.T WHERE id = 1", "SELECT * FROM dbo.Missing"):
+        _inspect_sql_batch(engine, sql.encode("utf-16le"), 1, "log", conn)
+        _expect_response(conn, 0x01, stmt=conn.pop("_stmt"))
+    ok = b"\x81\xff\xff" + done(0xFD, 0x10, 3)
+    failed = error_token(208, "Invalid object name 'dbo.Missing'.") + done(0xFD, 0x02, 0)
+    framed = build_packets(0x04, ok) + build_packets(0x04, failed)
+    _track_response(conn, framed[:9])
+    _track_response(conn, framed[9:])
+    hit = stmt_stats.get(statement_fingerprint("SELECT * FROM dbo.T WHERE id = 2"))
+    assert hit["count"] == 1 and hit["rows"] == 3 and hit["errors"] == 0
+    miss = stmt_stats.get(statement_fingerprint("SELECT * FROM dbo.Missing"))
+    assert miss["errors"] == 1 and miss["last_error"].startswith("208: Invalid object name")
+
+
+def test_api_statement_stats():
+    try:
+        from fastapi import HTTPException
+    except Exception:  # pragma: no cover
+        pytest.skip("fastapi not installed")
+    from src import api
+    stmt_stats.clear()
+    stmt_stats.record("f1", "SELECT 1", 2.5, rows=1)
+    assert api.statement_stats(limit=10)[0]["fingerprint"] == "f1"
+    assert api.statement_stats_detail("f1")["latency_buckets_ms"]["5"] == 1
+    with pytest.raises(HTTPException):
+        api.statement_stats_detail("nope")